@@ -1,40 +1,135 @@
+import importlib
+from typing import Any, Dict, List
+
 from .analysis import (
+    ActivityIndex,
+    AsyncMarketDataProvider,
+    CompactTimeline,
+    TimelineDelta,
     TimelineEntry,
     activityAffectsSymbol,
+    compactTimelineForSymbol,
+    compactTimelinesForAllSymbols,
     convertCashToCurrency,
     currencyConversionRates,
+    currencyConversionRatesAsync,
     deduplicatePositions,
+    fetchQuotesAsync,
     liveValuesForPositions,
+    liveValuesForPositionsAsync,
     normalizeInstrument,
     normalizeSymbol,
     realizedBasisForSymbol,
+    streamLiveValuesForPositions,
+    streamQuotes,
+    symbolsAffectedByActivity,
     timelineForSymbol,
+    timelinesForAllSymbols,
 )
-from .portfolio import (
-    delta,
-    etf,
-    holdings,
-    portfolio_to_returns,
-    positions_and_history_to_returns,
-    positions_to_dataframe,
-    positions_to_history,
-    positions_to_portfolio,
-    positions_to_returns,
-    prices_to_daily_returns,
-    stocks_to_portfolio,
+from .aggregation import CashSum, sumCash, sumPositions, sumPositionsByInstrument
+from .checkpoint import (
+    BackdatedActivityError,
+    CheckpointStore,
+    SymbolCheckpoint,
+    updateCheckpoint,
 )
+from .fx import CurrencyGraph, FxRateTable, FxRefreshPolicy
+from .ibkr import IBMarketDataProvider
+from .parallel import SymbolAnalysis, analyzeSymbols
+
+# Names from modules which import pandas, pyfolio, and friends, which are
+# slow to load. These are imported on first use (see __getattr__ below), so
+# that callers which don't need them (like most CLI commands) start quickly.
+_lazyNames: Dict[str, str] = {
+    "ActivityFrame": ".frame",
+    "AsyncCachingMarketDataProvider": ".caching",
+    "CachingMarketDataProvider": ".caching",
+    "HistoricalBarCache": ".history",
+    "HistoryReport": ".history",
+    "HistoryResult": ".history",
+    "fetchHistoricalData": ".history",
+    "fetchHistory": ".history",
+    "fetchHistoryAsync": ".history",
+    "PanelAlignment": ".panel",
+    "PricePanel": ".panel",
+    "bars_to_panel": ".panel",
+    "delta": ".portfolio",
+    "etf": ".portfolio",
+    "holdings": ".portfolio",
+    "portfolio_to_returns": ".portfolio",
+    "positions_and_history_to_returns": ".portfolio",
+    "positions_to_dataframe": ".portfolio",
+    "positions_to_history": ".portfolio",
+    "positions_to_panel": ".portfolio",
+    "positions_to_portfolio": ".portfolio",
+    "positions_to_returns": ".portfolio",
+    "prices_to_daily_returns": ".portfolio",
+    "stocks_to_portfolio": ".portfolio",
+    "timelines_to_dataframe": ".portfolio",
+}
+
+
+def __getattr__(name: str) -> Any:
+    module = _lazyNames.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals().keys()) | set(_lazyNames.keys()))
+
 
 __all__ = [
     "normalizeSymbol",
     "normalizeInstrument",
     "activityAffectsSymbol",
+    "symbolsAffectedByActivity",
+    "ActivityIndex",
+    "ActivityFrame",
     "realizedBasisForSymbol",
     "TimelineEntry",
     "timelineForSymbol",
+    "TimelineDelta",
+    "CompactTimeline",
+    "compactTimelineForSymbol",
+    "timelinesForAllSymbols",
+    "compactTimelinesForAllSymbols",
+    "SymbolCheckpoint",
+    "BackdatedActivityError",
+    "CheckpointStore",
+    "updateCheckpoint",
+    "SymbolAnalysis",
+    "analyzeSymbols",
     "liveValuesForPositions",
+    "AsyncMarketDataProvider",
+    "IBMarketDataProvider",
+    "fetchQuotesAsync",
+    "streamQuotes",
+    "streamLiveValuesForPositions",
+    "liveValuesForPositionsAsync",
     "deduplicatePositions",
+    "CashSum",
+    "sumCash",
+    "sumPositions",
+    "sumPositionsByInstrument",
     "currencyConversionRates",
+    "currencyConversionRatesAsync",
+    "CachingMarketDataProvider",
+    "AsyncCachingMarketDataProvider",
     "convertCashToCurrency",
+    "CurrencyGraph",
+    "FxRateTable",
+    "FxRefreshPolicy",
+    "HistoricalBarCache",
+    "HistoryResult",
+    "HistoryReport",
+    "fetchHistoricalData",
+    "fetchHistory",
+    "fetchHistoryAsync",
     "etf",
     "portfolio_to_returns",
     "prices_to_daily_returns",
@@ -42,8 +137,13 @@ __all__ = [
     "positions_to_returns",
     "positions_and_history_to_returns",
     "positions_to_portfolio",
+    "positions_to_panel",
     "positions_to_history",
     "holdings",
     "delta",
     "stocks_to_portfolio",
+    "PanelAlignment",
+    "PricePanel",
+    "bars_to_panel",
+    "timelines_to_dataframe",
 ]
@@ -0,0 +1,193 @@
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional
+
+from bankroll.model import Cash, Currency, Instrument, Position
+
+# Cash and position quantities are always quantized (see Cash.quantize() and
+# Position.quantizeQuantity()), so they can be summed exactly as integer
+# multiples of the quantization, instead of creating a new Decimal and Cash
+# (with currency checks and requantization) at every step of a
+# reduce(operator.add, ...).
+#
+# These scales are powers of ten with a coefficient of 1, so multiplying by
+# them never rounds.
+_cashScale = Decimal(1) / Cash.quantization
+_quantityScale = Decimal(1) / Position.quantityQuantization
+
+
+def _currencyMismatch(a: Cash, b: Cash) -> ValueError:
+    # Matches the error from Cash arithmetic.
+    return ValueError(f"Currency of {a} must match {b} for arithmetic")
+
+
+# A running total of Cash in a single currency, kept as an integer number of
+# Cash.quantization units.
+#
+# The currency is fixed by the first Cash added or subtracted, if not given
+# up front. Afterward, mixing in any other currency raises ValueError, as Cash
+# arithmetic does.
+class CashSum:
+    __slots__ = ("_currency", "_units")
+
+    def __init__(self, currency: Optional[Currency] = None):
+        self._currency = currency
+        self._units = 0
+        super().__init__()
+
+    @property
+    def currency(self) -> Optional[Currency]:
+        return self._currency
+
+    def _check(self, cash: Cash) -> None:
+        if self._currency is None:
+            self._currency = cash.currency
+        elif cash.currency is not self._currency:
+            raise _currencyMismatch(self.total or cash, cash)
+
+    def add(self, cash: Cash) -> None:
+        self._check(cash)
+        self._units += int(cash.quantity * _cashScale)
+
+    def subtract(self, cash: Cash) -> None:
+        self._check(cash)
+        self._units -= int(cash.quantity * _cashScale)
+
+    # Adds an arbitrary quantity in this sum's currency, after quantizing it
+    # as Cash(currency=..., quantity=quantity) would.
+    def addQuantity(self, quantity: Decimal) -> None:
+        if self._currency is None:
+            raise ValueError("Currency must be known to add a bare quantity")
+
+        self._units += int(Cash.quantize(quantity) * _cashScale)
+
+    # The sum so far, or None if nothing has been added (and no currency was
+    # given).
+    @property
+    def total(self) -> Optional[Cash]:
+        if self._currency is None:
+            return None
+
+        return Cash(currency=self._currency, quantity=Decimal(self._units) / _cashScale)
+
+    def __repr__(self) -> str:
+        return f"CashSum({self.total!r})"
+
+
+# Equivalent to reduce(operator.add, cash), but much faster for long
+# sequences. Returns None if `cash` is empty.
+def sumCash(cash: Iterable[Cash]) -> Optional[Cash]:
+    it = iter(cash)
+    first = next(it, None)
+    if first is None:
+        return None
+
+    # Inlined from CashSum, as this is the hottest loop.
+    currency = first.currency
+    units = int(first.quantity * _cashScale)
+    for c in it:
+        if c.currency is not currency:
+            raise _currencyMismatch(
+                Cash(currency=currency, quantity=Decimal(units) / _cashScale), c
+            )
+
+        units += int(c.quantity * _cashScale)
+
+    return Cash(currency=currency, quantity=Decimal(units) / _cashScale)
+
+
+# Equivalent to reduce(operator.add, positions), but much faster for many
+# positions, as quantities and cost bases are summed as integers.
+#
+# Like adding Position objects, this raises ValueError if the positions are in
+# different instruments, or if any partial sum has a quantity of zero with a
+# nonzero cost basis.
+def sumPositions(positions: Iterable[Position]) -> Position:
+    it = iter(positions)
+    first = next(it, None)
+    if first is None:
+        raise ValueError("Cannot sum an empty sequence of positions")
+
+    instrument = first.instrument
+    quantity = int(first.quantity * _quantityScale)
+    costBasis = int(first.costBasis.quantity * _cashScale)
+    combined = False
+
+    for p in it:
+        if p.instrument is not instrument and p.instrument != instrument:
+            raise ValueError(
+                f"Cannot combine positions in two different instruments: {instrument} and {p.instrument}"
+            )
+
+        quantity += int(p.quantity * _quantityScale)
+        costBasis += int(p.costBasis.quantity * _cashScale)
+        combined = True
+
+        if quantity == 0 and costBasis != 0:
+            partialBasis = Cash(
+                currency=first.costBasis.currency,
+                quantity=Decimal(costBasis) / _cashScale,
+            )
+            raise ValueError(
+                f"Cost basis {partialBasis!r} should be zero if quantity is zero"
+            )
+
+    if not combined:
+        return first
+
+    return Position(
+        instrument=instrument,
+        quantity=Decimal(quantity) / _quantityScale,
+        costBasis=Cash(
+            currency=first.costBasis.currency, quantity=Decimal(costBasis) / _cashScale
+        ),
+    )
+
+
+# Equivalent to applying sumPositions() to each group of positions sharing an
+# instrument, but in a single pass over `positions` (which may be a generator)
+# without sorting or materializing them.
+#
+# Returns one position per instrument, in order of each instrument's first
+# appearance. Raises ValueError under the same conditions as sumPositions(),
+# as partial sums are accumulated in input order within each instrument.
+def sumPositionsByInstrument(positions: Iterable[Position]) -> List[Position]:
+    # Per instrument: [first position, quantity units, cost basis units, combined].
+    sums: Dict[Instrument, List[Any]] = {}
+
+    for p in positions:
+        entry = sums.get(p.instrument)
+        if entry is None:
+            sums[p.instrument] = [
+                p,
+                int(p.quantity * _quantityScale),
+                int(p.costBasis.quantity * _cashScale),
+                False,
+            ]
+            continue
+
+        entry[1] += int(p.quantity * _quantityScale)
+        entry[2] += int(p.costBasis.quantity * _cashScale)
+        entry[3] = True
+
+        if entry[1] == 0 and entry[2] != 0:
+            partialBasis = Cash(
+                currency=entry[0].costBasis.currency,
+                quantity=Decimal(entry[2]) / _cashScale,
+            )
+            raise ValueError(
+                f"Cost basis {partialBasis!r} should be zero if quantity is zero"
+            )
+
+    return [
+        Position(
+            instrument=instrument,
+            quantity=Decimal(quantity) / _quantityScale,
+            costBasis=Cash(
+                currency=first.costBasis.currency,
+                quantity=Decimal(costBasis) / _cashScale,
+            ),
+        )
+        if combined
+        else first
+        for instrument, (first, quantity, costBasis, combined) in sums.items()
+    ]
@@ -1,11 +1,28 @@
+import asyncio
 import operator
 import re
+from abc import abstractmethod
+from concurrent.futures import Executor, ThreadPoolExecutor
 from dataclasses import dataclass, replace
 from datetime import datetime
 from decimal import Decimal
 from functools import reduce
-from itertools import groupby
-from typing import Dict, Iterable, Optional, Sequence, Tuple
+from typing import (
+    AbstractSet,
+    Any,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+    overload,
+)
+from warnings import warn
 
 from progress.bar import Bar  # type: ignore
 
@@ -24,6 +41,9 @@ from bankroll.model import (
     Trade,
 )
 
+from . import ibkr
+from .aggregation import CashSum, sumPositionsByInstrument
+
 
 # Different brokers represent "identical" symbols differently, and they can all
 # be valid. This function normalizes them so they can be compared across time
@@ -69,6 +89,102 @@ def activityAffectsSymbol(activity: Activity, symbol: str) -> bool:
         return False
 
 
+# Returns the normalized symbols that the given Activity concerns. This is
+# the set of symbols for which activityAffectsSymbol() would return True.
+def symbolsAffectedByActivity(activity: Activity) -> AbstractSet[str]:
+    if isinstance(activity, CashPayment):
+        if activity.instrument is None:
+            return frozenset()
+
+        return frozenset([normalizeSymbol(activity.instrument.symbol)])
+    elif isinstance(activity, Trade):
+        if isinstance(activity.instrument, Option):
+            return frozenset(
+                [
+                    normalizeSymbol(activity.instrument.symbol),
+                    normalizeSymbol(activity.instrument.underlying),
+                ]
+            )
+
+        return frozenset([normalizeSymbol(activity.instrument.symbol)])
+    else:
+        return frozenset()
+
+
+# Buckets activity by each normalized symbol it affects (including the
+# underlying of options), in a single pass over the history. Each bucket is
+# kept sorted by date.
+#
+# Analyses which are run for many symbols should build one index and reuse it,
+# instead of rescanning and renormalizing the full history per symbol.
+class ActivityIndex:
+    def __init__(self, activity: Iterable[Activity]):
+        activityBySymbol: Dict[str, List[Activity]] = {}
+        optionSymbols: Set[str] = set()
+        for a in activity:
+            for symbol in symbolsAffectedByActivity(a):
+                activityBySymbol.setdefault(symbol, []).append(a)
+
+            if isinstance(a, Trade) and isinstance(a.instrument, Option):
+                optionSymbols.add(normalizeSymbol(a.instrument.symbol))
+
+        for bucket in activityBySymbol.values():
+            bucket.sort(key=lambda t: t.date)
+
+        self._activityBySymbol = activityBySymbol
+        self._optionSymbols = frozenset(optionSymbols)
+        super().__init__()
+
+    # All normalized symbols which have at least one affecting activity.
+    @property
+    def symbols(self) -> AbstractSet[str]:
+        return self._activityBySymbol.keys()
+
+    # Like `symbols`, but without the symbols of option contracts themselves,
+    # as their activity is already traced under their underlying symbol.
+    @property
+    def underlyingSymbols(self) -> AbstractSet[str]:
+        return self._activityBySymbol.keys() - self._optionSymbols
+
+    # Returns the activity affecting the given symbol, sorted by date.
+    def activityForSymbol(self, symbol: str) -> Sequence[Activity]:
+        return self._activityBySymbol.get(normalizeSymbol(symbol), [])
+
+    # Calculates realizedBasisForSymbol() for every symbol in the index.
+    def realizedBasisForAllSymbols(self) -> Dict[str, Cash]:
+        result: Dict[str, Cash] = {}
+        for symbol, activity in self._activityBySymbol.items():
+            basis = _realizedBasis(activity)
+            if basis is not None:
+                result[symbol] = basis
+
+        return result
+
+
+def _activityForSymbol(
+    symbol: str, activity: Union[Iterable[Activity], ActivityIndex]
+) -> Iterable[Activity]:
+    if isinstance(activity, ActivityIndex):
+        return activity.activityForSymbol(symbol)
+    else:
+        return (t for t in activity if activityAffectsSymbol(t, symbol))
+
+
+def _realizedBasis(activity: Iterable[Activity]) -> Optional[Cash]:
+    basis = CashSum()
+    for a in activity:
+        if isinstance(a, CashPayment):
+            basis.subtract(a.proceeds)
+        elif isinstance(a, Trade):
+            # Equivalent to subtracting the trade's proceeds.
+            basis.subtract(a.amount)
+            basis.add(a.fees)
+        else:
+            raise ValueError(f"Unexpected type of activity: {a}")
+
+    return basis.total
+
+
 # Calculates the "realized" basis for a particular symbol, given a trade
 # history. This refers to the actual amounts paid in and out, including
 # dividend payments, as well as money gained or lost on derivatives related to
@@ -78,16 +194,12 @@ def activityAffectsSymbol(activity: Activity, symbol: str) -> bool:
 # "gains," where cost basis gets reduced over time as proceeds are paid out.
 # This is not how the tax accounting works, of course, but it provides a
 # different view into the return/profitability of an investment.
-def realizedBasisForSymbol(symbol: str, activity: Iterable[Activity]) -> Optional[Cash]:
-    def f(basis: Optional[Cash], activity: Activity) -> Optional[Cash]:
-        if isinstance(activity, CashPayment):
-            return basis - activity.proceeds if basis else -activity.proceeds
-        elif isinstance(activity, Trade):
-            return basis - activity.proceeds if basis else -activity.proceeds
-        else:
-            raise ValueError(f"Unexpected type of activity: {activity}")
-
-    return reduce(f, (t for t in activity if activityAffectsSymbol(t, symbol)), None)
+#
+# `activity` may be an ActivityIndex, to avoid rescanning the full history.
+def realizedBasisForSymbol(
+    symbol: str, activity: Union[Iterable[Activity], ActivityIndex]
+) -> Optional[Cash]:
+    return _realizedBasis(_activityForSymbol(symbol, activity))
 
 
 @dataclass(frozen=True)
@@ -109,17 +221,59 @@ class TimelineEntry:
         )
 
 
-# Traces position sizing and profit/loss of a particular symbol over a period
-# of activity. Yields a TimelineEntry corresponding to each action that
-# occurred to the given symbol, starting from the oldest and ending with the
-# most recent.
-def timelineForSymbol(symbol: str, a: Iterable[Activity]) -> Iterable[TimelineEntry]:
-    realizedProfit: Optional[Cash] = None
-    positions: Dict[Instrument, Decimal] = {}
-
-    for t in sorted(
-        (t for t in a if activityAffectsSymbol(t, symbol)), key=lambda t: t.date
+# A single step in a symbol's timeline, recording only what changed: the
+# (normalized) instrument whose position moved, if any, and by how much, along
+# with the cumulative realized profit as of this step.
+#
+# These are far smaller than TimelineEntry, which carries a full copy of all
+# open positions, so long histories can be kept in memory as a CompactTimeline.
+class TimelineDelta:
+    __slots__ = ("date", "instrument", "quantity", "realizedProfit")
+
+    def __init__(
+        self,
+        date: datetime,
+        instrument: Optional[Instrument],
+        quantity: Decimal,
+        realizedProfit: Cash,
     ):
+        self.date = date
+        self.instrument = instrument
+        self.quantity = quantity
+        self.realizedProfit = realizedProfit
+        super().__init__()
+
+    def applyTo(self, positions: Dict[Instrument, Decimal]) -> None:
+        if self.instrument is None:
+            return
+
+        newPosition = positions.get(self.instrument, Decimal(0)) + self.quantity
+        if newPosition == Decimal(0):
+            del positions[self.instrument]
+        else:
+            positions[self.instrument] = newPosition
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, TimelineDelta):
+            return (
+                self.date == other.date
+                and self.instrument == other.instrument
+                and self.quantity == other.quantity
+                and self.realizedProfit == other.realizedProfit
+            )
+        else:
+            return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"TimelineDelta(date={self.date!r}, instrument={self.instrument!r}, quantity={self.quantity!r}, realizedProfit={self.realizedProfit!r})"
+
+
+# `realizedProfit` is the profit realized before `activity`, when continuing a
+# timeline from a checkpoint.
+def _timelineDeltas(
+    activity: Iterable[Activity], realizedProfit: Optional[Cash] = None
+) -> Iterator[TimelineDelta]:
+    for t in activity:
         if isinstance(t, CashPayment) or isinstance(t, Trade):
             proceeds = t.proceeds
         else:
@@ -131,34 +285,196 @@ def timelineForSymbol(symbol: str, a: Iterable[Activity]) -> Iterable[TimelineEn
             realizedProfit = proceeds
 
         if isinstance(t, Trade):
-            instrument = normalizeInstrument(t.instrument)
+            yield TimelineDelta(
+                date=t.date,
+                instrument=normalizeInstrument(t.instrument),
+                quantity=t.quantity,
+                realizedProfit=realizedProfit,
+            )
+        else:
+            yield TimelineDelta(
+                date=t.date,
+                instrument=None,
+                quantity=Decimal(0),
+                realizedProfit=realizedProfit,
+            )
 
-            newPosition = positions.get(instrument, Decimal(0)) + t.quantity
-            if newPosition == Decimal(0):
-                del positions[instrument]
-            else:
-                positions[instrument] = newPosition
+
+def _sortedActivityForSymbol(
+    symbol: str, a: Union[Iterable[Activity], ActivityIndex], presorted: bool
+) -> Iterable[Activity]:
+    activity = _activityForSymbol(symbol, a)
+    if presorted or isinstance(a, ActivityIndex):
+        return activity
+    else:
+        return sorted(activity, key=lambda t: t.date)
+
+
+# Traces position sizing and profit/loss of a particular symbol over a period
+# of activity. Yields a TimelineEntry corresponding to each action that
+# occurred to the given symbol, starting from the oldest and ending with the
+# most recent.
+#
+# `a` may be an ActivityIndex, in which case the activity is already sorted.
+# Otherwise, callers can pass `presorted=True` to skip sorting activity that
+# they know to be in date order.
+def timelineForSymbol(
+    symbol: str, a: Union[Iterable[Activity], ActivityIndex], presorted: bool = False
+) -> Iterable[TimelineEntry]:
+    positions: Dict[Instrument, Decimal] = {}
+
+    for delta in _timelineDeltas(_sortedActivityForSymbol(symbol, a, presorted)):
+        delta.applyTo(positions)
 
         yield TimelineEntry(
-            date=t.date, positions=positions.copy(), realizedProfit=realizedProfit
+            date=delta.date,
+            positions=positions.copy(),
+            realizedProfit=delta.realizedProfit,
         )
 
 
-def liveValuesForPositions(
-    positions: Iterable[Position],
-    dataProvider: MarketDataProvider,
-    progressBar: Optional[Bar] = None,
-) -> Dict[Position, Cash]:
-    def priceFromQuote(q: Quote, p: Position) -> Optional[Cash]:
-        # For a long position, the value should be what the market is willing to pay right now.
-        # For a short position, the value should be what the market is asking to be paid right now.
-        if p.quantity < 0:
-            return q.ask or q.last or q.bid or q.close
-        else:
-            return q.bid or q.last or q.ask or q.close
+# A memory-efficient timeline, storing a TimelineDelta per step instead of a
+# full position snapshot. Every `checkpointInterval` steps, a snapshot of the
+# positions is kept, so any TimelineEntry can be rebuilt by replaying at most
+# that many deltas.
+class CompactTimeline(Sequence[TimelineEntry]):
+    defaultCheckpointInterval = 256
 
-    result = {}
+    def __init__(
+        self,
+        deltas: Iterable[TimelineDelta],
+        checkpointInterval: int = defaultCheckpointInterval,
+    ):
+        if checkpointInterval < 1:
+            raise ValueError(
+                f"Checkpoint interval must be positive: {checkpointInterval}"
+            )
+
+        self._deltas: List[TimelineDelta] = []
+        self._checkpoints: List[Dict[Instrument, Decimal]] = []
+        self._checkpointInterval = checkpointInterval
+
+        # Each checkpoint holds the positions _before_ the delta at the
+        # corresponding multiple of the interval.
+        positions: Dict[Instrument, Decimal] = {}
+        for delta in deltas:
+            if len(self._deltas) % checkpointInterval == 0:
+                self._checkpoints.append(positions.copy())
+
+            self._deltas.append(delta)
+            delta.applyTo(positions)
+
+        super().__init__()
+
+    @property
+    def deltas(self) -> Sequence[TimelineDelta]:
+        return self._deltas
+
+    # Rebuilds the full set of positions as of the step at `index`.
+    def positionsAt(self, index: int) -> Dict[Instrument, Decimal]:
+        if index < 0:
+            index += len(self._deltas)
+        if index < 0 or index >= len(self._deltas):
+            raise IndexError(f"Timeline index out of range: {index}")
+
+        checkpoint = index // self._checkpointInterval
+        positions = self._checkpoints[checkpoint].copy()
+        for delta in self._deltas[checkpoint * self._checkpointInterval : index + 1]:
+            delta.applyTo(positions)
+
+        return positions
+
+    def __len__(self) -> int:
+        return len(self._deltas)
+
+    @overload
+    def __getitem__(self, index: int) -> TimelineEntry:
+        pass
+
+    @overload
+    def __getitem__(self, index: slice) -> Sequence[TimelineEntry]:
+        pass
+
+    def __getitem__(
+        self, index: Union[int, slice]
+    ) -> Union[TimelineEntry, Sequence[TimelineEntry]]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        positions = self.positionsAt(index)
+        delta = self._deltas[index]
+        return TimelineEntry(
+            date=delta.date, positions=positions, realizedProfit=delta.realizedProfit
+        )
 
+    # Replays the whole timeline in order, without rebuilding from checkpoints.
+    def __iter__(self) -> Iterator[TimelineEntry]:
+        positions: Dict[Instrument, Decimal] = {}
+        for delta in self._deltas:
+            delta.applyTo(positions)
+
+            yield TimelineEntry(
+                date=delta.date,
+                positions=positions.copy(),
+                realizedProfit=delta.realizedProfit,
+            )
+
+
+# Like timelineForSymbol(), but returns a CompactTimeline, which is better
+# suited to symbols with a very large number of trades.
+def compactTimelineForSymbol(
+    symbol: str,
+    a: Union[Iterable[Activity], ActivityIndex],
+    presorted: bool = False,
+    checkpointInterval: int = CompactTimeline.defaultCheckpointInterval,
+) -> CompactTimeline:
+    return CompactTimeline(
+        _timelineDeltas(_sortedActivityForSymbol(symbol, a, presorted)),
+        checkpointInterval=checkpointInterval,
+    )
+
+
+# Traces the timeline of every symbol in the given activity, in one pass.
+#
+# This is much cheaper than calling timelineForSymbol() once per symbol, as
+# each activity is normalized and routed to its symbols only once (by building
+# an ActivityIndex, if one is not provided).
+#
+# Yields each normalized symbol, in sorted order, along with its timeline.
+# Options are traced under their underlying symbol, not individually.
+def timelinesForAllSymbols(
+    a: Union[Iterable[Activity], ActivityIndex]
+) -> Iterator[Tuple[str, Iterable[TimelineEntry]]]:
+    index = a if isinstance(a, ActivityIndex) else ActivityIndex(a)
+    for symbol in sorted(index.underlyingSymbols):
+        yield (symbol, timelineForSymbol(symbol, index))
+
+
+# Like timelinesForAllSymbols(), but yields a CompactTimeline for each symbol.
+def compactTimelinesForAllSymbols(
+    a: Union[Iterable[Activity], ActivityIndex],
+    checkpointInterval: int = CompactTimeline.defaultCheckpointInterval,
+) -> Iterator[Tuple[str, CompactTimeline]]:
+    index = a if isinstance(a, ActivityIndex) else ActivityIndex(a)
+    for symbol in sorted(index.underlyingSymbols):
+        yield (
+            symbol,
+            compactTimelineForSymbol(
+                symbol, index, checkpointInterval=checkpointInterval
+            ),
+        )
+
+
+def _priceFromQuote(q: Quote, p: Position) -> Optional[Cash]:
+    # For a long position, the value should be what the market is willing to pay right now.
+    # For a short position, the value should be what the market is asking to be paid right now.
+    if p.quantity < 0:
+        return q.ask or q.last or q.bid or q.close
+    else:
+        return q.bid or q.last or q.ask or q.close
+
+
+def _positionsByInstrument(positions: Iterable[Position]) -> Dict[Instrument, Position]:
     positionsByInstrument: Dict[Instrument, Position] = {}
     for p in positions:
         if p.instrument in positionsByInstrument:
@@ -168,12 +484,23 @@ def liveValuesForPositions(
 
         positionsByInstrument[p.instrument] = p
 
+    return positionsByInstrument
+
+
+def liveValuesForPositions(
+    positions: Iterable[Position],
+    dataProvider: MarketDataProvider,
+    progressBar: Optional[Bar] = None,
+) -> Dict[Position, Cash]:
+    result = {}
+
+    positionsByInstrument = _positionsByInstrument(positions)
     quotes = dataProvider.fetchQuotes(positionsByInstrument.keys())
     it = progressBar.iter(quotes) if progressBar else quotes
 
     for (instrument, quote) in it:
         position = positionsByInstrument[instrument]
-        price = priceFromQuote(quote, position)
+        price = _priceFromQuote(quote, position)
         if not price:
             continue
 
@@ -182,27 +509,193 @@ def liveValuesForPositions(
     return result
 
 
-def deduplicatePositions(positions: Iterable[Position]) -> Iterable[Position]:
-    return (
-        reduce(operator.add, ps)
-        for i, ps in groupby(
-            sorted(positions, key=lambda p: p.instrument), key=lambda p: p.instrument
-        )
+# A MarketDataProvider which can also fetch quotes without blocking the event
+# loop.
+#
+# Providers which don't implement this can still be used with the async
+# functions below, but their quotes will be fetched on a background thread.
+class AsyncMarketDataProvider(MarketDataProvider):
+    @abstractmethod
+    async def fetchQuotesAsync(
+        self, instruments: Sequence[Instrument]
+    ) -> Iterable[Tuple[Instrument, Quote]]:
+        pass
+
+
+# Fetches quotes for the given instruments from any provider, using its
+# asynchronous API if it has one.
+#
+# Otherwise, the provider is called on `executor` (or the event loop's default
+# executor, if None), so that the event loop is not blocked.
+async def fetchQuotesAsync(
+    dataProvider: MarketDataProvider,
+    instruments: Sequence[Instrument],
+    executor: Optional[Executor] = None,
+) -> Iterable[Tuple[Instrument, Quote]]:
+    if isinstance(dataProvider, AsyncMarketDataProvider):
+        return await dataProvider.fetchQuotesAsync(instruments)
+
+    client = ibkr.ibClient(dataProvider)
+    if client is not None:
+        return await ibkr.fetchQuotesAsync(client, instruments)
+
+    return await asyncio.get_event_loop().run_in_executor(
+        executor, lambda: list(dataProvider.fetchQuotes(instruments))
     )
 
 
-# Looks up how much each of the `otherCurrencies` cost in terms of
-# `quoteCurrency`.
+# Requests quotes for the given instruments in concurrent batches of up to
+# `batchSize`, yielding them as each batch arrives.
 #
-# Returns each of the other currencies (possibly out-of-order), along with a
-# cash price denominated in the `quoteCurrency`. If a quote is not available
-# for some reason, it is omitted from the results.
-def currencyConversionRates(
-    quoteCurrency: Currency,
-    otherCurrencies: Iterable[Currency],
+# If a batch does not complete within `timeout` seconds, its instruments are
+# omitted from the results, and a RuntimeWarning is issued.
+#
+# Batches are only fetched concurrently from an AsyncMarketDataProvider or an
+# IBMarketDataProvider. The latter must be used on the event loop its
+# connection was made on (see bankroll.analysis.ibkr). Other providers fetch
+# one batch at a time on a background thread, which keeps running any batch
+# that timed out until the provider returns. Their timeout only starts once the
+# thread starts fetching them.
+async def streamQuotes(
+    instruments: Iterable[Instrument],
     dataProvider: MarketDataProvider,
-) -> Iterable[Tuple[Currency, Cash]]:
-    instruments = (
+    batchSize: int = 50,
+    timeout: Optional[float] = None,
+) -> AsyncIterator[Tuple[Instrument, Quote]]:
+    if batchSize < 1:
+        raise ValueError(f"Batch size must be positive: {batchSize}")
+
+    allInstruments = list(instruments)
+    batches = [
+        allInstruments[i : i + batchSize]
+        for i in range(0, len(allInstruments), batchSize)
+    ]
+
+    # Providers without async support may not be safe to call from multiple
+    # threads at once.
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bankroll-quotes")
+
+    concurrent = (
+        isinstance(dataProvider, AsyncMarketDataProvider)
+        or ibkr.ibClient(dataProvider) is not None
+    )
+    slot = None if concurrent else asyncio.Semaphore(1)
+
+    # Batches for the executor queue behind one another (including any which
+    # timed out, but are still running), so only start timing each one once
+    # the executor actually starts on it.
+    async def fetchOnExecutor(
+        batch: Sequence[Instrument]
+    ) -> Iterable[Tuple[Instrument, Quote]]:
+        loop = asyncio.get_event_loop()
+        started = asyncio.Event()
+
+        def fetch() -> List[Tuple[Instrument, Quote]]:
+            loop.call_soon_threadsafe(started.set)
+            return list(dataProvider.fetchQuotes(batch))
+
+        future = loop.run_in_executor(executor, fetch)
+        try:
+            await started.wait()
+        except asyncio.CancelledError:
+            # Don't leave the batch queued.
+            future.cancel()
+            raise
+
+        return await asyncio.wait_for(future, timeout)
+
+    async def fetchBatch(
+        batch: Sequence[Instrument]
+    ) -> Iterable[Tuple[Instrument, Quote]]:
+        if slot is None:
+            return await asyncio.wait_for(
+                fetchQuotesAsync(dataProvider, batch), timeout
+            )
+
+        async with slot:
+            return await fetchOnExecutor(batch)
+
+    pending = [asyncio.ensure_future(fetchBatch(batch)) for batch in batches]
+
+    try:
+        for future in asyncio.as_completed(pending):
+            try:
+                quotes = await future
+            except asyncio.TimeoutError:
+                warn(
+                    f"Timed out after {timeout}s fetching quotes for a batch of instruments",
+                    category=RuntimeWarning,
+                )
+                continue
+
+            for instrument, quote in quotes:
+                yield (instrument, quote)
+    finally:
+        for f in pending:
+            f.cancel()
+
+        # Don't wait for batches which timed out.
+        executor.shutdown(wait=False)
+
+
+# An asyncio counterpart to liveValuesForPositions(), which yields each
+# position's value as soon as its quote arrives. See streamQuotes() for the
+# meaning of `batchSize` and `timeout`.
+async def streamLiveValuesForPositions(
+    positions: Iterable[Position],
+    dataProvider: MarketDataProvider,
+    batchSize: int = 50,
+    timeout: Optional[float] = None,
+) -> AsyncIterator[Tuple[Position, Cash]]:
+    positionsByInstrument = _positionsByInstrument(positions)
+
+    async for (instrument, quote) in streamQuotes(
+        positionsByInstrument.keys(), dataProvider, batchSize=batchSize, timeout=timeout
+    ):
+        position = positionsByInstrument[instrument]
+        price = _priceFromQuote(quote, position)
+        if not price:
+            continue
+
+        yield (position, price * position.quantity * instrument.multiplier)
+
+
+# Like streamLiveValuesForPositions(), but collects all of the (possibly
+# partial) results into a dictionary, as liveValuesForPositions() does.
+async def liveValuesForPositionsAsync(
+    positions: Iterable[Position],
+    dataProvider: MarketDataProvider,
+    batchSize: int = 50,
+    timeout: Optional[float] = None,
+) -> Dict[Position, Cash]:
+    return {
+        position: value
+        async for (position, value) in streamLiveValuesForPositions(
+            positions, dataProvider, batchSize=batchSize, timeout=timeout
+        )
+    }
+
+
+# Combines positions in the same instrument (e.g., held across several
+# accounts) into one.
+#
+# `positions` is consumed in a single pass. The result is sorted by
+# instrument, unless `sortByInstrument` is False, in which case positions are
+# left in order of each instrument's first appearance (skipping the sort).
+def deduplicatePositions(
+    positions: Iterable[Position], sortByInstrument: bool = True
+) -> List[Position]:
+    deduplicated = sumPositionsByInstrument(positions)
+    if sortByInstrument:
+        deduplicated.sort(key=lambda p: p.instrument)
+
+    return deduplicated
+
+
+def _forexPairs(
+    quoteCurrency: Currency, otherCurrencies: Iterable[Currency]
+) -> Iterable[Forex]:
+    return (
         Forex(
             baseCurrency=min(currency, quoteCurrency),
             quoteCurrency=max(currency, quoteCurrency),
@@ -210,10 +703,16 @@ def currencyConversionRates(
         for currency in otherCurrencies
     )
 
-    return (
-        (instrument.baseCurrency, quote.market)
-        if instrument.quoteCurrency == quoteCurrency
-        else (
+
+def _conversionRateFromQuote(
+    quoteCurrency: Currency, instrument: Forex, quote: Quote
+) -> Optional[Tuple[Currency, Cash]]:
+    if not quote.market:
+        return None
+    elif instrument.quoteCurrency == quoteCurrency:
+        return (instrument.baseCurrency, quote.market)
+    else:
+        return (
             instrument.quoteCurrency,
             Cash(
                 currency=instrument.baseCurrency,
@@ -224,10 +723,53 @@ def currencyConversionRates(
                 quantity=Decimal(1) / quote.market.quantity,
             ),
         )
-        for instrument, quote in dataProvider.fetchQuotes(instruments)
-        if quote.market and isinstance(instrument, Forex)
+
+
+# Looks up how much each of the `otherCurrencies` cost in terms of
+# `quoteCurrency`.
+#
+# Returns each of the other currencies (possibly out-of-order), along with a
+# cash price denominated in the `quoteCurrency`. If a quote is not available
+# for some reason, it is omitted from the results.
+def currencyConversionRates(
+    quoteCurrency: Currency,
+    otherCurrencies: Iterable[Currency],
+    dataProvider: MarketDataProvider,
+) -> Iterable[Tuple[Currency, Cash]]:
+    rates = (
+        _conversionRateFromQuote(quoteCurrency, instrument, quote)
+        for instrument, quote in dataProvider.fetchQuotes(
+            _forexPairs(quoteCurrency, otherCurrencies)
+        )
+        if isinstance(instrument, Forex)
     )
 
+    return (rate for rate in rates if rate)
+
+
+# An asyncio counterpart to currencyConversionRates(), which yields each rate
+# as soon as its quote arrives. See streamQuotes() for the meaning of
+# `batchSize` and `timeout`.
+async def currencyConversionRatesAsync(
+    quoteCurrency: Currency,
+    otherCurrencies: Iterable[Currency],
+    dataProvider: MarketDataProvider,
+    batchSize: int = 50,
+    timeout: Optional[float] = None,
+) -> AsyncIterator[Tuple[Currency, Cash]]:
+    async for (instrument, quote) in streamQuotes(
+        _forexPairs(quoteCurrency, otherCurrencies),
+        dataProvider,
+        batchSize=batchSize,
+        timeout=timeout,
+    ):
+        if not isinstance(instrument, Forex):
+            continue
+
+        rate = _conversionRateFromQuote(quoteCurrency, instrument, quote)
+        if rate:
+            yield rate
+
 
 # Converts the given cash values into `quoteCurrency` using forex market quotes.
 def convertCashToCurrency(
@@ -248,14 +790,10 @@ def convertCashToCurrency(
                 f"Unable to fetch currency rate for {c.currency} to convert {c}"
             )
 
-    return reduce(
-        operator.add,
-        (
-            Cash(
-                currency=quoteCurrency,
-                quantity=c.quantity * currencyRates[c.currency].quantity,
-            )
-            for c in cash
-        ),
-        Cash(currency=quoteCurrency, quantity=Decimal(0)),
-    )
+    # Each converted amount is quantized before summing, as Cash would be.
+    total = CashSum(quoteCurrency)
+    for c in cash:
+        total.addQuantity(c.quantity * currencyRates[c.currency].quantity)
+
+    assert total.total is not None
+    return total.total
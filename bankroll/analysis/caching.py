@@ -0,0 +1,186 @@
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+)
+
+import pandas as pd  # type: ignore
+
+from bankroll.marketdata import MarketDataProvider
+from bankroll.model import Instrument, Quote
+
+from . import ibkr
+from .analysis import AsyncMarketDataProvider, fetchQuotesAsync
+from .history import fetchHistoricalData
+
+
+# Wraps another MarketDataProvider, remembering the quotes it returns for a
+# limited time, so that repeated requests for the same instruments (e.g., from
+# liveValuesForPositions() followed by convertCashToCurrency()) don't all go
+# back to the market.
+#
+# Quotes are kept for `ttl` seconds, unless the instrument's type (or one of
+# its superclasses) appears in `ttlByType`. A TTL of zero disables caching for
+# that type. At most `maxSize` quotes are kept, evicting the least recently
+# used first.
+#
+# Historical data is fetched from the underlying provider directly (see
+# HistoricalBarCache for caching it).
+#
+# If `provider` can fetch quotes asynchronously (see fetchQuotesAsync()), the
+# cache is an AsyncCachingMarketDataProvider which can too. Otherwise, it is
+# only as thread-safe as `provider`, and is fetched from on a background thread
+# like any other synchronous provider.
+class CachingMarketDataProvider(MarketDataProvider):
+    defaultTTL = 60.0
+    defaultMaxSize = 1024
+
+    def __new__(
+        cls, provider: MarketDataProvider, *args: Any, **kwargs: Any
+    ) -> "CachingMarketDataProvider":
+        if cls is CachingMarketDataProvider and (
+            isinstance(provider, AsyncMarketDataProvider)
+            or ibkr.ibClient(provider) is not None
+        ):
+            cls = AsyncCachingMarketDataProvider
+
+        return super().__new__(cls)
+
+    def __init__(
+        self,
+        provider: MarketDataProvider,
+        ttl: float = defaultTTL,
+        ttlByType: Mapping[Type[Instrument], float] = {},
+        maxSize: int = defaultMaxSize,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if maxSize < 1:
+            raise ValueError(f"Cache size must be positive: {maxSize}")
+
+        self._provider = provider
+        self._ttl = ttl
+        self._ttlByType = dict(ttlByType)
+        self._maxSize = maxSize
+        self._clock = clock
+
+        # Maps each instrument to its quote, and the time at which it expires.
+        self._quotes: "OrderedDict[Instrument, Tuple[Quote, float]]" = OrderedDict()
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        super().__init__()
+
+    @property
+    def underlying(self) -> MarketDataProvider:
+        return self._provider
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    @property
+    def evictions(self) -> int:
+        return self._evictions
+
+    def ttlForInstrument(self, instrument: Instrument) -> float:
+        for cls in type(instrument).__mro__:
+            if cls in self._ttlByType:
+                return self._ttlByType[cls]
+
+        return self._ttl
+
+    def clear(self) -> None:
+        self._quotes.clear()
+
+    def _lookup(
+        self, instruments: Iterable[Instrument]
+    ) -> Tuple[List[Tuple[Instrument, Quote]], List[Instrument]]:
+        now = self._clock()
+        found: List[Tuple[Instrument, Quote]] = []
+        missing: List[Instrument] = []
+        seen: Set[Instrument] = set()
+
+        for instrument in instruments:
+            if instrument in seen:
+                continue
+
+            seen.add(instrument)
+
+            entry = self._quotes.get(instrument)
+            if entry and entry[1] > now:
+                self._hits += 1
+                self._quotes.move_to_end(instrument)
+                found.append((instrument, entry[0]))
+            else:
+                self._misses += 1
+                missing.append(instrument)
+
+        return (found, missing)
+
+    def _store(
+        self, quotes: Iterable[Tuple[Instrument, Quote]]
+    ) -> List[Tuple[Instrument, Quote]]:
+        now = self._clock()
+        result = list(quotes)
+
+        for instrument, quote in result:
+            ttl = self.ttlForInstrument(instrument)
+            if ttl <= 0:
+                continue
+
+            self._quotes[instrument] = (quote, now + ttl)
+            self._quotes.move_to_end(instrument)
+
+            while len(self._quotes) > self._maxSize:
+                self._quotes.popitem(last=False)
+                self._evictions += 1
+
+        return result
+
+    def fetchQuotes(
+        self, instruments: Iterable[Instrument]
+    ) -> Iterable[Tuple[Instrument, Quote]]:
+        found, missing = self._lookup(instruments)
+        if missing:
+            found += self._store(self._provider.fetchQuotes(missing))
+
+        return found
+
+    def fetchHistoricalData(
+        self, instrument: Instrument, start: Optional[date] = None
+    ) -> Optional[pd.DataFrame]:
+        return fetchHistoricalData(self._provider, instrument, start)
+
+    def __str__(self) -> str:
+        return f"Quote cache: {self._hits} hits, {self._misses} misses, {self._evictions} evictions"
+
+
+# A CachingMarketDataProvider around a provider which can fetch quotes
+# asynchronously, so that batches of quotes missing from the cache can be
+# fetched concurrently.
+class AsyncCachingMarketDataProvider(
+    CachingMarketDataProvider, AsyncMarketDataProvider
+):
+    async def fetchQuotesAsync(
+        self, instruments: Sequence[Instrument]
+    ) -> Iterable[Tuple[Instrument, Quote]]:
+        found, missing = self._lookup(instruments)
+        if missing:
+            found += self._store(await fetchQuotesAsync(self._provider, missing))
+
+        return found
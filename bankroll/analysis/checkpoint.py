@@ -0,0 +1,251 @@
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+from dataclasses import dataclass, field
+from datetime import datetime
+from decimal import Decimal
+from pathlib import Path
+from typing import Counter, Iterable, List, Mapping, Optional, Tuple, Union
+
+from bankroll.model import Activity, Cash, Instrument
+
+from .aggregation import CashSum
+from .analysis import (
+    ActivityIndex,
+    TimelineDelta,
+    TimelineEntry,
+    _activityForSymbol,
+    _realizedBasis,
+    _timelineDeltas,
+    normalizeSymbol,
+)
+
+defaultCheckpointDirectory = "~/.cache/bankroll/checkpoints"
+
+
+# Raised when activity older than a checkpoint is applied to it, which
+# requires rebuilding the checkpoint from the full history instead.
+class BackdatedActivityError(ValueError):
+    pass
+
+
+# Identifies one activity, so that it can be recognized if applied again
+# (e.g., after an export is re-ingested) without keeping the activity itself.
+def _digest(activity: Activity) -> str:
+    return hashlib.sha256(repr(activity).encode()).hexdigest()
+
+
+# The state of realizedBasisForSymbol() and timelineForSymbol() for one
+# symbol, after folding over its activity up to `lastDate`.
+#
+# Checkpoints can be saved (see CheckpointStore), then advanced with only the
+# activity which arrived since, instead of folding over the whole history
+# again.
+@dataclass(frozen=True)
+class SymbolCheckpoint:
+    # Normalized, as by normalizeSymbol().
+    symbol: str
+
+    realizedBasis: Optional[Cash] = None
+    realizedProfit: Optional[Cash] = None
+
+    # Open quantities of each (normalized) instrument, as in TimelineEntry.
+    positions: Mapping[Instrument, Decimal] = field(default_factory=dict)
+
+    # The date of the latest activity applied, and how many have been applied
+    # in total.
+    lastDate: Optional[datetime] = None
+    count: int = 0
+
+    # Digests of the activity applied at `lastDate` (see _digest()), sorted.
+    # Later activity may share that date, so this is needed to tell which of
+    # it was already applied.
+    lastDateDigests: Tuple[str, ...] = ()
+
+    # The latest step of the timeline, or None if no activity was applied.
+    @property
+    def entry(self) -> Optional[TimelineEntry]:
+        if self.lastDate is None or self.realizedProfit is None:
+            return None
+
+        return TimelineEntry(
+            date=self.lastDate,
+            positions=dict(self.positions),
+            realizedProfit=self.realizedProfit,
+        )
+
+    # Applies activity which arrived after this checkpoint was made, returning
+    # a new checkpoint along with the timeline steps for the new activity.
+    #
+    # Activity which does not affect this symbol is ignored, as is activity at
+    # `lastDate` which was already applied. The rest must not be dated before
+    # `lastDate`, or else BackdatedActivityError is raised.
+    def advance(
+        self, activity: Union[Iterable[Activity], ActivityIndex]
+    ) -> Tuple["SymbolCheckpoint", List[TimelineDelta]]:
+        newActivity = sorted(
+            _activityForSymbol(self.symbol, activity), key=lambda a: a.date
+        )
+        if newActivity and self.lastDate is not None:
+            if newActivity[0].date < self.lastDate:
+                raise BackdatedActivityError(
+                    f"Activity for {self.symbol} on {newActivity[0].date} predates checkpoint at {self.lastDate}"
+                )
+
+            newActivity = self._unapplied(newActivity)
+
+        if not newActivity:
+            return (self, [])
+
+        deltas = list(_timelineDeltas(newActivity, realizedProfit=self.realizedProfit))
+        positions = dict(self.positions)
+        for delta in deltas:
+            delta.applyTo(positions)
+
+        # Continue the running total exactly as _realizedBasis() would have.
+        basis = CashSum()
+        if self.realizedBasis is not None:
+            basis.add(self.realizedBasis)
+        newBasis = _realizedBasis(newActivity)
+        if newBasis is not None:
+            basis.add(newBasis)
+
+        lastDate = newActivity[-1].date
+        digests = [_digest(a) for a in newActivity if a.date == lastDate]
+        if lastDate == self.lastDate:
+            digests.extend(self.lastDateDigests)
+
+        checkpoint = SymbolCheckpoint(
+            symbol=self.symbol,
+            realizedBasis=basis.total,
+            realizedProfit=deltas[-1].realizedProfit,
+            positions=positions,
+            lastDate=lastDate,
+            count=self.count + len(newActivity),
+            lastDateDigests=tuple(sorted(digests)),
+        )
+
+        return (checkpoint, deltas)
+
+    # Filters out activity (sorted by date) which was already applied at
+    # `lastDate`. Each digest accounts for one activity, so identical activity
+    # which occurs more often than was applied is kept.
+    def _unapplied(self, activity: List[Activity]) -> List[Activity]:
+        applied = Counter(self.lastDateDigests)
+        unapplied: List[Activity] = []
+        for a in activity:
+            if a.date == self.lastDate:
+                digest = _digest(a)
+                if applied[digest] > 0:
+                    applied[digest] -= 1
+                    continue
+
+            unapplied.append(a)
+
+        return unapplied
+
+    # Builds a checkpoint by folding over the full history of `symbol`.
+    @classmethod
+    def build(
+        cls, symbol: str, activity: Union[Iterable[Activity], ActivityIndex]
+    ) -> "SymbolCheckpoint":
+        checkpoint, _ = cls(symbol=normalizeSymbol(symbol)).advance(activity)
+        return checkpoint
+
+
+# Keeps a SymbolCheckpoint for each symbol on disk, in one file per symbol.
+class CheckpointStore:
+    # Bump when the checkpoint format changes, to ignore older checkpoints.
+    version = 2
+
+    def __init__(self, directory: Union[str, Path] = defaultCheckpointDirectory):
+        self._directory = Path(directory).expanduser()
+        super().__init__()
+
+    @property
+    def directory(self) -> Path:
+        return self._directory
+
+    def _path(self, symbol: str) -> Path:
+        digest = hashlib.sha256(
+            f"{self.version}:{normalizeSymbol(symbol)}".encode()
+        ).hexdigest()
+        return self._directory / f"{digest[:32]}.checkpoint"
+
+    # Returns the saved checkpoint for `symbol`, if any.
+    def load(self, symbol: str) -> Optional[SymbolCheckpoint]:
+        try:
+            with open(self._path(symbol), "rb") as f:
+                checkpoint = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as err:
+            logging.warning(f"Ignoring unreadable checkpoint for {symbol}: {err}")
+            return None
+
+        if not isinstance(
+            checkpoint, SymbolCheckpoint
+        ) or checkpoint.symbol != normalizeSymbol(symbol):
+            return None
+
+        return checkpoint
+
+    def store(self, checkpoint: SymbolCheckpoint) -> None:
+        self._directory.mkdir(parents=True, exist_ok=True)
+
+        fd, tmp = tempfile.mkstemp(dir=str(self._directory), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(tmp, str(self._path(checkpoint.symbol)))
+
+    # Deletes the checkpoints for the given symbols, or for every symbol if
+    # None. Returns the number of files removed.
+    def invalidate(self, symbols: Optional[Iterable[str]] = None) -> int:
+        if symbols is None:
+            paths = list(self._directory.glob("*.checkpoint"))
+        else:
+            paths = [self._path(s) for s in symbols]
+
+        count = 0
+        for path in paths:
+            try:
+                path.unlink()
+                count += 1
+            except FileNotFoundError:
+                pass
+
+        return count
+
+    def __str__(self) -> str:
+        return f"Checkpoint store in {self._directory}"
+
+
+# Brings the saved checkpoint for `symbol` up to date with `newActivity`, and
+# saves the result.
+#
+# If there is no saved checkpoint, or `newActivity` is back-dated relative to
+# it, the checkpoint is instead rebuilt from `history`, which must contain all
+# activity for the symbol (including `newActivity`). `history` is only
+# consumed in that case, so it may be a lazily evaluated iterable.
+def updateCheckpoint(
+    store: CheckpointStore,
+    symbol: str,
+    newActivity: Union[Iterable[Activity], ActivityIndex],
+    history: Union[Iterable[Activity], ActivityIndex],
+) -> SymbolCheckpoint:
+    checkpoint = store.load(symbol)
+    if checkpoint is not None:
+        try:
+            checkpoint, _ = checkpoint.advance(newActivity)
+        except BackdatedActivityError as err:
+            logging.info(f"Rebuilding checkpoint: {err}")
+            checkpoint = None
+
+    if checkpoint is None:
+        checkpoint = SymbolCheckpoint.build(symbol, history)
+
+    store.store(checkpoint)
+    return checkpoint
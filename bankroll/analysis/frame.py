@@ -0,0 +1,381 @@
+from datetime import datetime
+from decimal import Decimal
+from typing import AbstractSet, Dict, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+
+from bankroll.model import (
+    Activity,
+    Cash,
+    CashPayment,
+    Currency,
+    Instrument,
+    Option,
+    Position,
+    Trade,
+    TradeFlags,
+)
+
+from .analysis import (
+    CompactTimeline,
+    TimelineDelta,
+    _realizedBasis,
+    _timelineDeltas,
+    normalizeInstrument,
+    normalizeSymbol,
+)
+
+_currencies = [c.name for c in Currency]
+
+
+def _toUnits(d: Decimal, quantization: Decimal) -> int:
+    return int(d / quantization)
+
+
+def _fromUnits(units: int, quantization: Decimal) -> Decimal:
+    return Decimal(int(units)) * quantization
+
+
+# A columnar representation of activity, for analyzing long histories with
+# vectorized operations instead of per-object arithmetic.
+#
+# The frame has one row per activity, in the order given, with columns:
+#
+#   date          datetime64
+#   kind          "trade" or "payment"
+#   symbol        normalized symbol of the instrument (None for payments not
+#                 associated with any instrument)
+#   underlying    normalized underlying symbol of options, otherwise None
+#   instrument    index into `instruments` (-1 if none)
+#   quantity      trade quantity, in units of Position.quantityQuantization
+#   amount        trade amount or payment proceeds, in units of
+#                 Cash.quantization
+#   fees          trade fees, in units of Cash.quantization
+#   currency      currency code of `amount`
+#   feesCurrency  currency code of `fees`
+#   flags         TradeFlags value of trades
+#
+# As quantities and amounts are already quantized by the model, storing them
+# as scaled int64 is exact, as long as no sum exceeds about 9.2 * 10^14 (in
+# any currency, or shares). Dates must be within the range of pandas
+# timestamps (1677-2262).
+#
+# Results match the equivalent functions over Activity objects (e.g.,
+# realizedBasisForSymbol()). Symbols whose activity mixes currencies, which
+# cannot be summed, fall back to those functions, so they fail in the same way.
+class ActivityFrame:
+    def __init__(self, activity: Iterable[Activity]):
+        dates: List[datetime] = []
+        kinds: List[str] = []
+        symbols: List[Optional[str]] = []
+        underlyings: List[Optional[str]] = []
+        instruments: List[Optional[Instrument]] = []
+        quantities: List[int] = []
+        amounts: List[int] = []
+        fees: List[int] = []
+        currencies: List[str] = []
+        feesCurrencies: List[str] = []
+        flags: List[int] = []
+
+        for a in activity:
+            if isinstance(a, Trade):
+                kinds.append("trade")
+                instruments.append(a.instrument)
+                symbols.append(normalizeSymbol(a.instrument.symbol))
+                underlyings.append(
+                    normalizeSymbol(a.instrument.underlying)
+                    if isinstance(a.instrument, Option)
+                    else None
+                )
+                quantities.append(_toUnits(a.quantity, Position.quantityQuantization))
+                amounts.append(_toUnits(a.amount.quantity, Cash.quantization))
+                fees.append(_toUnits(a.fees.quantity, Cash.quantization))
+                currencies.append(a.amount.currency.name)
+                feesCurrencies.append(a.fees.currency.name)
+                flags.append(a.flags.value)
+            elif isinstance(a, CashPayment):
+                kinds.append("payment")
+                instruments.append(a.instrument)
+                symbols.append(
+                    normalizeSymbol(a.instrument.symbol) if a.instrument else None
+                )
+                underlyings.append(None)
+                quantities.append(0)
+                amounts.append(_toUnits(a.proceeds.quantity, Cash.quantization))
+                fees.append(0)
+                currencies.append(a.proceeds.currency.name)
+                feesCurrencies.append(a.proceeds.currency.name)
+                flags.append(TradeFlags.NONE.value)
+            else:
+                raise ValueError(f"Unexpected type of activity: {a}")
+
+            dates.append(a.date)
+
+        codes, uniques = pd.factorize(pd.Series(instruments, dtype=object))
+        self._instruments: List[Instrument] = list(uniques)
+        self._normalizedInstruments: Dict[int, Instrument] = {}
+
+        self._frame = pd.DataFrame(
+            {
+                "date": pd.to_datetime(pd.Series(dates, dtype=object)),
+                "kind": pd.Categorical(kinds, categories=["trade", "payment"]),
+                "symbol": pd.Series(symbols, dtype=object),
+                "underlying": pd.Series(underlyings, dtype=object),
+                "instrument": np.asarray(codes, dtype=np.int64),
+                "quantity": np.array(quantities, dtype=np.int64),
+                "amount": np.array(amounts, dtype=np.int64),
+                "fees": np.array(fees, dtype=np.int64),
+                "currency": pd.Categorical(currencies, categories=_currencies),
+                "feesCurrency": pd.Categorical(feesCurrencies, categories=_currencies),
+                "flags": np.array(flags, dtype=np.int64),
+            }
+        )
+
+        # Built on first use by activityAt().
+        self._columns: Optional[Dict[str, np.ndarray]] = None
+
+        self._indexBySymbol()
+        super().__init__()
+
+    # Routes each row to every symbol it affects (as symbolsAffectedByActivity()
+    # does), then sorts rows by symbol, date, and original order, so each
+    # symbol's rows are one contiguous run in date order.
+    def _indexBySymbol(self) -> None:
+        symbol = self._frame["symbol"].to_numpy(dtype=object)
+        underlying = self._frame["underlying"].to_numpy(dtype=object)
+
+        primary = np.flatnonzero(pd.notna(symbol))
+        extra = np.flatnonzero(pd.notna(underlying) & (underlying != symbol))
+        rows = np.concatenate([primary, extra])
+
+        # pandas' string hashing stops at NUL characters, so symbols are
+        # factorized by sorting instead.
+        self._symbols, symbolCodes = np.unique(
+            np.concatenate([symbol[primary], underlying[extra]]), return_inverse=True
+        )
+        dates = self._frame["date"].to_numpy()[rows]
+        order = np.lexsort((rows, dates, symbolCodes))
+
+        self._rows = rows[order]
+        self._starts = np.searchsorted(
+            symbolCodes[order], np.arange(len(self._symbols) + 1)
+        )
+        self._symbolIndices: Dict[str, int] = {
+            s: i for i, s in enumerate(self._symbols)
+        }
+
+        # Symbols whose activity (including fees) is all in one currency can be
+        # summed directly.
+        currency = self._frame["currency"].cat.codes.to_numpy(dtype=np.int64)
+        feesCurrency = self._frame["feesCurrency"].cat.codes.to_numpy(dtype=np.int64)
+        if len(self._rows) > 0:
+            starts = self._starts[:-1]
+            low = np.minimum.reduceat(
+                np.minimum(currency, feesCurrency)[self._rows], starts
+            )
+            high = np.maximum.reduceat(
+                np.maximum(currency, feesCurrency)[self._rows], starts
+            )
+            self._symbolCurrencies = np.where(low == high, low, -1)
+        else:
+            self._symbolCurrencies = np.array([], dtype=np.int64)
+
+    # The columnar data, which should not be modified.
+    @property
+    def frame(self) -> pd.DataFrame:
+        return self._frame
+
+    # Every distinct instrument in the activity, as indexed by the `instrument`
+    # column.
+    @property
+    def instruments(self) -> Sequence[Instrument]:
+        return self._instruments
+
+    # All normalized symbols which have at least one affecting activity.
+    @property
+    def symbols(self) -> AbstractSet[str]:
+        return self._symbolIndices.keys()
+
+    def __len__(self) -> int:
+        return len(self._frame)
+
+    # Converts the row at `row` back into an Activity.
+    def activityAt(self, row: int) -> Activity:
+        if self._columns is None:
+            frame = self._frame
+            self._columns = {
+                "date": frame["date"].dt.to_pydatetime(),
+                "kind": frame["kind"].to_numpy(dtype=object),
+                "currency": frame["currency"].to_numpy(dtype=object),
+                "feesCurrency": frame["feesCurrency"].to_numpy(dtype=object),
+            }
+            for column in ["instrument", "quantity", "amount", "fees", "flags"]:
+                self._columns[column] = frame[column].to_numpy()
+
+        columns = self._columns
+        code = columns["instrument"][row]
+        instrument = self._instruments[code] if code >= 0 else None
+        amount = Cash(
+            currency=Currency[columns["currency"][row]],
+            quantity=_fromUnits(columns["amount"][row], Cash.quantization),
+        )
+
+        if columns["kind"][row] == "payment":
+            return CashPayment(
+                date=columns["date"][row], instrument=instrument, proceeds=amount
+            )
+
+        assert instrument is not None
+        return Trade(
+            date=columns["date"][row],
+            instrument=instrument,
+            quantity=_fromUnits(
+                columns["quantity"][row], Position.quantityQuantization
+            ),
+            amount=amount,
+            fees=Cash(
+                currency=Currency[columns["feesCurrency"][row]],
+                quantity=_fromUnits(columns["fees"][row], Cash.quantization),
+            ),
+            flags=TradeFlags(int(columns["flags"][row])),
+        )
+
+    # Converts every row back into an Activity, in the original order.
+    def __iter__(self) -> Iterator[Activity]:
+        return (self.activityAt(row) for row in range(len(self._frame)))
+
+    def _rowsForSymbol(self, symbol: str) -> Optional[np.ndarray]:
+        i = self._symbolIndices.get(normalizeSymbol(symbol))
+        if i is None:
+            return None
+
+        return self._rows[self._starts[i] : self._starts[i + 1]]
+
+    def _normalizedInstrument(self, code: int) -> Instrument:
+        instrument = self._normalizedInstruments.get(code)
+        if instrument is None:
+            instrument = normalizeInstrument(self._instruments[code])
+            self._normalizedInstruments[code] = instrument
+
+        return instrument
+
+    def _currencyForSymbol(self, symbol: str) -> Optional[Currency]:
+        code = self._symbolCurrencies[self._symbolIndices[normalizeSymbol(symbol)]]
+        return Currency[_currencies[code]] if code >= 0 else None
+
+    def _proceeds(self) -> np.ndarray:
+        return self._frame["amount"].to_numpy() - self._frame["fees"].to_numpy()
+
+    # Returns the activity affecting the given symbol, sorted by date, as
+    # ActivityIndex.activityForSymbol() does.
+    def activityForSymbol(self, symbol: str) -> Sequence[Activity]:
+        rows = self._rowsForSymbol(symbol)
+        if rows is None:
+            return []
+
+        return [self.activityAt(row) for row in rows]
+
+    # Calculates realizedBasisForSymbol() for the given symbol.
+    def realizedBasisForSymbol(self, symbol: str) -> Optional[Cash]:
+        rows = self._rowsForSymbol(symbol)
+        if rows is None:
+            return None
+
+        currency = self._currencyForSymbol(symbol)
+        if currency is None:
+            return _realizedBasis(self.activityForSymbol(symbol))
+
+        total = self._proceeds()[rows].sum()
+        return Cash(currency=currency, quantity=-_fromUnits(total, Cash.quantization))
+
+    # Calculates realizedBasisForSymbol() for every symbol, with one grouped
+    # sum over all activity.
+    def realizedBasisForAllSymbols(self) -> Dict[str, Cash]:
+        if len(self._rows) == 0:
+            return {}
+
+        totals = np.add.reduceat(self._proceeds()[self._rows], self._starts[:-1])
+
+        result: Dict[str, Cash] = {}
+        for symbol, total, code in zip(self._symbols, totals, self._symbolCurrencies):
+            if code >= 0:
+                result[symbol] = Cash(
+                    currency=Currency[_currencies[code]],
+                    quantity=-_fromUnits(total, Cash.quantization),
+                )
+            else:
+                basis = _realizedBasis(self.activityForSymbol(symbol))
+                if basis is not None:
+                    result[symbol] = basis
+
+        return result
+
+    # Like compactTimelineForSymbol(), with realized profit computed as a
+    # cumulative sum.
+    def timelineForSymbol(
+        self,
+        symbol: str,
+        checkpointInterval: int = CompactTimeline.defaultCheckpointInterval,
+    ) -> CompactTimeline:
+        rows = self._rowsForSymbol(symbol)
+        if rows is None:
+            return CompactTimeline([], checkpointInterval=checkpointInterval)
+
+        currency = self._currencyForSymbol(symbol)
+        if currency is None:
+            return CompactTimeline(
+                _timelineDeltas(self.activityForSymbol(symbol)),
+                checkpointInterval=checkpointInterval,
+            )
+
+        frame = self._frame
+        dates = frame["date"].iloc[rows].dt.to_pydatetime()
+        isTrade = (frame["kind"] == "trade").to_numpy()[rows]
+        codes = frame["instrument"].to_numpy()[rows]
+        quantities = frame["quantity"].to_numpy()[rows]
+        profits = np.cumsum(self._proceeds()[rows])
+
+        # Only trades move positions (as in _timelineDeltas()).
+        instruments: List[Optional[Instrument]] = [None] * len(rows)
+        changes = [Decimal(0)] * len(rows)
+        for i in np.flatnonzero(isTrade):
+            instruments[i] = self._normalizedInstrument(codes[i])
+            changes[i] = _fromUnits(quantities[i], Position.quantityQuantization)
+
+        deltas = (
+            TimelineDelta(
+                date=dates[i],
+                instrument=instruments[i],
+                quantity=changes[i],
+                realizedProfit=Cash(
+                    currency=currency,
+                    quantity=_fromUnits(profits[i], Cash.quantization),
+                ),
+            )
+            for i in range(len(rows))
+        )
+        return CompactTimeline(deltas, checkpointInterval=checkpointInterval)
+
+    # Sums cash payments (e.g., dividends and interest) by symbol and currency,
+    # and also by `period` (a pandas period alias, like "A" or "M") if given.
+    #
+    # Payments not associated with any instrument are summed under the empty
+    # symbol. Returns a DataFrame with an "income" column of Decimal amounts.
+    def incomeBySymbol(self, period: Optional[str] = None) -> pd.DataFrame:
+        frame = self._frame
+        payments = frame[frame["kind"] == "payment"]
+
+        keys = [payments["symbol"].fillna("").rename("symbol")]
+        if period:
+            keys.append(payments["date"].dt.to_period(period).rename("period"))
+        keys.append(payments["currency"].astype(str).rename("currency"))
+
+        totals = payments["amount"].groupby(keys).sum()
+        return pd.DataFrame(
+            {"income": [_fromUnits(t, Cash.quantization) for t in totals]},
+            index=totals.index,
+        )
+
+    def __repr__(self) -> str:
+        return f"ActivityFrame({len(self._frame)} activities x {len(self._symbols)} symbols)"
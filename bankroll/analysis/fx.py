@@ -0,0 +1,405 @@
+import time
+from collections import deque
+from decimal import Decimal
+from enum import Enum, unique
+from typing import (
+    AbstractSet,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+    overload,
+)
+
+from bankroll.marketdata import MarketDataProvider
+from bankroll.model import Cash, Currency, Forex
+
+from .analysis import currencyConversionRates
+
+
+@unique
+class FxRefreshPolicy(Enum):
+    # Never request quotes except through FxRateTable.refresh(). Converting a
+    # currency which is not already in the table raises an error.
+    MANUAL = "manual"
+
+    # Fetch rates for currencies which are not yet in the table, but never
+    # update rates which have already been fetched.
+    MISSING = "missing"
+
+    # Like MISSING, but also re-fetch every rate in the table once it is older
+    # than the table's `maxAge`.
+    EXPIRED = "expired"
+
+
+# Derives exchange rates between any two currencies from quotes on a small set
+# of liquid forex pairs, so that converting N currencies into any number of
+# report currencies needs (at most) N - 1 quotes, instead of one per
+# (currency, report currency) combination.
+#
+# `pairs` are the pairs which may be quoted. By default, these are the pairs
+# between `hub` and every other currency, with the lesser currency as the base.
+# Currency is ordered by market convention priority (EUR, GBP, AUD, NZD, USD,
+# CAD, CHF, JPY), not by name, so this gives e.g. EURUSD and USDJPY.
+#
+# A spanning tree over these pairs is built outward from the hub, and only the
+# pairs on the tree paths to requested currencies are ever fetched.
+#
+# Every cross rate is then computed from the value of each currency in terms of
+# the hub, using full Decimal precision (rather than rounding inverted rates
+# like JPY to Cash precision).
+class CurrencyGraph:
+    def __init__(
+        self,
+        dataProvider: MarketDataProvider,
+        pairs: Optional[Iterable[Forex]] = None,
+        hub: Currency = Currency.USD,
+    ):
+        if pairs is None:
+            pairs = (
+                Forex(baseCurrency=min(c, hub), quoteCurrency=max(c, hub))
+                for c in Currency
+                if c != hub
+            )
+
+        self._dataProvider = dataProvider
+        self._hub = hub
+
+        # Maps each reachable currency to the pair which links it to its parent
+        # in the spanning tree (closer to the hub).
+        self._parentPairs: Dict[Currency, Forex] = {}
+
+        # Value of one unit of each currency in terms of the hub, for those
+        # currencies whose paths have been quoted.
+        self._values: Dict[Currency, Decimal] = {hub: Decimal(1)}
+
+        self._midpoints: Dict[Forex, Decimal] = {}
+        self._requestedPairs = 0
+
+        adjacent: Dict[Currency, List[Forex]] = {}
+        for pair in pairs:
+            adjacent.setdefault(pair.baseCurrency, []).append(pair)
+            adjacent.setdefault(pair.quoteCurrency, []).append(pair)
+
+        queue = deque([hub])
+        while queue:
+            currency = queue.popleft()
+            for pair in adjacent.get(currency, []):
+                other = (
+                    pair.quoteCurrency
+                    if pair.baseCurrency == currency
+                    else pair.baseCurrency
+                )
+
+                if other == hub or other in self._parentPairs:
+                    continue
+
+                self._parentPairs[other] = pair
+                queue.append(other)
+
+    @property
+    def hub(self) -> Currency:
+        return self._hub
+
+    # All currencies which can be converted using this graph.
+    @property
+    def currencies(self) -> AbstractSet[Currency]:
+        return set(self._parentPairs.keys()) | {self._hub}
+
+    # The total number of pairs which have been requested from the data
+    # provider so far.
+    @property
+    def requestedPairs(self) -> int:
+        return self._requestedPairs
+
+    def _parent(self, currency: Currency) -> Currency:
+        pair = self._parentPairs[currency]
+        return (
+            pair.quoteCurrency if pair.baseCurrency == currency else pair.baseCurrency
+        )
+
+    # Returns the pairs linking `currency` to the hub, starting from the hub.
+    def _path(self, currency: Currency) -> List[Forex]:
+        if currency != self._hub and currency not in self._parentPairs:
+            raise ValueError(
+                f"No forex pairs connect {currency} to {self._hub} in {self}"
+            )
+
+        path: List[Forex] = []
+        while currency != self._hub:
+            path.append(self._parentPairs[currency])
+            currency = self._parent(currency)
+
+        path.reverse()
+        return path
+
+    # Fetches quotes for any pairs needed to convert `currencies` which have
+    # not been fetched already.
+    def fetch(self, currencies: Iterable[Currency]) -> None:
+        self._fetchPairs(
+            {
+                pair
+                for c in currencies
+                if c not in self._values
+                for pair in self._path(c)
+                if pair not in self._midpoints
+            }
+        )
+
+    # Re-fetches quotes for all of the pairs needed to convert `currencies`.
+    def refresh(self, currencies: Iterable[Currency]) -> None:
+        self._fetchPairs({pair for c in currencies for pair in self._path(c)})
+
+    def _fetchPairs(self, pairs: AbstractSet[Forex]) -> None:
+        if not pairs:
+            return
+
+        self._requestedPairs += len(pairs)
+        for instrument, quote in self._dataProvider.fetchQuotes(sorted(pairs)):
+            if isinstance(instrument, Forex) and quote.market:
+                self._midpoints[instrument] = quote.market.quantity
+
+        # Recompute values outward from the hub, so that each parent is
+        # computed before its children.
+        self._values = {self._hub: Decimal(1)}
+        for currency in sorted(self._parentPairs, key=lambda c: len(self._path(c))):
+            self._updateValue(currency)
+
+    def _updateValue(self, currency: Currency) -> None:
+        pair = self._parentPairs[currency]
+        midpoint = self._midpoints.get(pair)
+        parentValue = self._values.get(self._parent(currency))
+        if midpoint is None or parentValue is None:
+            return
+
+        if pair.baseCurrency == currency:
+            # One unit of `currency` costs `midpoint` units of the parent.
+            self._values[currency] = midpoint * parentValue
+        else:
+            # One unit of the parent costs `midpoint` units of `currency`.
+            self._values[currency] = parentValue / midpoint
+
+    # Returns how much one unit of `currency` costs in `quoteCurrency`,
+    # fetching quotes first if necessary, or None if a quote along the way is
+    # unavailable.
+    def rate(self, currency: Currency, quoteCurrency: Currency) -> Optional[Decimal]:
+        self.fetch([currency, quoteCurrency])
+        return self._fetchedRate(currency, quoteCurrency)
+
+    # Like rate(), but only from quotes which have already been fetched.
+    def _fetchedRate(
+        self, currency: Currency, quoteCurrency: Currency
+    ) -> Optional[Decimal]:
+        value = self._values.get(currency)
+        quoteValue = self._values.get(quoteCurrency)
+        if value is None or quoteValue is None:
+            return None
+
+        return value / quoteValue
+
+    # Like currencyConversionRates(), but derives all rates from this graph,
+    # and returns them at full precision.
+    #
+    # All of the pairs needed are requested together, once, so a pair which
+    # cannot be quoted is not requested again for each currency which needs it.
+    def conversionRates(
+        self, quoteCurrency: Currency, otherCurrencies: Iterable[Currency]
+    ) -> Iterable[Tuple[Currency, Decimal]]:
+        others = set(otherCurrencies)
+        self.fetch(others | {quoteCurrency})
+
+        for currency in others:
+            rate = self._fetchedRate(currency, quoteCurrency)
+            if rate is not None:
+                yield (currency, rate)
+
+    def __str__(self) -> str:
+        return f"Currency graph around {self._hub.name} with {len(self._parentPairs) + 1} currencies"
+
+
+# A snapshot of conversion rates from other currencies into `baseCurrency`,
+# fetched in as few requests as possible, then reused for any number of
+# conversions.
+#
+# When rates are requested again is decided by `policy` (see FxRefreshPolicy).
+#
+# Rates are quoted directly from `dataProvider`, or, if a CurrencyGraph is
+# given instead, triangulated from it. Sharing one graph among tables for
+# several base currencies avoids quoting the same pairs for each.
+class FxRateTable:
+    def __init__(
+        self,
+        baseCurrency: Currency,
+        dataProvider: Union[MarketDataProvider, CurrencyGraph],
+        currencies: Iterable[Currency] = (),
+        policy: FxRefreshPolicy = FxRefreshPolicy.MISSING,
+        maxAge: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if policy == FxRefreshPolicy.EXPIRED and maxAge is None:
+            raise ValueError(f"Refresh policy {policy} requires a maximum age")
+
+        self._baseCurrency = baseCurrency
+        self._dataProvider = dataProvider
+        self._policy = policy
+        self._maxAge = maxAge
+        self._clock = clock
+
+        self._rates: Dict[Currency, Decimal] = {}
+        self._fetchedAt: Optional[float] = None
+
+        self._fetch(set(currencies) - {baseCurrency})
+
+    @property
+    def baseCurrency(self) -> Currency:
+        return self._baseCurrency
+
+    @property
+    def policy(self) -> FxRefreshPolicy:
+        return self._policy
+
+    # How much one unit of each currency costs in the base currency.
+    @property
+    def rates(self) -> Mapping[Currency, Decimal]:
+        rates = dict(self._rates)
+        rates[self._baseCurrency] = Decimal(1)
+        return rates
+
+    # Seconds since every rate in the table was last fetched at once (so the
+    # age of the oldest rate), or None if they never have been.
+    @property
+    def age(self) -> Optional[float]:
+        if self._fetchedAt is None:
+            return None
+
+        return self._clock() - self._fetchedAt
+
+    @property
+    def isStale(self) -> bool:
+        age = self.age
+        return self._maxAge is not None and age is not None and age >= self._maxAge
+
+    # Fetches fresh rates for `currencies`, in addition to any already in the
+    # table. If `currencies` is None, only the rates already in the table are
+    # refreshed.
+    def refresh(self, currencies: Optional[Iterable[Currency]] = None) -> None:
+        wanted = set(self._rates.keys())
+        if currencies is not None:
+            wanted.update(currencies)
+
+        wanted.discard(self._baseCurrency)
+        self._fetch(wanted, refresh=True)
+
+    def _fetch(self, currencies: AbstractSet[Currency], refresh: bool = False) -> None:
+        if not currencies:
+            return
+
+        # Fetching only some of the table leaves the rest as old as they were.
+        complete = self._rates.keys() <= currencies
+
+        if isinstance(self._dataProvider, CurrencyGraph):
+            if refresh:
+                self._dataProvider.refresh(currencies | {self._baseCurrency})
+
+            self._rates.update(
+                self._dataProvider.conversionRates(
+                    quoteCurrency=self._baseCurrency, otherCurrencies=currencies
+                )
+            )
+        else:
+            self._rates.update(
+                (currency, rate.quantity)
+                for currency, rate in currencyConversionRates(
+                    quoteCurrency=self._baseCurrency,
+                    otherCurrencies=currencies,
+                    dataProvider=self._dataProvider,
+                )
+            )
+
+        if complete:
+            self._fetchedAt = self._clock()
+
+    # Returns the rates for all of `currencies`, fetching them first if the
+    # policy allows.
+    def _ratesFor(self, currencies: AbstractSet[Currency]) -> Dict[Currency, Decimal]:
+        if self._policy == FxRefreshPolicy.EXPIRED and self.isStale:
+            self.refresh(currencies)
+        elif self._policy != FxRefreshPolicy.MANUAL:
+            self._fetch(
+                {
+                    c
+                    for c in currencies
+                    if c != self._baseCurrency and c not in self._rates
+                }
+            )
+
+        rates = {self._baseCurrency: Decimal(1)}
+        for currency in currencies:
+            if currency == self._baseCurrency:
+                continue
+
+            rate = self._rates.get(currency)
+            if rate is None:
+                raise RuntimeError(
+                    f"Unable to fetch currency rate for {currency} to convert into {self._baseCurrency}"
+                )
+
+            rates[currency] = rate
+
+        return rates
+
+    def convert(self, cash: Cash) -> Cash:
+        return self.convertMany([cash])[0]
+
+    @overload
+    def convertMany(self, values: Iterable[Cash]) -> List[Cash]:
+        pass
+
+    @overload
+    def convertMany(self, values: Any, currencies: Any) -> Any:
+        pass
+
+    # Converts many values into the base currency at once, requesting quotes
+    # for all of the currencies involved (if needed) in a single batch.
+    #
+    # `values` may be an iterable of Cash, in which case a list of converted
+    # Cash is returned in the same order. Alternatively, `values` may be a
+    # pandas Series (e.g., a DataFrame column) of quantities, with `currencies`
+    # a Series of the Currency for each row; the result is then a Series of
+    # quantities in the base currency.
+    def convertMany(self, values: Any, currencies: Any = None) -> Any:
+        if currencies is not None:
+            return self._convertColumn(values, currencies)
+
+        cash = list(values)
+        rates = self._ratesFor({c.currency for c in cash})
+        return [
+            Cash(currency=self._baseCurrency, quantity=c.quantity * rates[c.currency])
+            for c in cash
+        ]
+
+    def _convertColumn(self, values: Any, currencies: Any) -> Any:
+        rates = self._ratesFor(set(currencies))
+        factors = currencies.map(rates)
+
+        if values.dtype.kind in "fiu":
+            # Decimals cannot be multiplied with floats, so use float rates for
+            # numeric columns.
+            factors = factors.map(float)
+
+        return values * factors
+
+    def __str__(self) -> str:
+        rates = ", ".join(
+            f"{currency.name}={rate}"
+            for currency, rate in sorted(
+                self._rates.items(), key=lambda item: item[0].name
+            )
+        )
+        return f"FX rates into {self._baseCurrency.name}: {rates}"
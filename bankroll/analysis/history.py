@@ -0,0 +1,456 @@
+import asyncio
+import inspect
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Iterable, List, Optional, Union, cast
+
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+
+from bankroll.marketdata import MarketDataProvider
+from bankroll.model import Instrument
+
+from . import ibkr
+
+# The columns of daily bars, as returned by IBDataProvider.fetchHistoricalData().
+barColumns = ["date", "open", "high", "low", "close", "volume", "barCount", "average"]
+
+_barDtype = np.dtype(
+    [("date", "datetime64[D]")] + [(column, np.float64) for column in barColumns[1:]]
+)
+
+
+# Keeps daily bars for each instrument on disk, in one NumPy file per
+# instrument (which is memory-mapped when read), so that historical data only
+# has to be fetched once.
+#
+# When bars are requested, only days after the last cached bar are fetched and
+# appended. Providers whose fetchHistoricalData() accepts a `start` keyword
+# argument (and IBDataProvider, via fetchHistoryAsync()) are asked for just
+# that range; other providers return their full history, of which only the new
+# bars are kept.
+#
+# Only completed days are cached, so today's (possibly partial) bar is never
+# returned. `lookback` limits how far back returned bars go, but does not
+# affect what is kept on disk.
+class HistoricalBarCache:
+    defaultLookback = timedelta(days=365)
+
+    def __init__(
+        self, directory: Union[str, Path], lookback: timedelta = defaultLookback
+    ):
+        self._directory = Path(directory).expanduser()
+        self._lookback = lookback
+
+    @property
+    def directory(self) -> Path:
+        return self._directory
+
+    @property
+    def lookback(self) -> timedelta:
+        return self._lookback
+
+    def pathForInstrument(self, instrument: Instrument) -> Path:
+        symbol = re.sub(r"[^A-Za-z0-9]+", "_", instrument.symbol)
+        return (
+            self._directory
+            / f"{type(instrument).__name__}-{symbol}-{instrument.currency.name}.npy"
+        )
+
+    # Returns the cached bars for `instrument` (memory-mapped), or None if
+    # nothing has been cached yet.
+    def cachedBars(self, instrument: Instrument) -> Optional[np.ndarray]:
+        path = self.pathForInstrument(instrument)
+        try:
+            return np.load(path, mmap_mode="r")
+        except FileNotFoundError:
+            return None
+
+    # Returns daily bars for `instrument` within the lookback window, fetching
+    # any missing days from `provider` first. Returns None if no bars are
+    # available.
+    def bars(
+        self,
+        instrument: Instrument,
+        provider: MarketDataProvider,
+        today: Optional[date] = None,
+    ) -> Optional[pd.DataFrame]:
+        if today is None:
+            today = date.today()
+
+        path = self.pathForInstrument(instrument)
+        cached = self.cachedBars(instrument)
+
+        if not self._isFresh(path, cached, today):
+            fetched = fetchHistoricalData(provider, instrument, _nextDay(cached))
+            cached = self._append(path, cached, fetched, today)
+
+        return self._window(cached, today)
+
+    # Like bars(), but awaits `fetch` for any missing days, instead of calling
+    # a provider. `fetch` is passed the first missing day, or None if nothing
+    # is cached.
+    async def _barsAsync(
+        self,
+        instrument: Instrument,
+        fetch: Callable[[Optional[date]], Awaitable[Optional[pd.DataFrame]]],
+        today: Optional[date] = None,
+    ) -> Optional[pd.DataFrame]:
+        if today is None:
+            today = date.today()
+
+        path = self.pathForInstrument(instrument)
+        cached = self.cachedBars(instrument)
+
+        if not self._isFresh(path, cached, today):
+            fetched = await fetch(_nextDay(cached))
+            cached = self._append(path, cached, fetched, today)
+
+        return self._window(cached, today)
+
+    def _window(
+        self, cached: Optional[np.ndarray], today: date
+    ) -> Optional[pd.DataFrame]:
+        if cached is None or len(cached) == 0:
+            return None
+
+        window = cached[cached["date"] >= np.datetime64(today - self._lookback, "D")]
+        return pd.DataFrame(
+            {
+                column: (
+                    window[column].astype("datetime64[ns]")
+                    if column == "date"
+                    else np.array(window[column])
+                )
+                for column in barColumns
+            }
+        )
+
+    # Cached bars are fresh if they include the last completed weekday, or if
+    # the cache was already checked today (e.g., on a market holiday).
+    def _isFresh(self, path: Path, cached: Optional[np.ndarray], today: date) -> bool:
+        if cached is None:
+            return False
+
+        lastCompleteDay = np.busday_offset(
+            np.datetime64(today, "D"), -1, roll="forward"
+        )
+        if len(cached) > 0 and cached["date"][-1] >= lastCompleteDay:
+            return True
+
+        return date.fromtimestamp(path.stat().st_mtime) >= today
+
+    def _append(
+        self,
+        path: Path,
+        cached: Optional[np.ndarray],
+        fetched: Optional[pd.DataFrame],
+        today: date,
+    ) -> Optional[np.ndarray]:
+        if fetched is None:
+            return cached
+
+        bars = _barsToRecords(fetched)
+        bars = bars[bars["date"] < np.datetime64(today, "D")]
+
+        if cached is not None and len(cached) > 0:
+            bars = bars[bars["date"] > cached["date"][-1]]
+            if len(bars) == 0:
+                # Remember that the cache was checked, so it isn't fetched
+                # again today.
+                path.touch()
+                return cached
+
+            bars = np.concatenate([np.array(cached), bars])
+
+        self._directory.mkdir(parents=True, exist_ok=True)
+
+        # Write to a temporary file first, so readers never observe a partially
+        # written file (and existing memory maps remain valid).
+        fd, tmp = tempfile.mkstemp(dir=str(self._directory), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, bars)
+
+        os.replace(tmp, str(path))
+        return bars
+
+    # Deletes cached bars for the given instruments, or for every instrument if
+    # None. Returns the number of files removed.
+    def invalidate(self, instruments: Optional[Iterable[Instrument]] = None) -> int:
+        if instruments is None:
+            paths = list(self._directory.glob("*.npy"))
+        else:
+            paths = [self.pathForInstrument(i) for i in instruments]
+
+        return _unlinkAll(paths)
+
+    # Deletes cached bars for any instrument with one of the given symbols.
+    # Returns the number of files removed.
+    def invalidateSymbols(self, symbols: Iterable[str]) -> int:
+        symbolNames = {re.sub(r"[^A-Za-z0-9]+", "_", s).upper() for s in symbols}
+        return _unlinkAll(
+            p
+            for p in self._directory.glob("*.npy")
+            if p.stem.split("-")[1].upper() in symbolNames
+        )
+
+    def __str__(self) -> str:
+        return f"Historical bar cache in {self._directory}"
+
+
+def _nextDay(cached: Optional[np.ndarray]) -> Optional[date]:
+    if cached is None or len(cached) == 0:
+        return None
+
+    day: date = (cached["date"][-1] + 1).astype(date)
+    return day
+
+
+def _unlinkAll(paths: Iterable[Path]) -> int:
+    count = 0
+    for path in paths:
+        try:
+            path.unlink()
+            count += 1
+        except FileNotFoundError:
+            pass
+
+    return count
+
+
+# Fetches daily bars for `instrument` from `provider`, starting from `start` if
+# the provider supports it (otherwise, its full history is returned).
+def fetchHistoricalData(
+    provider: MarketDataProvider, instrument: Instrument, start: Optional[date] = None
+) -> Optional[pd.DataFrame]:
+    # FIXME: fetchHistoricalData() is specific to IBDataProvider right now
+    fetch = provider.fetchHistoricalData  # type: ignore
+
+    if start is not None and "start" in inspect.signature(fetch).parameters:
+        result: Optional[pd.DataFrame] = fetch(instrument, start=start)
+    else:
+        result = fetch(instrument)
+
+    return result
+
+
+async def _fetchIBHistoricalData(
+    client: Any, instrument: Instrument, start: Optional[date]
+) -> Optional[pd.DataFrame]:
+    bars = await ibkr.fetchHistoricalBarsAsync(client, instrument, start=start)
+    if not bars:
+        return None
+
+    return pd.DataFrame(
+        [[getattr(bar, column) for column in barColumns] for bar in bars],
+        columns=barColumns,
+    )
+
+
+def _barsToRecords(bars: pd.DataFrame) -> np.ndarray:
+    records = np.empty(len(bars), dtype=_barDtype)
+    records["date"] = pd.to_datetime(bars["date"]).values.astype("datetime64[D]")
+    for column in barColumns[1:]:
+        records[column] = (
+            bars[column].to_numpy(dtype=np.float64) if column in bars else np.nan
+        )
+
+    return np.sort(records, order="date")
+
+
+# The outcome of fetching historical data for one instrument.
+@dataclass(frozen=True)
+class HistoryResult:
+    instrument: Instrument
+
+    # None if no data was available, or fetching failed.
+    bars: Optional[pd.DataFrame]
+
+    # The error from the last attempt, if every attempt failed.
+    error: Optional[BaseException]
+
+    attempts: int
+    seconds: float
+
+    @property
+    def succeeded(self) -> bool:
+        return self.bars is not None
+
+    def __str__(self) -> str:
+        if self.bars is not None:
+            outcome = f"{len(self.bars)} bars"
+        elif self.error is not None:
+            outcome = f"failed ({type(self.error).__name__}: {self.error})"
+        else:
+            outcome = "no data"
+
+        return f"{self.instrument.symbol}: {outcome} after {self.attempts} attempt(s) in {self.seconds:.1f}s"
+
+
+# Per-instrument results from fetchHistory(), in the order requested.
+@dataclass(frozen=True)
+class HistoryReport:
+    results: List[HistoryResult]
+
+    @property
+    def succeeded(self) -> List[HistoryResult]:
+        return [r for r in self.results if r.succeeded]
+
+    @property
+    def failed(self) -> List[HistoryResult]:
+        return [r for r in self.results if not r.succeeded]
+
+    def __str__(self) -> str:
+        return "\n".join(
+            [
+                f"Fetched history for {len(self.succeeded)} of {len(self.results)} instrument(s)"
+            ]
+            + [f"\t{r}" for r in self.failed]
+        )
+
+
+defaultMaxConcurrency = 4
+
+
+# Fetches historical data for many instruments at once, with at most
+# `maxConcurrency` requests in flight, so that providers' pacing limits are
+# respected but one slow instrument doesn't hold up the rest.
+#
+# An IBDataProvider is queried with ib_insync's asynchronous API, which must
+# be awaited on the event loop its connection was made on (see
+# bankroll.analysis.ibkr). Other providers are called on a pool of
+# `maxConcurrency` threads.
+#
+# Each attempt is abandoned after `timeout` seconds (if not None), and failed
+# attempts are retried up to `retries` more times, waiting `retryDelay`
+# seconds (doubling each time) in between. Note that an abandoned attempt
+# still occupies its thread until the provider returns.
+#
+# If `cache` is provided, bars are read from (and saved to) the cache.
+async def fetchHistoryAsync(
+    provider: MarketDataProvider,
+    instruments: Iterable[Instrument],
+    cache: Optional[HistoricalBarCache] = None,
+    maxConcurrency: int = defaultMaxConcurrency,
+    timeout: Optional[float] = None,
+    retries: int = 0,
+    retryDelay: float = 1.0,
+) -> HistoryReport:
+    if maxConcurrency < 1:
+        raise ValueError(f"Concurrency limit must be positive: {maxConcurrency}")
+
+    loop = asyncio.get_event_loop()
+    client = ibkr.ibClient(provider)
+    executor = (
+        ThreadPoolExecutor(
+            max_workers=maxConcurrency, thread_name_prefix="bankroll-history"
+        )
+        if client is None
+        else None
+    )
+    semaphore = asyncio.Semaphore(maxConcurrency)
+
+    async def fetchFromProvider(
+        instrument: Instrument, start: Optional[date]
+    ) -> Optional[pd.DataFrame]:
+        if client is not None:
+            return await _fetchIBHistoricalData(client, instrument, start)
+
+        bars: Optional[pd.DataFrame] = await loop.run_in_executor(
+            executor, fetchHistoricalData, provider, instrument, start
+        )
+        return bars
+
+    async def fetch(instrument: Instrument) -> Optional[pd.DataFrame]:
+        if cache:
+            return await cache._barsAsync(
+                instrument, lambda start: fetchFromProvider(instrument, start)
+            )
+        else:
+            return await fetchFromProvider(instrument, None)
+
+    async def fetchWithRetries(instrument: Instrument) -> HistoryResult:
+        started = time.monotonic()
+        error: Optional[BaseException] = None
+
+        for attempt in range(1, retries + 2):
+            if attempt > 1:
+                await asyncio.sleep(retryDelay * 2 ** (attempt - 2))
+
+            try:
+                async with semaphore:
+                    bars = await asyncio.wait_for(fetch(instrument), timeout)
+
+                return HistoryResult(
+                    instrument=instrument,
+                    bars=bars,
+                    error=None,
+                    attempts=attempt,
+                    seconds=time.monotonic() - started,
+                )
+            except asyncio.CancelledError:
+                # Still an Exception before Python 3.8.
+                raise
+            except Exception as err:
+                error = err
+
+        return HistoryResult(
+            instrument=instrument,
+            bars=None,
+            error=error,
+            attempts=retries + 1,
+            seconds=time.monotonic() - started,
+        )
+
+    try:
+        results = await asyncio.gather(*(fetchWithRetries(i) for i in instruments))
+    finally:
+        # Don't wait for abandoned attempts to finish.
+        if executor:
+            executor.shutdown(wait=False)
+
+    return HistoryReport(results=list(results))
+
+
+# A synchronous version of fetchHistoryAsync().
+def fetchHistory(
+    provider: MarketDataProvider,
+    instruments: Iterable[Instrument],
+    cache: Optional[HistoricalBarCache] = None,
+    maxConcurrency: int = defaultMaxConcurrency,
+    timeout: Optional[float] = None,
+    retries: int = 0,
+    retryDelay: float = 1.0,
+) -> HistoryReport:
+    report = fetchHistoryAsync(
+        provider,
+        instruments,
+        cache=cache,
+        maxConcurrency=maxConcurrency,
+        timeout=timeout,
+        retries=retries,
+        retryDelay=retryDelay,
+    )
+
+    client = ibkr.ibClient(provider)
+    if client is not None:
+        # Run on the loop the connection was made on, as ib_insync's own
+        # synchronous API does (which also works in a notebook, after
+        # ib_insync.util.startLoop()).
+        return cast(HistoryReport, client.run(report))
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(report)
+
+    # asyncio.run() cannot be called while another event loop is running on
+    # this thread (e.g., in a notebook), so use a thread of its own.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return cast(HistoryReport, executor.submit(asyncio.run, report).result())
@@ -0,0 +1,163 @@
+import math
+import sys
+from datetime import date
+from decimal import Decimal
+from typing import Any, Iterable, List, Optional, Sequence, Tuple
+
+from bankroll.marketdata import MarketDataProvider
+from bankroll.model import Cash, Currency, Instrument, Quote
+
+# Asynchronous access to Interactive Brokers market data.
+#
+# ib_insync's synchronous API runs the event loop its connection was made on
+# until each request completes. It therefore cannot be used from other threads,
+# nor from a coroutine already running on that loop. These functions use its
+# asynchronous API instead, and must be awaited on the loop the connection was
+# made on (as is the case in a notebook after ib_insync.util.startLoop(), or
+# when run with IB.run()).
+
+# https://interactivebrokers.github.io/tws-api/market_data_type.html
+_delayedFrozenMarketData = 4
+
+
+# A MarketDataProvider for Interactive Brokers which can also be used with the
+# asynchronous functions in bankroll.analysis, given the ib_insync client to use
+# (e.g., IBAccount.client from the optional bankroll.brokers.ibkr plugin).
+#
+# Synchronous requests go through the plugin's own IBDataProvider. It has no
+# asynchronous API, nor any public way to get at its client, so those requests
+# are made by the functions below instead.
+class IBMarketDataProvider(MarketDataProvider):
+    def __init__(self, client: Any):
+        self._client = client
+        super().__init__()
+
+    @property
+    def client(self) -> Any:
+        return self._client
+
+    def _provider(self) -> MarketDataProvider:
+        from bankroll.brokers.ibkr import IBDataProvider
+
+        return IBDataProvider(self._client)
+
+    def fetchQuotes(
+        self, instruments: Iterable[Instrument]
+    ) -> Iterable[Tuple[Instrument, Quote]]:
+        return self._provider().fetchQuotes(instruments)
+
+    def fetchHistoricalData(self, instrument: Instrument) -> Any:
+        # FIXME: fetchHistoricalData() is specific to IBDataProvider right now
+        return self._provider().fetchHistoricalData(instrument)  # type: ignore
+
+
+# Returns an IBMarketDataProvider for `account`, if it is an IBAccount from the
+# (optional) bankroll.brokers.ibkr plugin which is connected to TWS, or None
+# otherwise.
+def accountDataProvider(account: Any) -> Optional[IBMarketDataProvider]:
+    # If the plugin was never imported, this cannot be one of its accounts.
+    module = sys.modules.get("bankroll.brokers.ibkr")
+    if module is None or not isinstance(account, getattr(module, "IBAccount")):
+        return None
+
+    client = account.client
+    return IBMarketDataProvider(client) if client is not None else None
+
+
+# Returns the ib_insync client behind `provider`, if it is an
+# IBMarketDataProvider (possibly wrapped in a CachingMarketDataProvider), or
+# None otherwise.
+def ibClient(provider: MarketDataProvider) -> Optional[Any]:
+    # If bankroll.analysis.caching (which imports pandas) was never imported,
+    # this cannot be a caching provider.
+    caching = sys.modules.get("bankroll.analysis.caching")
+    if caching is not None:
+        while isinstance(provider, getattr(caching, "CachingMarketDataProvider")):
+            provider = getattr(provider, "underlying")
+
+    if not isinstance(provider, IBMarketDataProvider):
+        return None
+
+    return provider.client
+
+
+def _price(value: Optional[float], instrument: Instrument) -> Optional[Cash]:
+    if not value or not math.isfinite(value):
+        return None
+
+    # Tickers are quoted in GBX despite all the other data being in GBP.
+    factor = 100 if instrument.currency == Currency.GBP else 1
+    return Cash(currency=instrument.currency, quantity=Decimal(value) / factor)
+
+
+# Converts a ticker the same way IBDataProvider.fetchQuotes() does.
+def _quoteFromTicker(instrument: Instrument, ticker: Any) -> Quote:
+    return Quote(
+        bid=_price(ticker.bid, instrument) if ticker.bidSize != 0 else None,
+        ask=_price(ticker.ask, instrument) if ticker.askSize != 0 else None,
+        last=_price(ticker.last, instrument) if ticker.lastSize != 0 else None,
+        close=_price(ticker.close, instrument),
+    )
+
+
+# An asynchronous counterpart to IBDataProvider.fetchQuotes().
+async def fetchQuotesAsync(
+    client: Any, instruments: Sequence[Instrument]
+) -> List[Tuple[Instrument, Quote]]:
+    from bankroll.brokers.ibkr import contract
+
+    client.reqMarketDataType(_delayedFrozenMarketData)
+
+    contracts = [contract(i) for i in instruments]
+    await client.qualifyContractsAsync(*contracts)
+
+    # Tickers are returned in the same order as the contracts requested.
+    tickers = await client.reqTickersAsync(*contracts)
+    return [
+        (instrument, _quoteFromTicker(instrument, ticker))
+        for instrument, ticker in zip(instruments, tickers)
+    ]
+
+
+# How far back IBDataProvider.fetchHistoricalData() goes, which is also used
+# here when no start date is given.
+_maximumDuration = "10 Y"
+
+
+# Returns the duration string for bars from `start` up to `today`, in days if
+# possible. IB only accepts durations over 365 days in whole years.
+def _durationSince(start: date, today: date) -> str:
+    days = max((today - start).days + 1, 1)
+    if days <= 365:
+        return f"{days} D"
+
+    return f"{math.ceil(days / 365)} Y"
+
+
+# An asynchronous counterpart to IBDataProvider.fetchHistoricalData(), which
+# returns ib_insync's bars rather than a DataFrame of them.
+#
+# If `start` is given, only bars since then are requested (although IB may
+# return some earlier ones too).
+async def fetchHistoricalBarsAsync(
+    client: Any, instrument: Instrument, start: Optional[date] = None
+) -> List[Any]:
+    from bankroll.brokers.ibkr import contract
+
+    c = contract(instrument)
+    await client.qualifyContractsAsync(c)
+
+    bars = await client.reqHistoricalDataAsync(
+        c,
+        endDateTime="",
+        durationStr=(
+            _durationSince(start, date.today())
+            if start is not None
+            else _maximumDuration
+        ),
+        barSizeSetting="1 day",
+        whatToShow="TRADES",
+        useRTH=True,
+        formatDate=1,
+    )
+    return list(bars)
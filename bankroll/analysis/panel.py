@@ -0,0 +1,144 @@
+from enum import Enum, unique
+from functools import reduce
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+
+from .history import barColumns
+
+
+@unique
+class PanelAlignment(Enum):
+    """
+    How to align instruments whose bars cover different dates.
+    """
+
+    # Keep only dates on which every instrument has a bar.
+    INNER = "inner"
+
+    # Keep every date on which any instrument has a bar. Where an instrument
+    # has no bar, its last close is carried forward as its price (with zero
+    # volume). Dates before an instrument's first bar remain NaN.
+    FORWARD_FILL = "ffill"
+
+
+class PricePanel:
+    """
+    Daily bars and weights for a basket of instruments, stored as one contiguous float64 array of shape (field x date x instrument), with a shared trading calendar.
+    """
+
+    fields: Sequence[str] = barColumns[1:] + ["weight"]
+
+    def __init__(
+        self, values: np.ndarray, dates: pd.DatetimeIndex, instruments: List[str]
+    ):
+        if values.shape != (len(self.fields), len(dates), len(instruments)):
+            raise ValueError(
+                f"Panel values of shape {values.shape} do not match {len(self.fields)} fields, {len(dates)} dates, and {len(instruments)} instruments"
+            )
+
+        self.values = values
+        self.dates = dates
+        self.instruments = instruments
+
+    def field(self, name: str) -> np.ndarray:
+        """
+        Returns a (date x instrument) view of one field.
+        """
+        return self.values[self.fields.index(name)]
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Returns the panel as a DataFrame indexed by (field, date), with one column per instrument, like stocks_to_portfolio() but without its "date" field.
+        """
+        index = pd.MultiIndex.from_product(
+            [self.fields, self.dates], names=["field", "date"]
+        )
+        frame = pd.DataFrame(
+            self.values.reshape(-1, len(self.instruments)),
+            index=index,
+            columns=self.instruments,
+        )
+        return frame.sort_index()
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def __repr__(self) -> str:
+        return (
+            f"PricePanel({len(self.dates)} dates x {len(self.instruments)} instruments)"
+        )
+
+
+def bars_to_panel(
+    components: Dict[str, pd.DataFrame],
+    weights: Dict[str, float],
+    alignment: PanelAlignment = PanelAlignment.INNER,
+) -> PricePanel:
+    """
+    Aligns daily bars for many instruments into a PricePanel, allocating the panel only once.
+
+    @param components: Bars for each instrument, in the format of IBDataProvider.fetchHistoricalData().
+    @param weights: The weight of each instrument in the basket.
+    @param alignment: How to handle dates which some instruments are missing.
+    """
+    instruments = list(components.keys())
+    fields = PricePanel.fields
+    bar_fields = barColumns[1:]
+
+    # Sort each instrument's bars by date into a (field x date) array, keeping
+    # only the last bar for any date.
+    bars: List[Tuple[np.ndarray, np.ndarray]] = []
+    for key in instruments:
+        val = components[key]
+        if val.empty:
+            bars.append(
+                (np.array([], dtype="datetime64[ns]"), np.empty((len(bar_fields), 0)))
+            )
+            continue
+
+        dates = pd.DatetimeIndex(val["date"]).values
+        order = np.argsort(dates, kind="stable")
+        dates = dates[order]
+        keep = np.append(dates[1:] != dates[:-1], True)
+        columns = np.empty((len(bar_fields), int(keep.sum())))
+        for f, column in enumerate(bar_fields):
+            columns[f] = val[column].to_numpy(dtype=np.float64)[order][keep]
+
+        bars.append((dates[keep], columns))
+
+    calendar = np.array([], dtype="datetime64[ns]")
+    if bars:
+        combine = np.intersect1d if alignment == PanelAlignment.INNER else np.union1d
+        calendar = reduce(combine, (dates for dates, _ in bars))
+
+    values = np.full((len(fields), len(calendar), len(instruments)), np.nan)
+    index = pd.DatetimeIndex(calendar, name="date")
+    if len(calendar) == 0:
+        return PricePanel(values, index, instruments)
+
+    close_field = fields.index("close")
+    for i, (key, (dates, columns)) in enumerate(zip(instruments, bars)):
+        # Instruments without any bars remain NaN on every date.
+        if len(dates) == 0:
+            continue
+
+        # The index of the last bar on or before each calendar date.
+        rows = np.searchsorted(dates, calendar, side="right") - 1
+        present = rows >= 0
+        if alignment == PanelAlignment.INNER:
+            present &= dates[np.maximum(rows, 0)] == calendar
+
+        values[: len(bar_fields), present, i] = columns[:, rows[present]]
+        values[fields.index("weight"), present, i] = weights[key]
+
+        if alignment == PanelAlignment.FORWARD_FILL:
+            filled = present & (dates[np.maximum(rows, 0)] != calendar)
+            for column in ["open", "high", "low", "average"]:
+                values[fields.index(column), filled, i] = values[close_field, filled, i]
+
+            values[fields.index("volume"), filled, i] = 0.0
+            values[fields.index("barCount"), filled, i] = 0.0
+
+    return PricePanel(values, index, instruments)
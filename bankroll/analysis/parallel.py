@@ -0,0 +1,284 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from functools import partial
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from bankroll.model import (
+    Activity,
+    Cash,
+    CashPayment,
+    Currency,
+    Instrument,
+    Trade,
+    TradeFlags,
+)
+
+from .aggregation import _cashScale, _quantityScale
+from .analysis import (
+    ActivityIndex,
+    CompactTimeline,
+    _realizedBasis,
+    _timelineDeltas,
+    normalizeSymbol,
+)
+
+# One activity, flattened into plain values, which pickle much faster than
+# model objects (with their nested Cash, Instrument, and enum values):
+#
+#   (date, instrument, quantity, amount, currency, fees, feesCurrency, flags)
+#
+# `instrument` indexes into a table of instruments sent alongside (-1 if none).
+# Quantities and amounts are integer multiples of their quantization, which is
+# exact, as the model always quantizes them. `flags` is None for cash payments.
+_EncodedActivity = Tuple[datetime, int, int, int, str, int, str, Optional[int]]
+
+
+# All of the activity affecting one symbol, in date order, to be analyzed in a
+# worker process.
+class _Partition(NamedTuple):
+    symbol: str
+    instruments: List[Instrument]
+    activity: List[_EncodedActivity]
+    timeline: bool
+    checkpointInterval: int
+
+
+# The realized basis and timeline of one symbol, as calculated by
+# analyzeSymbols().
+#
+# If analysis failed (e.g., because the symbol's activity mixes currencies),
+# `error` describes why, and the other fields are empty.
+@dataclass(frozen=True)
+class SymbolAnalysis:
+    # Normalized, as by normalizeSymbol().
+    symbol: str
+
+    realizedBasis: Optional[Cash]
+
+    # None if timelines were not requested.
+    timeline: Optional[CompactTimeline]
+
+    error: Optional[str] = None
+
+
+def _units(quantity: Decimal, scale: Decimal) -> int:
+    return int(quantity * scale)
+
+
+def _cash(currency: str, units: int) -> Cash:
+    return Cash(currency=Currency[currency], quantity=Decimal(units) / _cashScale)
+
+
+def _encodePartition(
+    symbol: str, activity: Sequence[Activity], timeline: bool, checkpointInterval: int
+) -> _Partition:
+    codes: Dict[Instrument, int] = {}
+    encoded: List[_EncodedActivity] = []
+
+    for a in activity:
+        if isinstance(a, Trade):
+            encoded.append(
+                (
+                    a.date,
+                    codes.setdefault(a.instrument, len(codes)),
+                    _units(a.quantity, _quantityScale),
+                    _units(a.amount.quantity, _cashScale),
+                    a.amount.currency.name,
+                    _units(a.fees.quantity, _cashScale),
+                    a.fees.currency.name,
+                    a.flags.value,
+                )
+            )
+        elif isinstance(a, CashPayment):
+            encoded.append(
+                (
+                    a.date,
+                    codes.setdefault(a.instrument, len(codes)) if a.instrument else -1,
+                    0,
+                    _units(a.proceeds.quantity, _cashScale),
+                    a.proceeds.currency.name,
+                    0,
+                    a.proceeds.currency.name,
+                    None,
+                )
+            )
+        else:
+            raise ValueError(f"Unexpected type of activity: {a}")
+
+    return _Partition(
+        symbol=symbol,
+        instruments=list(codes),
+        activity=encoded,
+        timeline=timeline,
+        checkpointInterval=checkpointInterval,
+    )
+
+
+def _decodeActivity(partition: _Partition) -> List[Activity]:
+    instruments = partition.instruments
+    activity: List[Activity] = []
+
+    for encoded in partition.activity:
+        date, code, quantity, amount, currency, fees, feesCurrency, flags = encoded
+        if flags is None:
+            activity.append(
+                CashPayment(
+                    date=date,
+                    instrument=instruments[code] if code >= 0 else None,
+                    proceeds=_cash(currency, amount),
+                )
+            )
+        else:
+            activity.append(
+                Trade(
+                    date=date,
+                    instrument=instruments[code],
+                    quantity=Decimal(quantity) / _quantityScale,
+                    amount=_cash(currency, amount),
+                    fees=_cash(feesCurrency, fees),
+                    flags=TradeFlags(flags),
+                )
+            )
+
+    return activity
+
+
+def _analyzeLocally(
+    symbol: str, activity: Sequence[Activity], timeline: bool, checkpointInterval: int
+) -> SymbolAnalysis:
+    try:
+        return SymbolAnalysis(
+            symbol=symbol,
+            realizedBasis=_realizedBasis(activity),
+            timeline=CompactTimeline(
+                _timelineDeltas(activity), checkpointInterval=checkpointInterval
+            )
+            if timeline
+            else None,
+        )
+    except ValueError as err:
+        return SymbolAnalysis(
+            symbol=symbol, realizedBasis=None, timeline=None, error=str(err)
+        )
+
+
+# Runs in a worker process. The whole result is built here, including the
+# timeline, so that the parent process only has to unpickle it.
+def _analyzePartition(partition: _Partition) -> SymbolAnalysis:
+    return _analyzeLocally(
+        partition.symbol,
+        _decodeActivity(partition),
+        partition.timeline,
+        partition.checkpointInterval,
+    )
+
+
+# The activity being analyzed, in worker processes which were forked with it
+# (see _initializeWorker()).
+_workerIndex: Optional[ActivityIndex] = None
+
+
+def _initializeWorker(index: ActivityIndex) -> None:
+    global _workerIndex
+    _workerIndex = index
+
+
+# Like _analyzePartition(), but runs in a worker process which already has the
+# activity, so only the symbol is sent to it.
+def _analyzeSymbol(
+    symbol: str, timeline: bool, checkpointInterval: int
+) -> SymbolAnalysis:
+    assert _workerIndex is not None
+    return _analyzeLocally(
+        symbol, _workerIndex.activityForSymbol(symbol), timeline, checkpointInterval
+    )
+
+
+# Calculates the realized basis and (if `timelines` is true) the timeline of
+# each of `symbols`, or of every underlying symbol in `activity` if None (see
+# ActivityIndex.underlyingSymbols), in `jobs` worker processes (by default,
+# one per CPU).
+#
+# Where worker processes are forked (as on Linux), they inherit the activity,
+# so only symbols are sent to them. Otherwise, activity is partitioned by
+# normalized symbol (see ActivityIndex), and each partition is flattened into
+# plain values before being sent to a worker, which is much cheaper than
+# pickling the model objects. Either way, workers return finished results, so
+# the parent process does no analysis of its own.
+#
+# Yields results in sorted order of symbol, regardless of which worker
+# finishes first. Results are the same as from realizedBasisForSymbol() and
+# compactTimelineForSymbol(), except that failures are reported through
+# SymbolAnalysis.error instead of being raised.
+def analyzeSymbols(
+    activity: Union[Iterable[Activity], ActivityIndex],
+    symbols: Optional[Iterable[str]] = None,
+    jobs: Optional[int] = None,
+    timelines: bool = True,
+    checkpointInterval: int = CompactTimeline.defaultCheckpointInterval,
+) -> Iterator[SymbolAnalysis]:
+    index = activity if isinstance(activity, ActivityIndex) else ActivityIndex(activity)
+    if symbols is None:
+        symbolList = sorted(index.underlyingSymbols)
+    else:
+        symbolList = sorted({normalizeSymbol(s) for s in symbols})
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if jobs < 1:
+        raise ValueError(f"Number of jobs must be positive: {jobs}")
+
+    if jobs == 1 or len(symbolList) < 2:
+        for symbol in symbolList:
+            yield _analyzeLocally(
+                symbol, index.activityForSymbol(symbol), timelines, checkpointInterval
+            )
+
+        return
+
+    # Batch small partitions, to reduce the overhead of each round trip.
+    chunksize = max(1, len(symbolList) // (jobs * 4))
+
+    context = multiprocessing.get_context()
+    if context.get_start_method() == "fork":
+        with ProcessPoolExecutor(
+            max_workers=jobs,
+            mp_context=context,
+            initializer=_initializeWorker,
+            initargs=(index,),
+        ) as executor:
+            yield from executor.map(
+                partial(
+                    _analyzeSymbol,
+                    timeline=timelines,
+                    checkpointInterval=checkpointInterval,
+                ),
+                symbolList,
+                chunksize=chunksize,
+            )
+
+        return
+
+    partitions = (
+        _encodePartition(
+            symbol, index.activityForSymbol(symbol), timelines, checkpointInterval
+        )
+        for symbol in symbolList
+    )
+
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context) as executor:
+        yield from executor.map(_analyzePartition, partitions, chunksize=chunksize)
@@ -1,21 +1,97 @@
+import logging
 import math
 import pandas as pd  # type: ignore
 import numpy as np  # type: ignore
 import pyfolio as pf  # type: ignore
-from typing import Optional, List, Dict, Iterable, Tuple
+from typing import Any, Optional, List, Dict, Iterable, Tuple, Union
 from decimal import Decimal
 from bankroll.model import *
 from bankroll.marketdata import *
 from dataclasses import asdict
 
+from .analysis import CompactTimeline
+from .history import HistoricalBarCache, defaultMaxConcurrency, fetchHistory
+from .panel import PanelAlignment, PricePanel, bars_to_panel
 
-def etf(portfolio: pd.DataFrame, timezone: str) -> pd.Series:
+
+def etf(
+    portfolio: Union[PricePanel, pd.DataFrame], timezone: str, reference: bool = False
+) -> pd.Series:
     """
     Returns a time series representing the investment of $1 in a basket of instruments weighted proportionally by the given weights.
 
-    @param portfolio: A DataFrame of instruments containing open, close, and weight data indexed by Date.
+    @param portfolio: A PricePanel, or a DataFrame of instruments containing open, close, and weight data indexed by Date.
+    @param reference: If true, computes the series one instrument and date at a time using Decimal arithmetic. This is much slower, and mostly useful for verifying the default array-based implementation.
     """
-    index = portfolio.index.levels[1].tz_localize(timezone)
+    if isinstance(portfolio, PricePanel):
+        index = portfolio.dates.tz_localize(timezone)
+        if reference:
+            values = _etf_reference(portfolio.to_frame())
+        else:
+            values = _etf_vectorized(
+                portfolio.field("open"),
+                portfolio.field("close"),
+                portfolio.field("weight"),
+            )
+    else:
+        index = portfolio.index.levels[1].tz_localize(timezone)
+        if reference:
+            values = _etf_reference(portfolio)
+        else:
+            values = _etf_vectorized(
+                portfolio.loc["open"].to_numpy(dtype=np.float64),
+                portfolio.loc["close"].to_numpy(dtype=np.float64),
+                portfolio.loc["weight"].to_numpy(dtype=np.float64),
+            )
+
+    return pd.Series(values, index=index)
+
+
+def _etf_vectorized(
+    open_prices: np.ndarray, close_prices: np.ndarray, weights: np.ndarray
+) -> np.ndarray:
+    """
+    Computes the AUM path for etf() as whole-array operations over T x I float64 panels.
+    """
+    etf = np.zeros(close_prices.shape[0])
+    etf[0] = 1.0  # Initial AUM for this instrument is $1.
+    if etf.shape[0] < 2:
+        return etf
+
+    # Equivalent to delta() for every instrument and date: the change from
+    # t - 1 to t, or zero if either close is missing.
+    changes = np.diff(close_prices, axis=0)
+    changes[np.isnan(changes)] = 0.0
+
+    # Equivalent to holdings(), expressed per $1 of AUM. Holdings are only
+    # recalculated when both the open and close are known; otherwise the
+    # previous day's holdings carry forward.
+    rebalanced = np.isfinite(open_prices) & np.isfinite(close_prices)
+    sum_of_weights = np.nansum(np.abs(weights), axis=1)[:, np.newaxis]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        holdings_per_aum = np.where(
+            rebalanced, weights * sum_of_weights / close_prices, 0.0
+        )
+
+    # If carried-forward holdings never meet a price change, every step simply
+    # scales the previous AUM, so the whole path is a cumulative product.
+    carried = ~rebalanced[:-1] & (changes != 0)
+    if not carried.any():
+        growth = 1.0 + (holdings_per_aum[:-1] * changes).sum(axis=1)
+        etf[1:] = np.cumprod(growth)
+        return etf
+
+    # Otherwise, carried holdings are denominated in an earlier day's AUM, so
+    # walk the dates while still operating on all instruments at once.
+    holds = np.zeros(close_prices.shape[1])
+    for t in range(1, etf.shape[0]):
+        holds = np.where(rebalanced[t - 1], holdings_per_aum[t - 1] * etf[t - 1], holds)
+        etf[t] = etf[t - 1] + holds @ changes[t - 1]
+
+    return etf
+
+
+def _etf_reference(portfolio: pd.DataFrame) -> np.ndarray:
     # Initialize a zero'd out T-sized array where T is the length of the date range.
     etf = np.zeros(portfolio.loc["open"].shape[0])
     etf[0] = Decimal(1)  # Initial AUM for this instrument is $1.
@@ -48,10 +124,12 @@ def etf(portfolio: pd.DataFrame, timezone: str) -> pd.Series:
         # for exchange rates, transaction costs, and dividends.
         etf[t] = Decimal(etf[t - 1]) + portfolio_sum
 
-    return pd.Series(etf, index=index)
+    return etf
 
 
-def portfolio_to_returns(portfolio: pd.DataFrame, timezone: str) -> pd.Series:
+def portfolio_to_returns(
+    portfolio: Union[PricePanel, pd.DataFrame], timezone: str
+) -> pd.Series:
     prices = etf(portfolio, timezone)
     return prices_to_daily_returns(prices)
 
@@ -84,11 +162,57 @@ def positions_to_dataframe(positions: Iterable[Position]) -> pd.DataFrame:
     return frame
 
 
+def timelines_to_dataframe(
+    timelines: Iterable[Tuple[str, CompactTimeline]]
+) -> pd.DataFrame:
+    """
+    Returns a long-format DataFrame with one row per step of each symbol's timeline.
+
+    Each row records the instrument whose position changed (if any), the change in quantity, the resulting position in
+    that instrument, and the cumulative realized profit for the symbol.
+
+    @param timelines: Pairs of symbols and their timelines, e.g., from compactTimelinesForAllSymbols().
+    """
+    columns: Dict[str, List[Any]] = {
+        "symbol": [],
+        "date": [],
+        "instrument": [],
+        "quantity": [],
+        "position": [],
+        "realizedProfit": [],
+        "currency": [],
+    }
+
+    for symbol, timeline in timelines:
+        positions: Dict[Instrument, Decimal] = {}
+        for step in timeline.deltas:
+            step.applyTo(positions)
+
+            columns["symbol"].append(symbol)
+            columns["date"].append(step.date)
+            columns["instrument"].append(
+                str(step.instrument) if step.instrument else None
+            )
+            columns["quantity"].append(step.quantity)
+            columns["position"].append(
+                positions.get(step.instrument, Decimal(0)) if step.instrument else None
+            )
+            columns["realizedProfit"].append(step.realizedProfit.quantity)
+            columns["currency"].append(step.realizedProfit.currency.name)
+
+    return pd.DataFrame(columns)
+
+
 def positions_to_returns(
-    provider: MarketDataProvider, positions: Iterable[Position], timezone: str
+    provider: MarketDataProvider,
+    positions: Iterable[Position],
+    timezone: str,
+    cache: Optional[HistoricalBarCache] = None,
 ) -> pd.Series:
     frame = positions_to_dataframe(positions)
-    positions, frame, history = positions_to_history(provider, positions, frame)
+    positions, frame, history = positions_to_history(
+        provider, positions, frame, cache=cache
+    )
     return positions_and_history_to_returns(frame, history, timezone)
 
 
@@ -99,54 +223,87 @@ def positions_and_history_to_returns(
     Returns a Series of returns calculated by allocating $1 to the given historical data assets by the allocations specified in a positions frame.
     The timezones of the returns series are localized to the given timezone.
     """
-    portfolio = positions_to_portfolio(frame, historical_data, timezone)
-    return portfolio_to_returns(portfolio, timezone)
+    panel = positions_to_panel(frame, historical_data)
+    return portfolio_to_returns(panel, timezone)
 
 
-def positions_to_portfolio(
-    frame: pd.DataFrame, historical_data: List[pd.DataFrame], timezone: str
-) -> pd.DataFrame:
-    """
-    Returns a DataFrame of position histories with weights and allocation columns.
-    """
+def _positions_to_components(
+    frame: pd.DataFrame, historical_data: List[pd.DataFrame]
+) -> Tuple[Dict[str, pd.DataFrame], Dict[str, float]]:
     weights = {}
     components = {}
     for i, row in frame.reset_index().iterrows():
         weights[row["instrument"]["symbol"]] = row["allocation"]
         components[row["instrument"]["symbol"]] = historical_data[i]
 
+    return (components, weights)
+
+
+def positions_to_portfolio(
+    frame: pd.DataFrame, historical_data: List[pd.DataFrame], timezone: str
+) -> pd.DataFrame:
+    """
+    Returns a DataFrame of position histories with weights and allocation columns.
+
+    See positions_to_panel() for a faster alternative, which avoids building the DataFrame.
+    """
+    components, weights = _positions_to_components(frame, historical_data)
     return stocks_to_portfolio(components, weights)
 
 
+def positions_to_panel(
+    frame: pd.DataFrame,
+    historical_data: List[pd.DataFrame],
+    alignment: PanelAlignment = PanelAlignment.INNER,
+) -> PricePanel:
+    """
+    Returns a PricePanel of position histories, weighted by their allocations, which can be passed to etf() or portfolio_to_returns() in place of positions_to_portfolio().
+
+    @param alignment: How to handle dates on which some positions have no historical data.
+    """
+    components, weights = _positions_to_components(frame, historical_data)
+    return bars_to_panel(components, weights, alignment=alignment)
+
+
 def positions_to_history(
-    provider: MarketDataProvider, positions: Iterable[Position], frame: pd.DataFrame
+    provider: MarketDataProvider,
+    positions: Iterable[Position],
+    frame: pd.DataFrame,
+    cache: Optional[HistoricalBarCache] = None,
+    max_concurrency: int = defaultMaxConcurrency,
+    timeout: Optional[float] = None,
+    retries: int = 0,
 ) -> Tuple[List[Position], pd.DataFrame, List[pd.DataFrame]]:
     """
     Returns 1 year of daily historical data for a dataframe of positions.
+
+    Positions whose data could not be fetched are omitted, and logged as warnings. Use fetchHistory() directly for a detailed report.
+
+    @param cache: If provided, bars are read from this cache first, only fetching (and saving) days which are missing, and are limited to the cache's lookback window instead.
+    @param max_concurrency: The maximum number of instruments to fetch at once.
+    @param timeout: How many seconds to wait for each attempt to fetch an instrument, or None to wait indefinitely.
+    @param retries: How many more times to try fetching an instrument after a failure.
     """
     is_stock = lambda position: type(position.instrument) == Stock
-    bars = []
-    new_positions = []
-    for position in filter(is_stock, positions):
-        try:
-            # FIXME: This is specific to IBDataProvider right now
-            barList = provider.fetchHistoricalData(position.instrument)  # type: ignore
-        except ValueError:
-            print("something bad happened")
-            continue
-        except:
-            print("caught an exception")
-            continue
-
-        if barList is not None:
-            new_positions.append(position)
-        bars.append(barList)
-
-    indices = [i for i, x in enumerate(bars) if x is not None]
+    stock_positions = list(filter(is_stock, positions))
+
+    report = fetchHistory(
+        provider,
+        (p.instrument for p in stock_positions),
+        cache=cache,
+        maxConcurrency=max_concurrency,
+        timeout=timeout,
+        retries=retries,
+    )
+
+    for result in report.failed:
+        logging.warning(f"Could not fetch historical data for {result}")
+
+    indices = [i for i, result in enumerate(report.results) if result.succeeded]
     return (
-        new_positions,
+        [stock_positions[i] for i in indices],
         frame.loc[indices],
-        list(filter(lambda x: x is not None, bars)),
+        [report.results[i].bars for i in indices],
     )
 
 
@@ -158,7 +315,7 @@ def holdings(
     # If the open price is NaN, this instrument's open wasn't recorded at time t.
     # So let's use the previous day's calculation.
     if not open_price.is_finite():
-        prev_day: Decimal = holds[t - 1][val.columns.get_loc(i)]
+        prev_day = Decimal(holds[t - 1][val.columns.get_loc(i)])
         return prev_day
     else:
         # TODO: make the exchange rate flexible. This should generally be the dollar value of 1 point of instrument i.
@@ -171,7 +328,7 @@ def holdings(
         # If open prices are unavailable, then the last close price at t will work too.
         next_open = Decimal(val[i].loc["close"][t])
         if not next_open.is_finite():
-            last_close_price: Decimal = holds[t - 1][val.columns.get_loc(i)]
+            last_close_price = Decimal(holds[t - 1][val.columns.get_loc(i)])
             return last_close_price
 
         weighted_holding: Decimal = Decimal(val[i].loc["weight"][t]) * aum_t / Decimal(
@@ -195,32 +352,21 @@ def delta(val: pd.DataFrame, i: str, t: int) -> Decimal:
 def stocks_to_portfolio(
     components: Dict[str, pd.DataFrame], weights: Dict[str, float]
 ) -> pd.DataFrame:
-    instruments = []
-    for key, val in components.items():
-        arrays = [
-            ["date", "open", "high", "low", "close", "volume", "barCount", "average"],
-            pd.DatetimeIndex(val["date"]),
-        ]
-        index = pd.MultiIndex.from_product(arrays, names=["field", "date"])
-        df = pd.DataFrame(val.unstack().values, index=index)
-        df.columns = [key]
-        arrays = [
-            [
-                "date",
-                "open",
-                "high",
-                "low",
-                "close",
-                "volume",
-                "barCount",
-                "average",
-                "weight",
-            ],
-            pd.DatetimeIndex(val["date"]),
-        ]
-        df = df.reindex(pd.MultiIndex.from_product(arrays, names=["field", "date"]))
-        df[key].loc["weight"] = np.repeat(
-            weights[key], df[key].loc["weight"].index.shape[0]
-        )
-        instruments.append(df)
-    return pd.concat(instruments, join="inner", sort=False, axis=1).sort_index()
+    """
+    Returns a DataFrame of instrument bars and weights, indexed by (field, date), keeping only the dates shared by every instrument. The "date" field repeats each row's date.
+
+    Prefer bars_to_panel(), which avoids building the DataFrame and supports other alignments.
+    """
+    panel = bars_to_panel(components, weights)
+    dates = pd.DataFrame(
+        np.repeat(
+            panel.dates.to_numpy(dtype=object)[:, np.newaxis],
+            len(panel.instruments),
+            axis=1,
+        ),
+        index=pd.MultiIndex.from_product(
+            [["date"], panel.dates], names=["field", "date"]
+        ),
+        columns=panel.instruments,
+    )
+    return pd.concat([dates, panel.to_frame()], sort=False).sort_index()
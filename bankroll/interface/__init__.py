@@ -1,6 +1,58 @@
-from bankroll.analysis import *
-from bankroll.broker import *
+from typing import TYPE_CHECKING, Any, List
+
+import bankroll.analysis as _analysis
+import bankroll.broker as _broker
+from bankroll.broker import AccountData
 from bankroll.model import *
 
+from . import brokers
 from .brokers import *
-from .configuration import loadConfig, marketDataProvider
+from .configuration import (
+    HistorySettings,
+    MarketDataSettings,
+    historicalBarCache,
+    loadConfig,
+    marketDataProvider,
+)
+from .snapshots import SnapshotCache, loadAccounts
+
+if TYPE_CHECKING:
+    from bankroll.broker import AccountAggregator
+
+
+# Re-exports bankroll.analysis and the built-in broker packages on demand, so
+# that importing this package (e.g., to run the CLI) doesn't load them unless
+# they're used.
+#
+# AccountAggregator.fromSettings() and allSettings() only know of brokers which
+# have been imported, so every installed broker is imported the first time
+# AccountAggregator is used from here (e.g., in a notebook). The CLI imports
+# only the brokers it needs, and AccountAggregator from bankroll.broker.
+def __getattr__(name: str) -> Any:
+    if name == "AccountAggregator":
+        loadBrokers(discoverBrokers())
+        globals()[name] = _broker.AccountAggregator
+        return _broker.AccountAggregator
+    elif name in _analysis.__all__:
+        return getattr(_analysis, name)
+    elif name in builtinBrokers:
+        return getattr(brokers, name)
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> List[str]:
+    return sorted(
+        set(globals().keys())
+        | {"AccountAggregator"}
+        | set(_analysis.__all__)
+        | set(builtinBrokers)
+    )
+
+
+__all__ = (
+    [name for name in globals().keys() if not name.startswith("_")]
+    + ["AccountAggregator"]
+    + list(_analysis.__all__)
+    + list(builtinBrokers)
+)
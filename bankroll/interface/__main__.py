@@ -1,7 +1,9 @@
 import logging
+import sys
 from argparse import ArgumentParser, FileType, Namespace
 from itertools import chain
-from typing import Callable, Dict, Iterable, List, Optional
+from types import ModuleType
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple, Type
 
 from progress.bar import Bar  # type: ignore
 
@@ -13,14 +15,82 @@ from bankroll.broker.configuration import (
     addSettingsToArgumentGroup,
 )
 from bankroll.marketdata import MarketConnectedAccountData, MarketDataProvider
-from bankroll.model import Activity, Cash, converter, Instrument, Position, Stock, Trade
-
-from .brokers import *
-from .configuration import loadConfig, marketDataProvider
+from bankroll.model import Activity, Cash, Instrument, Position, Stock, Trade
+
+from .brokers import BrokerPlugin, discoverBrokers, loadBrokers
+from .configuration import (
+    HistorySettings,
+    MarketDataSettings,
+    configuredSections,
+    defaultPollInterval,
+    defaultSocketPath,
+    historicalBarCache,
+    loadConfig,
+    marketDataProvider,
+)
+from .export import ExportFormat, defaultChunkSize
+from .profiling import Profiler
+
+# Modules needed by only some commands (e.g., server, watch, snapshots) are
+# imported by the commands which use them, so that others start quickly. The
+# export module is cheap to import, and its formats are listed in --help.
+
+# Parses only the options needed to set up logging and load configuration,
+# before the full set of options (which depends on which brokers are
+# configured) is known.
+configParser = ArgumentParser(add_help=False)
+configParser.add_argument(
+    "-v",
+    "--verbose",
+    help="Turns on more logging, for debugging purposes.",
+    dest="verbose",
+    default=False,
+    action="store_true",
+)
+configParser.add_argument(
+    "--config",
+    help="Path to an INI file specifying configuration options, taking precedence over the default search paths. Can be specified multiple times, with the latest file's settings taking precedence over those previous.",
+    action="append",
+)
+configParser.add_argument(
+    "--server",
+    help="Forward the command to a server started with `bankroll serve`, and print its response.",
+    default=False,
+    action="store_true",
+)
+configParser.add_argument(
+    "--server-address",
+    help=f"With --server, the address of the server to forward to: a Unix socket path or host:port (by default, {defaultSocketPath}).",
+    default=defaultSocketPath,
+    metavar="address",
+)
+configParser.add_argument(
+    "--profile",
+    help="Time each stage of the run, then write a JSON summary to standard error.",
+    default=False,
+    action="store_true",
+)
+configParser.add_argument(
+    "--profile-memory",
+    help="With --profile, also track peak memory use. This slows the run down, so timings are less accurate.",
+    default=False,
+    action="store_true",
+)
+configParser.add_argument(
+    "--profile-output",
+    help="With --profile, write the JSON summary to out-file instead of standard error.",
+    metavar="out-file",
+)
+configParser.add_argument(
+    "--profile-dump",
+    help="With --profile, also profile the run with cProfile, and write the statistics to out-file (e.g., for use with pstats or snakeviz).",
+    metavar="out-file",
+)
 
 parser = ArgumentParser(
     prog="bankroll",
     add_help=False,
+    parents=[configParser],
     description="Ingests portfolio and other data from multiple brokerages, and analyzes it.",
     epilog="For more information, or to report issues, please visit: https://github.com/bankroll-py/bankroll",
 )
@@ -40,98 +110,271 @@ parser.add_argument(
     "--no-lenient", dest="lenient", help="Opposite of --lenient.", action="store_false"
 )
 parser.add_argument(
-    "-v",
-    "--verbose",
-    help="Turns on more logging, for debugging purposes.",
-    dest="verbose",
-    default=False,
-    action="store_true",
+    "--no-cache",
+    help="Parse all account data again, instead of reusing snapshots of unchanged files.",
+    dest="cache",
+    default=True,
+    action="store_false",
 )
+
 parser.add_argument(
-    "--config",
-    help="Path to an INI file specifying configuration options, taking precedence over the default search paths. Can be specified multiple times, with the latest file's settings taking precedence over those previous.",
-    action="append",
+    "--no-parallel-load",
+    help="Load account data from each broker one after another, instead of parsing local files in separate processes at the same time.",
+    dest="parallel_load",
+    default=True,
+    action="store_false",
+)
+parser.add_argument(
+    "-j",
+    "--jobs",
+    help="How many processes to analyze symbols in, for `timeline --all` and `positions --realized-basis`.",
+    type=int,
+    default=1,
 )
 
-if ibkr:
-    ibGroup = parser.add_argument_group(
-        "IB", "Options for importing data from Interactive Brokers."
-    )
-    readIBSettings = addSettingsToArgumentGroup(ibkr.Settings, ibGroup)
 
-if fidelity:
-    fidelityGroup = parser.add_argument_group(
-        "Fidelity",
-        "Options for importing data from local files in Fidelity's CSV export format.",
-    )
-    readFidelitySettings = addSettingsToArgumentGroup(fidelity.Settings, fidelityGroup)
+marketDataGroup = parser.add_argument_group(
+    "Market", "Options for fetching market data from a connected brokerage."
+)
+readMarketDataSettings = addSettingsToArgumentGroup(MarketDataSettings, marketDataGroup)
 
-if schwab:
-    schwabGroup = parser.add_argument_group(
-        "Schwab",
-        "Options for importing data from local files in Charles Schwab's CSV export format.",
-    )
-    readSchwabSettings = addSettingsToArgumentGroup(schwab.Settings, schwabGroup)
+historyGroup = parser.add_argument_group(
+    "History", "Options for caching historical market data."
+)
+readHistorySettings = addSettingsToArgumentGroup(HistorySettings, historyGroup)
 
-if vanguard:
-    vanguardGroup = parser.add_argument_group(
-        "Vanguard",
-        "Options for importing data from local files in Vanguard's CSV export format.",
-    )
-    readVanguardSettings = addSettingsToArgumentGroup(vanguard.Settings, vanguardGroup)
+
+# Adds an argument group for each broker, returning callables which will
+# extract their settings.
+def addBrokerArguments(
+    brokers: Mapping[BrokerPlugin, ModuleType]
+) -> List[Callable[[Configuration, Namespace], Mapping[Settings, str]]]:
+    readers: List[Callable[[Configuration, Namespace], Mapping[Settings, str]]] = []
+    for plugin, module in brokers.items():
+        settings: Type[Settings] = getattr(module, "Settings")
+        group = parser.add_argument_group(settings.sectionName(), plugin.description)
+        readers.append(addSettingsToArgumentGroup(settings, group))
+
+    return readers
 
 
 def printPositions(accounts: AccountAggregator, args: Namespace) -> None:
+    profiler: Profiler = args.profiler
+    with profiler.stage("positions"):
+        positions = sorted(accounts.positions(), key=lambda p: p.instrument)
+
     values: Dict[Position, Cash] = {}
     if args.live_value:
-        dataProvider = marketDataProvider(accounts)
-        if dataProvider:
-            values = analysis.liveValuesForPositions(
-                accounts.positions(),
-                dataProvider=dataProvider,
-                progressBar=Bar("Loading market data for positions"),
+        with profiler.stage("market data"):
+            dataProvider = marketDataProvider(accounts, args.marketDataSettings)
+            if dataProvider:
+                values = analysis.liveValuesForPositions(
+                    positions,
+                    dataProvider=dataProvider,
+                    progressBar=Bar("Loading market data for positions"),
+                )
+
+                if isinstance(dataProvider, analysis.CachingMarketDataProvider):
+                    logging.info(dataProvider)
+            else:
+                logging.error("Live data connection required to fetch market values")
+
+    realizedBases: Dict[Position, Optional[Cash]] = {}
+    if args.realized_basis:
+        if args.jobs < 1:
+            parser.error("--jobs must be positive")
+
+        with profiler.stage("activity"):
+            activityIndex = analysis.ActivityIndex(accounts.activity())
+
+        stockPositions = [p for p in positions if isinstance(p.instrument, Stock)]
+        with profiler.stage("analysis"):
+            bases: Dict[str, Optional[Cash]] = {}
+            for result in analysis.analyzeSymbols(
+                activityIndex,
+                symbols=(p.instrument.symbol for p in stockPositions),
+                jobs=args.jobs,
+                timelines=False,
+            ):
+                if result.error is not None:
+                    raise ValueError(result.error)
+
+                bases[result.symbol] = result.realizedBasis
+
+            realizedBases = {
+                p: bases[analysis.normalizeSymbol(p.instrument.symbol)]
+                for p in stockPositions
+            }
+
+    with profiler.stage("output"):
+        for p in positions:
+            print(p)
+
+            if p in values:
+                print(f"\tMarket value: {values[p]}")
+            elif args.live_value:
+                logging.warning(f"Could not fetch market value for {p.instrument}")
+
+            print(f"\tCost basis: {p.costBasis}")
+
+            if p in realizedBases:
+                print(f"\tRealized basis: {realizedBases[p]}")
+
+
+def printActivity(accounts: AccountAggregator, args: Namespace) -> None:
+    profiler: Profiler = args.profiler
+    if args.output:
+        format = ExportFormat.forPath(args.output)
+        if args.format:
+            format = ExportFormat(args.format)
+
+        compress = args.gzip or args.output.lower().endswith(".gz")
+        if not format.available:
+            activityParser.error(f"Writing {format.value} requires pyarrow")
+        if compress and not format.supportsGzip:
+            activityParser.error(f"Cannot compress {format.value} output with --gzip")
+        if args.chunk_size < 1:
+            activityParser.error("--chunk-size must be positive")
+
+        from .export import exportActivity, mergeActivity
+
+        # Activity is merged and written a chunk at a time, so both stages are
+        # measured together.
+        with profiler.stage("output"):
+            exportActivity(
+                mergeActivity(a.activity() for a in accounts.accounts),
+                args.output,
+                format=format,
+                compress=compress,
+                chunkSize=args.chunk_size,
             )
-        else:
-            logging.error("Live data connection required to fetch market values")
 
-    for p in sorted(accounts.positions(), key=lambda p: p.instrument):
-        print(p)
+        print(f"Activity saved to: {args.output}")
+        return
 
-        if p in values:
-            print(f"\tMarket value: {values[p]}")
-        elif args.live_value:
-            logging.warning(f"Could not fetch market value for {p.instrument}")
+    with profiler.stage("activity"):
+        activity = list(accounts.activity())
 
-        print(f"\tCost basis: {p.costBasis}")
+    with profiler.stage("output"):
+        for t in sorted(activity, key=lambda t: t.date, reverse=True):
+            print(t)
 
-        if args.realized_basis and isinstance(p.instrument, Stock):
-            realizedBasis = analysis.realizedBasisForSymbol(
-                p.instrument.symbol, activity=accounts.activity()
-            )
-            print(f"\tRealized basis: {realizedBasis}")
 
+def printBalances(accounts: AccountAggregator, args: Namespace) -> None:
+    profiler: Profiler = args.profiler
+    with profiler.stage("balances"):
+        balance = accounts.balance()
 
-def printActivity(accounts: AccountAggregator, args: Namespace) -> None:
-    if args.output_csv:
-        df = converter.dataframeForModelObjects(list(accounts.activity())).sort_values(
-            by=["Date"]
+    with profiler.stage("output"):
+        print(balance)
+
+
+def symbolTimeline(accounts: AccountAggregator, args: Namespace) -> None:
+    if args.all == bool(args.symbol):
+        timelineParser.error("Specify either a symbol or --all")
+    if args.jobs < 1:
+        parser.error("--jobs must be positive")
+
+    profiler: Profiler = args.profiler
+    with profiler.stage("activity"):
+        index = analysis.ActivityIndex(accounts.activity())
+
+    timelines: List[Tuple[str, analysis.CompactTimeline]] = []
+    with profiler.stage("analysis"):
+        for result in analysis.analyzeSymbols(
+            index, symbols=None if args.all else [args.symbol], jobs=args.jobs
+        ):
+            if result.error is not None:
+                if not args.all:
+                    raise ValueError(result.error)
+
+                logging.warning(
+                    f"Could not trace timeline for {result.symbol}: {result.error}"
+                )
+                continue
+
+            assert result.timeline is not None
+            timelines.append((result.symbol, result.timeline))
+
+    with profiler.stage("output"):
+        if args.output_csv:
+            df = analysis.timelines_to_dataframe(timelines)
+            df.to_csv(args.output_csv, index=False)
+            print(f"Timeline saved to: {args.output_csv}")
+            return
+
+        for symbol, timeline in timelines:
+            if args.all:
+                print(f"{symbol}:")
+
+            for entry in reversed(list(timeline)):
+                print(entry)
+
+
+def serveAccounts(accounts: AccountAggregator, args: Namespace) -> None:
+    from .server import BankrollService, formatAddress, parseAddress, serve
+
+    service = BankrollService(accounts, marketDataSettings=args.marketDataSettings)
+    address = parseAddress(args.listen)
+
+    print(f"Serving on {formatAddress(address)}", flush=True)
+    serve(service, address)
+
+
+def watchAccounts(settings: Mapping[Settings, str], args: Namespace) -> None:
+    if args.interval <= 0:
+        watchParser.error("--interval must be positive")
+
+    from .snapshots import SnapshotCache
+    from .watch import AccountWatcher
+
+    profiler: Profiler = args.profiler
+    with profiler.stage("load accounts"):
+        watcher = AccountWatcher(
+            settings,
+            lenient=args.lenient,
+            cache=SnapshotCache() if args.cache else None,
         )
-        df.to_csv(args.output_csv, index=False)
-        print(f"Activity saved to: {args.output_csv}")
+
+    paths = watcher.watchedPaths
+    if not paths:
+        logging.error("No brokers are configured with local files to watch")
+        return
+
+    print(f"Watching {len(paths)} path(s) for changes", flush=True)
+    for change in watcher.watch(pollInterval=args.interval):
+        print(
+            f"Reloaded {', '.join(change.sources)}: {len(change.added)} added, {len(change.removed)} removed",
+            flush=True,
+        )
+
+        for update in watcher.updates(change.symbols):
+            print(update, flush=True)
+
+
+def clearHistory(config: Configuration, args: Namespace) -> None:
+    cache = historicalBarCache(readHistorySettings(config, args))
+    if not cache:
+        logging.error("Historical data caching is disabled")
+        return
+
+    if args.symbols:
+        count = cache.invalidateSymbols(args.symbols)
     else:
-        for t in sorted(accounts.activity(), key=lambda t: t.date, reverse=True):
-            print(t)
+        count = cache.invalidate()
 
+    print(f"Removed cached history for {count} instrument(s) from {cache.directory}")
 
-def printBalances(accounts: AccountAggregator, args: Namespace) -> None:
-    print(accounts.balance())
 
+def printCacheStats(config: Configuration, args: Namespace) -> None:
+    from .snapshots import SnapshotCache
 
-def symbolTimeline(accounts: AccountAggregator, args: Namespace) -> None:
-    for entry in reversed(
-        list(analysis.timelineForSymbol(args.symbol, accounts.activity()))
-    ):
-        print(entry)
+    cache = SnapshotCache()
+    if args.clear:
+        count = cache.clear()
+        print(f"Removed {count} snapshot(s) from {cache.directory}")
+    else:
+        print(cache.stats())
 
 
 commands: Dict[str, Callable[[AccountAggregator, Namespace], None]] = {
@@ -139,6 +382,99 @@ commands: Dict[str, Callable[[AccountAggregator, Namespace], None]] = {
     "activity": printActivity,
     "balances": printBalances,
     "timeline": symbolTimeline,
+    "serve": serveAccounts,
+}
+
+
+def positionsArguments(args: Namespace) -> Dict[str, Any]:
+    return {"realizedBasis": args.realized_basis, "liveValue": args.live_value}
+
+
+def activityArguments(args: Namespace) -> Dict[str, Any]:
+    if args.output:
+        activityParser.error("--output cannot be used with --server")
+
+    return {}
+
+
+def timelineArguments(args: Namespace) -> Dict[str, Any]:
+    if args.all == bool(args.symbol):
+        timelineParser.error("Specify either a symbol or --all")
+    if args.output_csv:
+        timelineParser.error("--output-csv cannot be used with --server")
+
+    return {"symbol": args.symbol, "all": args.all}
+
+
+# Commands which can be answered by a server (see serveAccounts), along with
+# how to convert their command-line arguments into the server's.
+forwardedCommands: Dict[str, Callable[[Namespace], Dict[str, Any]]] = {
+    "positions": positionsArguments,
+    "activity": activityArguments,
+    "balances": lambda args: {},
+    "timeline": timelineArguments,
+}
+
+
+# The following print a server's response to each forwarded command, the same
+# way as running the command here would.
+def printForwardedPositions(response: Dict[str, Any], args: Namespace) -> None:
+    from .server import decodeCash
+
+    for p in response["positions"]:
+        print(p["description"])
+
+        marketValue = p.get("marketValue")
+        if marketValue is not None:
+            print(f"\tMarket value: {decodeCash(marketValue)}")
+        elif args.live_value:
+            instrument = p["instrument"]["description"]
+            logging.warning(f"Could not fetch market value for {instrument}")
+
+        print(f"\tCost basis: {decodeCash(p['costBasis'])}")
+
+        if "realizedBasis" in p:
+            basis = p["realizedBasis"]
+            print(f"\tRealized basis: {decodeCash(basis) if basis else None}")
+
+
+def printForwardedActivity(response: Dict[str, Any], args: Namespace) -> None:
+    for a in response["activity"]:
+        print(a["description"])
+
+
+def printForwardedBalances(response: Dict[str, Any], args: Namespace) -> None:
+    from .server import decodeBalance
+
+    print(decodeBalance(response))
+
+
+def printForwardedTimelines(response: Dict[str, Any], args: Namespace) -> None:
+    for symbol, timeline in response["timelines"].items():
+        if args.all:
+            print(f"{symbol}:")
+
+        for entry in reversed(timeline):
+            print(entry["description"])
+
+
+forwardedPrinters: Dict[str, Callable[[Dict[str, Any], Namespace], None]] = {
+    "positions": printForwardedPositions,
+    "activity": printForwardedActivity,
+    "balances": printForwardedBalances,
+    "timeline": printForwardedTimelines,
+}
+
+# Commands which load accounts themselves, from the merged broker settings.
+settingsCommands: Dict[str, Callable[[Mapping[Settings, str], Namespace], None]] = {
+    "watch": watchAccounts
+}
+
+# Commands which operate only upon local configuration, without loading any
+# accounts.
+configurationCommands: Dict[str, Callable[[Configuration, Namespace], None]] = {
+    "clear-history": clearHistory,
+    "cache-stats": printCacheStats,
 }
 
 subparsers = parser.add_subparsers(dest="command", help="What to inspect")
@@ -163,7 +499,28 @@ activityParser = subparsers.add_parser(
     "activity", help="Operations upon imported portfolio activity"
 )
 activityParser.add_argument(
-    "-o", "--output-csv", metavar="out-file", help="Path to output results as csv file"
+    "-o",
+    "--output",
+    "--output-csv",
+    metavar="out-file",
+    help="Path to output activity to, in date order (as CSV, unless the file extension or --format says otherwise)",
+)
+activityParser.add_argument(
+    "--format",
+    choices=[f.value for f in ExportFormat],
+    help="The format to output trades in (parquet and feather require pyarrow)",
+)
+activityParser.add_argument(
+    "--gzip",
+    help="Compress the output with gzip, as is the default if out-file ends in .gz (not supported for feather)",
+    default=False,
+    action="store_true",
+)
+activityParser.add_argument(
+    "--chunk-size",
+    help="How many trades to write at once, which bounds memory use",
+    type=int,
+    default=defaultChunkSize,
 )
 
 balancesParser = subparsers.add_parser(
@@ -175,33 +532,173 @@ timelineParser = subparsers.add_parser(
 )
 timelineParser.add_argument(
     "symbol",
+    nargs="?",
     help="The symbol to look up (multi-part symbols like BRK.B will be normalized so they can be tracked across brokers)",
 )
+timelineParser.add_argument(
+    "--all",
+    help="Trace every symbol in the imported activity, instead of just one",
+    default=False,
+    action="store_true",
+)
+timelineParser.add_argument(
+    "-o",
+    "--output-csv",
+    metavar="out-file",
+    help="Path to output one row per timeline step as csv file",
+)
+
+serveParser = subparsers.add_parser(
+    "serve",
+    help="Keeps accounts and market data loaded, answering commands forwarded with --server (or requested over HTTP, as JSON)",
+)
+serveParser.add_argument(
+    "--listen",
+    metavar="address",
+    help=f"A Unix socket path, or host:port to serve HTTP over TCP (by default, {defaultSocketPath})",
+    default=defaultSocketPath,
+)
+
+watchParser = subparsers.add_parser(
+    "watch",
+    help="Parses broker exports again as they change, and prints the realized basis and latest position of each symbol whose activity changed",
+)
+watchParser.add_argument(
+    "--interval",
+    help="How often to check for changes, in seconds (when inotify_simple is installed, changes are also noticed immediately)",
+    type=float,
+    default=defaultPollInterval,
+)
+
+clearHistoryParser = subparsers.add_parser(
+    "clear-history", help="Deletes cached historical market data"
+)
+clearHistoryParser.add_argument(
+    "symbols",
+    nargs="*",
+    metavar="symbol",
+    help="Symbols to delete cached data for (by default, all cached data is deleted)",
+)
+
+cacheStatsParser = subparsers.add_parser(
+    "cache-stats", help="Shows how often snapshots of parsed account data are reused"
+)
+cacheStatsParser.add_argument(
+    "--clear",
+    help="Delete all snapshots, so that account data is parsed again on next use",
+    default=False,
+    action="store_true",
+)
 
 
 def main() -> None:
-    args = parser.parse_args()
-    if args.verbose:
+    argv = sys.argv[1:]
+    configArgs, _ = configParser.parse_known_args(argv)
+    if configArgs.verbose:
         logging.basicConfig(level=logging.INFO)
 
-    config = loadConfig(
-        chain(Configuration.defaultSearchPaths, args.config if args.config else [])
+    profiler = Profiler(
+        enabled=configArgs.profile,
+        traceMemory=configArgs.profile_memory,
+        dumpPath=configArgs.profile_dump,
     )
+    profiler.start()
+    try:
+        run(argv, configArgs, profiler)
+    finally:
+        profiler.stop()
+        if configArgs.profile and configArgs.profile_output:
+            with open(configArgs.profile_output, "w") as f:
+                profiler.writeSummary(f)
+        elif configArgs.profile:
+            profiler.writeSummary(sys.stderr)
+
+
+# Sends the command in `argv` to a server, instead of loading accounts here.
+# Only options understood by the server are accepted, as it has its own
+# configuration.
+def forwardCommand(address: str, argv: List[str]) -> None:
+    from .server import ServerError, parseAddress, requestCommand
+
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.print_usage()
+        quit(1)
+
+    toArguments = forwardedCommands.get(args.command)
+    if toArguments is None:
+        parser.error(f"{args.command} cannot be used with --server")
+
+    try:
+        response = requestCommand(
+            parseAddress(address), args.command, toArguments(args)
+        )
+    except (OSError, ServerError) as err:
+        logging.error(f"Could not get {args.command} from server at {address}: {err}")
+        quit(1)
+
+    forwardedPrinters[args.command](response, args)
+
+
+def run(argv: List[str], configArgs: Namespace, profiler: Profiler) -> None:
+    if configArgs.server:
+        with profiler.stage("forward"):
+            forwardCommand(configArgs.server_address, argv)
+
+        return
+
+    with profiler.stage("config"):
+        config = loadConfig(
+            chain(
+                Configuration.defaultSearchPaths,
+                configArgs.config if configArgs.config else [],
+            )
+        )
+        sections = configuredSections(config)
+
+    # Only import brokers which have settings, unless all of their options
+    # need to be listed.
+    plugins = discoverBrokers()
+    if not {"-h", "--help"}.isdisjoint(argv):
+        wanted = plugins
+    else:
+        wanted = [p for p in plugins if p.isConfigured(sections, argv)]
+
+    readBrokerSettings = addBrokerArguments(loadBrokers(wanted, profiler=profiler))
+
+    args = parser.parse_args(argv)
 
     if not args.command:
         parser.print_usage()
         quit(1)
 
+    if args.command in configurationCommands:
+        configurationCommands[args.command](config, args)
+        return
+
     mergedSettings: Dict[Settings, str] = dict(
-        chain(
-            readFidelitySettings(config, args).items() if fidelity else [],
-            readSchwabSettings(config, args).items() if schwab else [],
-            readVanguardSettings(config, args).items() if vanguard else [],
-            readIBSettings(config, args).items() if ibkr else [],
+        chain.from_iterable(
+            readSettings(config, args).items() for readSettings in readBrokerSettings
         )
     )
 
-    accounts = AccountAggregator.fromSettings(mergedSettings, lenient=args.lenient)
+    # Not needed to load accounts, but used by commands which fetch quotes.
+    args.marketDataSettings = readMarketDataSettings(config, args)
+    args.profiler = profiler
+
+    if args.command in settingsCommands:
+        settingsCommands[args.command](mergedSettings, args)
+        return
+
+    from .snapshots import SnapshotCache, loadAccounts
+
+    accounts = loadAccounts(
+        mergedSettings,
+        lenient=args.lenient,
+        cache=SnapshotCache() if args.cache else None,
+        profiler=profiler,
+        parallel=args.parallel_load,
+    )
     commands[args.command](accounts, args)
 
 
@@ -1,19 +1,127 @@
-try:
-    import bankroll.brokers.ibkr as ibkr
-except ImportError:
-    ibkr = None  # type: ignore
-
-try:
-    import bankroll.brokers.schwab as schwab
-except ImportError:
-    schwab = None  # type: ignore
-
-try:
-    import bankroll.brokers.fidelity as fidelity
-except ImportError:
-    fidelity = None  # type: ignore
-
-try:
-    import bankroll.brokers.vanguard as vanguard
-except ImportError:
-    vanguard = None  # type: ignore
+import importlib
+import logging
+import sys
+from dataclasses import dataclass
+from types import ModuleType
+from typing import AbstractSet, Any, Dict, Iterable, List, Optional, Sequence
+
+from .profiling import Profiler, disabledProfiler
+
+if sys.version_info >= (3, 8):
+    from importlib.metadata import entry_points
+else:
+    from importlib_metadata import entry_points  # type: ignore
+
+# The entry point group under which broker plugins are registered. Each entry
+# point names a module which exports a `Settings` type for the broker's
+# configuration section, and its AccountData subclass.
+#
+# The name of each entry point must match (case-insensitively) the name of
+# its configuration section, which is also the prefix of its command-line
+# flags (e.g., `fidelity` for `[Fidelity]` and `--fidelity-positions`).
+entryPointGroup = "bankroll.brokers"
+
+# Brokers which are always looked for, as their packages don't register entry
+# points themselves. Each plugin package should register its own entry point,
+# which is only present if the plugin is installed.
+builtinBrokers: Dict[str, str] = {
+    "ibkr": "bankroll.brokers.ibkr",
+    "schwab": "bankroll.brokers.schwab",
+    "fidelity": "bankroll.brokers.fidelity",
+    "vanguard": "bankroll.brokers.vanguard",
+}
+
+_descriptions = {
+    "ibkr": "Options for importing data from Interactive Brokers.",
+    "schwab": "Options for importing data from local files in Charles Schwab's CSV export format.",
+    "fidelity": "Options for importing data from local files in Fidelity's CSV export format.",
+    "vanguard": "Options for importing data from local files in Vanguard's CSV export format.",
+}
+
+
+# A broker package which can provide account data, which is not imported until
+# needed.
+@dataclass(frozen=True)
+class BrokerPlugin:
+    name: str
+    module: str
+
+    @property
+    def description(self) -> str:
+        return _descriptions.get(
+            self.name, f"Options for importing data from {self.name}."
+        )
+
+    # Whether the broker has any settings, either in `configuredSections` (as
+    # returned by configuredSections()) or in command-line `args`.
+    def isConfigured(
+        self, configuredSections: AbstractSet[str], args: Sequence[str]
+    ) -> bool:
+        prefix = f"--{self.name.lower()}-"
+        return self.name.lower() in configuredSections or any(
+            arg.lower().startswith(prefix) for arg in args
+        )
+
+    # Imports the broker's module, or returns None if it is not installed.
+    def load(self) -> Optional[ModuleType]:
+        try:
+            return importlib.import_module(self.module)
+        except ImportError as err:
+            logging.info(f"Broker plugin {self.name} is unavailable: {err}")
+            return None
+
+    def __str__(self) -> str:
+        return f"{self.name} ({self.module})"
+
+
+def _entryPoints() -> Iterable[Any]:
+    eps: Any = entry_points()
+    if hasattr(eps, "select"):
+        return eps.select(group=entryPointGroup)  # type: ignore
+    else:
+        return eps.get(entryPointGroup, [])  # type: ignore
+
+
+# Finds every broker plugin, without importing any of them.
+def discoverBrokers() -> List[BrokerPlugin]:
+    modules = dict(builtinBrokers)
+    for ep in sorted(_entryPoints(), key=lambda ep: ep.name):
+        modules[ep.name.lower()] = ep.value.partition(":")[0].strip()
+
+    return [BrokerPlugin(name=name, module=module) for name, module in modules.items()]
+
+
+# Imports each of `plugins` which is installed, returning the imported modules.
+def loadBrokers(
+    plugins: Iterable[BrokerPlugin], profiler: Profiler = disabledProfiler
+) -> Dict[BrokerPlugin, ModuleType]:
+    loaded: Dict[BrokerPlugin, ModuleType] = {}
+    for plugin in plugins:
+        with profiler.stage(f"import {plugin.name}"):
+            module = plugin.load()
+
+        if module is not None:
+            loaded[plugin] = module
+
+    return loaded
+
+
+# Allows the built-in broker packages to be used as attributes of this module
+# (e.g., `brokers.ibkr`), importing them on first use, and returning None if
+# they are not installed.
+def __getattr__(name: str) -> Optional[ModuleType]:
+    if name not in builtinBrokers:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    module = BrokerPlugin(name=name, module=builtinBrokers[name]).load()
+    globals()[name] = module
+    return module
+
+
+__all__ = [
+    "BrokerPlugin",
+    "builtinBrokers",
+    "discoverBrokers",
+    "entryPointGroup",
+    "loadBrokers",
+]
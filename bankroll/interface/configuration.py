@@ -1,18 +1,110 @@
 from bankroll.broker import AccountAggregator
-from bankroll.broker.configuration import Configuration
+from bankroll.broker.configuration import Configuration, Settings
 from bankroll.marketdata import MarketDataProvider, MarketConnectedAccountData
-from typing import Iterable
+from bankroll.model import Bond, Forex, Future, Instrument, Option, Stock
+from configparser import ConfigParser
+from datetime import timedelta
+from enum import unique
+from typing import (
+    TYPE_CHECKING,
+    AbstractSet,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Mapping,
+    Optional,
+    Tuple,
+    Type,
+)
+from weakref import WeakKeyDictionary
 
-import pkg_resources
+import importlib.resources
+
+if TYPE_CHECKING:
+    from bankroll.analysis.history import HistoricalBarCache
+
+
+@unique
+class MarketDataSettings(Settings):
+    CACHE_QUOTES = "Cache quotes"
+    CACHE_SIZE = "Quote cache size"
+    QUOTE_TTL = "Quote TTL"
+    STOCK_QUOTE_TTL = "Stock quote TTL"
+    BOND_QUOTE_TTL = "Bond quote TTL"
+    OPTION_QUOTE_TTL = "Option quote TTL"
+    FUTURE_QUOTE_TTL = "Future quote TTL"
+    FOREX_QUOTE_TTL = "Forex quote TTL"
+
+    @property
+    def help(self) -> str:
+        if self == self.CACHE_QUOTES:
+            return "Whether to reuse recently fetched quotes instead of requesting them again (true or false)."
+        elif self == self.CACHE_SIZE:
+            return "The maximum number of quotes to cache."
+        elif self == self.QUOTE_TTL:
+            return "How many seconds a cached quote remains valid, unless overridden for its instrument type below."
+        else:
+            return f"How many seconds a cached {self.instrumentType.__name__.lower()} quote remains valid."
+
+    @property
+    def instrumentType(self) -> Type[Instrument]:
+        return _quoteTTLInstrumentTypes.get(self.value, Instrument)
+
+    @classmethod
+    def sectionName(cls) -> str:
+        return "Market"
+
+
+# The instrument type whose quote TTL each setting overrides, keyed by the
+# setting's value.
+_quoteTTLInstrumentTypes: Dict[str, Type[Instrument]] = {
+    MarketDataSettings.STOCK_QUOTE_TTL.value: Stock,
+    MarketDataSettings.BOND_QUOTE_TTL.value: Bond,
+    MarketDataSettings.OPTION_QUOTE_TTL.value: Option,
+    MarketDataSettings.FUTURE_QUOTE_TTL.value: Future,
+    MarketDataSettings.FOREX_QUOTE_TTL.value: Forex,
+}
+
+
+@unique
+class HistorySettings(Settings):
+    CACHE_HISTORY = "Cache history"
+    CACHE_DIRECTORY = "Cache directory"
+    LOOKBACK_DAYS = "Lookback days"
+
+    @property
+    def help(self) -> str:
+        if self == self.CACHE_HISTORY:
+            return "Whether to keep fetched historical data on disk, and only fetch days which are missing (true or false)."
+        elif self == self.CACHE_DIRECTORY:
+            return "A local path to a directory in which to keep historical data."
+        elif self == self.LOOKBACK_DAYS:
+            return "How many days of historical data to use."
+        else:
+            return ""
+
+    @classmethod
+    def sectionName(cls) -> str:
+        return "History"
+
+
+defaultHistoryCacheDirectory = "~/.cache/bankroll/history"
+
+# Where `bankroll serve` listens, and `--server` connects, by default.
+defaultSocketPath = "~/.cache/bankroll/bankroll.sock"
+
+# How often `bankroll watch` checks watched files for changes, in seconds, when
+# inotify is not available (or as a backstop when it is).
+defaultPollInterval = 5.0
 
 
 def loadConfig(
     searchPaths: Iterable[str] = Configuration.defaultSearchPaths
 ) -> Configuration:
     defaultConfigName = "bankroll.default.ini"
-    defaultConfig = pkg_resources.resource_string(
+    defaultConfig = importlib.resources.read_text(
         "bankroll.interface", defaultConfigName
-    ).decode()
+    )
 
     return Configuration(
         searchPaths=searchPaths,
@@ -21,11 +113,112 @@ def loadConfig(
     )
 
 
-def marketDataProvider(accounts: AccountAggregator) -> MarketDataProvider:
-    return next(
+# Returns the names (in lowercase) of every section in `config` which has at
+# least one non-empty setting.
+def configuredSections(config: Configuration) -> AbstractSet[str]:
+    parser = ConfigParser(empty_lines_in_values=False, interpolation=None)
+    parser.read_string(str(config))
+
+    return {
+        section.lower()
+        for section in parser.sections()
+        if any(parser.get(section, key) for key in parser.options(section))
+    }
+
+
+def _parseBool(value: str) -> bool:
+    return value.strip().lower() in ["1", "yes", "true", "on"]
+
+
+# Wraps `provider` in a CachingMarketDataProvider, if enabled by the given
+# settings.
+def cachingMarketDataProvider(
+    provider: MarketDataProvider, settings: Mapping[MarketDataSettings, str]
+) -> MarketDataProvider:
+    if not _parseBool(settings.get(MarketDataSettings.CACHE_QUOTES, "")):
+        return provider
+
+    # Only imported here, as it imports pandas.
+    from bankroll.analysis.caching import CachingMarketDataProvider
+
+    ttl = settings.get(MarketDataSettings.QUOTE_TTL)
+    size = settings.get(MarketDataSettings.CACHE_SIZE)
+
+    return CachingMarketDataProvider(
+        provider,
+        ttl=float(ttl) if ttl else CachingMarketDataProvider.defaultTTL,
+        ttlByType={
+            key.instrumentType: float(value)
+            for key, value in settings.items()
+            if key.instrumentType is not Instrument and value
+        },
+        maxSize=int(size) if size else CachingMarketDataProvider.defaultMaxSize,
+    )
+
+
+# Caching providers for each set of accounts, keyed by the settings they were
+# created with.
+_SettingsKey = FrozenSet[Tuple[MarketDataSettings, str]]
+_cachingProviders: "WeakKeyDictionary[AccountAggregator, Dict[_SettingsKey, MarketDataProvider]]" = (
+    WeakKeyDictionary()
+)
+
+
+# Returns a market data provider from the given accounts.
+#
+# If quote caching is enabled in `settings` (which are read from the default
+# configuration files if not provided), the same caching provider is returned
+# for every call with the same accounts and settings, so that quotes are
+# shared between callers.
+def marketDataProvider(
+    accounts: AccountAggregator,
+    settings: Optional[Mapping[MarketDataSettings, str]] = None,
+) -> MarketDataProvider:
+    if settings is None:
+        settings = loadConfig().section(MarketDataSettings)
+
+    key = frozenset(settings.items())
+    providers = _cachingProviders.setdefault(accounts, {})
+    if key in providers:
+        return providers[key]
+
+    from bankroll.analysis.ibkr import accountDataProvider
+
+    # Prefer a provider for Interactive Brokers which also supports asyncio.
+    underlying = next(
         (
-            account.marketDataProvider
+            accountDataProvider(account) or account.marketDataProvider
             for account in accounts.accounts
             if isinstance(account, MarketConnectedAccountData)
         )
     )
+
+    provider = cachingMarketDataProvider(underlying, settings)
+    if provider is not underlying:
+        providers[key] = provider
+
+    return provider
+
+
+# Returns a cache of historical bars, as configured by the given settings (which
+# are read from the default configuration files if not provided), or None if
+# caching is disabled.
+def historicalBarCache(
+    settings: Optional[Mapping[HistorySettings, str]] = None
+) -> Optional["HistoricalBarCache"]:
+    if settings is None:
+        settings = loadConfig().section(HistorySettings)
+
+    if not _parseBool(settings.get(HistorySettings.CACHE_HISTORY) or "true"):
+        return None
+
+    # Only imported here, as it imports pandas.
+    from bankroll.analysis.history import HistoricalBarCache
+
+    lookback = settings.get(HistorySettings.LOOKBACK_DAYS)
+    return HistoricalBarCache(
+        settings.get(HistorySettings.CACHE_DIRECTORY) or defaultHistoryCacheDirectory,
+        lookback=timedelta(days=int(lookback))
+        if lookback
+        else HistoricalBarCache.defaultLookback,
+    )
@@ -0,0 +1,241 @@
+import csv
+import gzip
+import heapq
+import os
+from decimal import Decimal
+from enum import Enum
+from importlib.util import find_spec
+from itertools import islice
+from typing import (
+    Any,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    TextIO,
+    TypeVar,
+    cast,
+)
+
+from bankroll.model import Activity, CashPayment, Trade
+
+_T = TypeVar("_T")
+
+# How many rows are converted and written at once, by default.
+defaultChunkSize = 10000
+
+# The columns of exported activity. The first six match
+# converter.dataframeForModelObjects() for trades. Kind is "trade" or "payment",
+# as in ActivityFrame; payments have no action, quantity, or fees, and their
+# proceeds are exported as the amount.
+columns = ["Date", "Action", "Quantity", "Instrument", "Amount", "Fees", "Kind"]
+
+
+class ExportFormat(Enum):
+    CSV = "csv"
+    PARQUET = "parquet"
+    FEATHER = "feather"
+
+    # Guesses the format of `path` from its extension (ignoring any ".gz"),
+    # defaulting to CSV.
+    @classmethod
+    def forPath(cls, path: str) -> "ExportFormat":
+        root, ext = os.path.splitext(path)
+        if ext.lower() == ".gz":
+            _, ext = os.path.splitext(root)
+
+        ext = ext.lower().lstrip(".")
+        if ext in ("parquet", "pq"):
+            return cls.PARQUET
+        elif ext in ("feather", "arrow"):
+            return cls.FEATHER
+        else:
+            return cls.CSV
+
+    # Whether the libraries needed to write this format are installed.
+    @property
+    def available(self) -> bool:
+        return self == ExportFormat.CSV or find_spec("pyarrow") is not None
+
+    # Whether output in this format can be compressed with gzip.
+    @property
+    def supportsGzip(self) -> bool:
+        return self != ExportFormat.FEATHER
+
+
+def _date(activity: Activity) -> Any:
+    return activity.date
+
+
+# Merges the activity of several accounts (e.g., from AccountData.activity())
+# into date order.
+#
+# Only each account's own activity is sorted (by reference), instead of
+# collecting and sorting a copy of all activity together.
+def mergeActivity(activity: Iterable[Iterable[Activity]]) -> Iterator[Activity]:
+    return iter(heapq.merge(*(sorted(a, key=_date) for a in activity), key=_date))
+
+
+def _chunks(items: Iterable[_T], size: int) -> Iterator[List[_T]]:
+    it = iter(items)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+
+        yield chunk
+
+
+def _row(activity: Activity) -> List[Any]:
+    if isinstance(activity, Trade):
+        return [
+            activity.date.date(),
+            activity.action,
+            abs(activity.quantity),
+            str(activity.instrument),
+            activity.amount,
+            activity.fees,
+            "trade",
+        ]
+    elif isinstance(activity, CashPayment):
+        return [
+            activity.date.date(),
+            None,
+            None,
+            str(activity.instrument) if activity.instrument else None,
+            activity.proceeds,
+            None,
+            "payment",
+        ]
+    else:
+        raise ValueError(f"Unexpected type of activity: {activity}")
+
+
+def _writeCSV(chunks: Iterable[List[Activity]], path: str, compress: bool) -> int:
+    f: TextIO
+    if compress:
+        f = cast(TextIO, gzip.open(path, "wt", newline=""))
+    else:
+        f = open(path, "w", newline="")
+
+    count = 0
+    with f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(columns)
+        for chunk in chunks:
+            writer.writerows(_row(a) for a in chunk)
+            count += len(chunk)
+
+    return count
+
+
+# Decimal places kept for quantities and amounts in Arrow-based formats, which
+# require a fixed scale.
+_arrowScale = 10
+
+
+def _arrowSchema() -> Any:
+    import pyarrow  # type: ignore
+
+    decimal = pyarrow.decimal128(38, _arrowScale)
+    return pyarrow.schema(
+        [
+            ("Date", pyarrow.date32()),
+            ("Action", pyarrow.string()),
+            ("Quantity", decimal),
+            ("Instrument", pyarrow.string()),
+            ("Currency", pyarrow.string()),
+            ("Amount", decimal),
+            ("Fees", decimal),
+            ("Kind", pyarrow.string()),
+        ]
+    )
+
+
+def _arrowTable(activity: Sequence[Activity], schema: Any) -> Any:
+    import pyarrow
+
+    exponent = Decimal(10) ** -_arrowScale
+
+    def quantize(value: Optional[Decimal]) -> Optional[Decimal]:
+        return value.quantize(exponent) if value is not None else None
+
+    rows = [_row(a) for a in activity]
+    dates, actions, quantities, instruments, amounts, fees, kinds = zip(*rows)
+    return pyarrow.Table.from_pydict(
+        {
+            "Date": list(dates),
+            "Action": list(actions),
+            "Quantity": [quantize(q) for q in quantities],
+            "Instrument": list(instruments),
+            "Currency": [a.currency.name for a in amounts],
+            "Amount": [quantize(a.quantity) for a in amounts],
+            "Fees": [quantize(f.quantity) if f else None for f in fees],
+            "Kind": list(kinds),
+        },
+        schema=schema,
+    )
+
+
+def _writeParquet(chunks: Iterable[List[Activity]], path: str, compress: bool) -> int:
+    import pyarrow.parquet  # type: ignore
+
+    schema = _arrowSchema()
+    count = 0
+    with pyarrow.parquet.ParquetWriter(
+        path, schema, compression="gzip" if compress else "snappy"
+    ) as writer:
+        for chunk in chunks:
+            writer.write_table(_arrowTable(chunk, schema))
+            count += len(chunk)
+
+    return count
+
+
+def _writeFeather(chunks: Iterable[List[Activity]], path: str) -> int:
+    import pyarrow
+    import pyarrow.ipc  # type: ignore
+
+    schema = _arrowSchema()
+    count = 0
+    with pyarrow.OSFile(path, "wb") as sink:
+        with pyarrow.ipc.new_file(sink, schema) as writer:
+            for chunk in chunks:
+                writer.write_table(_arrowTable(chunk, schema))
+                count += len(chunk)
+
+    return count
+
+
+# Writes `activity` to `path`, `chunkSize` rows at a time, so that memory use
+# does not grow with the length of history. Activity should already be in the
+# desired order (e.g., from mergeActivity()).
+#
+# CSV output has the columns listed above. The Parquet and Feather formats
+# (which require pyarrow) keep typed dates and decimals, with the currency of
+# each amount in a separate column.
+#
+# If `compress` is true, CSV output is gzipped, and Parquet output uses gzip
+# compression internally. Feather does not support gzip.
+#
+# Returns the number of rows written.
+def exportActivity(
+    activity: Iterable[Activity],
+    path: str,
+    format: ExportFormat = ExportFormat.CSV,
+    compress: bool = False,
+    chunkSize: int = defaultChunkSize,
+) -> int:
+    if chunkSize < 1:
+        raise ValueError(f"Chunk size must be positive: {chunkSize}")
+    if compress and not format.supportsGzip:
+        raise ValueError(f"Cannot compress {format.value} output with gzip")
+
+    chunks = _chunks(activity, chunkSize)
+    if format == ExportFormat.PARQUET:
+        return _writeParquet(chunks, path, compress)
+    elif format == ExportFormat.FEATHER:
+        return _writeFeather(chunks, path)
+    else:
+        return _writeCSV(chunks, path, compress)
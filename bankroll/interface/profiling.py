@@ -0,0 +1,155 @@
+import json
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, TextIO
+
+# cProfile and tracemalloc are only imported once needed, so that runs which
+# aren't profiled don't pay for them.
+if TYPE_CHECKING:
+    import cProfile
+
+
+@dataclass(frozen=True)
+class StageTiming:
+    name: str
+    seconds: float
+
+    # The most memory allocated at once during this stage, or None if unknown.
+    peakMemoryBytes: Optional[int]
+
+
+# Measures each stage of a run (e.g., loading configuration, parsing account
+# data, fetching market data), for finding out where time goes.
+#
+# If `traceMemory` is true, peak memory use is also tracked with tracemalloc.
+# This is off by default, as tracing every allocation slows down the run and
+# distorts the timings. If `dumpPath` is provided, the whole run is also
+# profiled with cProfile, and the statistics written there on stop().
+#
+# A disabled profiler does nothing, so callers can use stage() without
+# checking whether profiling was requested.
+class Profiler:
+    def __init__(
+        self,
+        enabled: bool = True,
+        traceMemory: bool = False,
+        dumpPath: Optional[str] = None,
+        clock: Callable[[], float] = time.perf_counter,
+    ):
+        self._enabled = enabled
+        self._traceMemory = enabled and traceMemory
+        self._dumpPath = dumpPath if enabled else None
+        self._clock = clock
+
+        self._stages: List[StageTiming] = []
+        self._profile: Optional["cProfile.Profile"] = None
+        self._startedAt: Optional[float] = None
+        self._seconds: Optional[float] = None
+        self._peakMemoryBytes: Optional[int] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    @property
+    def stages(self) -> List[StageTiming]:
+        return list(self._stages)
+
+    def start(self) -> None:
+        if not self._enabled:
+            return
+
+        if self._traceMemory:
+            import tracemalloc
+
+            tracemalloc.start()
+
+        if self._dumpPath:
+            import cProfile
+
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+        self._startedAt = self._clock()
+
+    def stop(self) -> None:
+        if not self._enabled or self._startedAt is None:
+            return
+
+        self._seconds = self._clock() - self._startedAt
+        self._startedAt = None
+
+        if self._profile:
+            self._profile.disable()
+            if self._dumpPath:
+                self._profile.dump_stats(self._dumpPath)
+
+            self._profile = None
+
+        import tracemalloc
+
+        if self._traceMemory and tracemalloc.is_tracing():
+            # Stages reset the peak (where supported), so include theirs.
+            _, peak = tracemalloc.get_traced_memory()
+            self._peakMemoryBytes = max(
+                [peak] + [s.peakMemoryBytes or 0 for s in self._stages]
+            )
+            tracemalloc.stop()
+
+    # Times the enclosed block as a stage called `name`. Stages should not be
+    # nested.
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        if not self._enabled:
+            yield
+            return
+
+        import tracemalloc
+
+        # Per-stage peaks require tracemalloc.reset_peak() (Python 3.9+).
+        resetPeak: Optional[Callable[[], None]] = getattr(
+            tracemalloc, "reset_peak", None
+        )
+        stagePeaks = self._traceMemory and resetPeak is not None
+        if self._traceMemory and resetPeak is not None:
+            resetPeak()
+
+        started = self._clock()
+        try:
+            yield
+        finally:
+            seconds = self._clock() - started
+            peak: Optional[int] = None
+            if stagePeaks and tracemalloc.is_tracing():
+                _, peak = tracemalloc.get_traced_memory()
+
+            self._stages.append(
+                StageTiming(name=name, seconds=seconds, peakMemoryBytes=peak)
+            )
+
+    # Records a stage which was timed elsewhere (e.g., in another process), so
+    # it may overlap other stages. Its peak memory use is unknown.
+    def record(self, name: str, seconds: float) -> None:
+        if not self._enabled:
+            return
+
+        self._stages.append(
+            StageTiming(name=name, seconds=seconds, peakMemoryBytes=None)
+        )
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "totalSeconds": self._seconds,
+            "peakMemoryBytes": self._peakMemoryBytes,
+            "stages": [asdict(s) for s in self._stages],
+            "profileDump": self._dumpPath,
+        }
+
+    def writeSummary(self, file: TextIO) -> None:
+        json.dump(self.summary(), file, indent=2)
+        file.write("\n")
+
+
+# Used by default where profiling is optional.
+disabledProfiler = Profiler(enabled=False)
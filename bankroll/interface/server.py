@@ -0,0 +1,468 @@
+import errno
+import http.client
+import inspect
+import json
+import logging
+import socket
+import socketserver
+from datetime import datetime
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple, Union
+from urllib.parse import parse_qsl, urlsplit
+
+import bankroll.analysis as analysis
+from bankroll.broker import AccountAggregator
+from bankroll.marketdata import MarketDataProvider
+from bankroll.model import (
+    Activity,
+    AccountBalance,
+    Cash,
+    CashPayment,
+    Currency,
+    Instrument,
+    Position,
+    Stock,
+    Trade,
+)
+
+from .configuration import (
+    MarketDataSettings,
+    _parseBool,
+    defaultSocketPath,
+    marketDataProvider,
+)
+
+
+# Either the path of a Unix socket, or a TCP host and port.
+ServerAddress = Union[Path, Tuple[str, int]]
+
+
+# Parses an address given on the command line: "host:port" (optionally
+# prefixed with "http://") for TCP, or otherwise a path to a Unix socket.
+def parseAddress(address: str) -> ServerAddress:
+    if address.startswith("http://"):
+        address = address[len("http://") :].rstrip("/")
+
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and "/" not in address:
+        return (host or "localhost", int(port))
+
+    return Path(address).expanduser()
+
+
+def formatAddress(address: ServerAddress) -> str:
+    if isinstance(address, Path):
+        return str(address)
+
+    host, port = address
+    return f"http://{host}:{port}"
+
+
+# Raised when a request is invalid, or cannot be answered. Carries the HTTP
+# status to respond with.
+class ServerError(Exception):
+    def __init__(self, status: int, message: str):
+        self.status = status
+        super().__init__(message)
+
+
+def _decimal(value: Decimal) -> str:
+    # Strings keep full precision, unlike JSON numbers.
+    return str(value)
+
+
+def _date(value: datetime) -> str:
+    return value.isoformat()
+
+
+def _cash(cash: Cash) -> Dict[str, Any]:
+    return {"currency": cash.currency.name, "quantity": _decimal(cash.quantity)}
+
+
+# The inverse of _cash(), for clients reading a response.
+def decodeCash(value: Mapping[str, Any]) -> Cash:
+    return Cash(
+        currency=Currency[value["currency"]], quantity=Decimal(value["quantity"])
+    )
+
+
+# The balance in a response from BankrollService.balances().
+def decodeBalance(response: Mapping[str, Any]) -> AccountBalance:
+    cash = [decodeCash(c) for c in response["cash"]]
+    return AccountBalance(cash={c.currency: c for c in cash})
+
+
+def _instrument(instrument: Instrument) -> Dict[str, Any]:
+    return {
+        "type": type(instrument).__name__,
+        "symbol": instrument.symbol,
+        "currency": instrument.currency.name,
+        "description": str(instrument),
+    }
+
+
+def _position(position: Position) -> Dict[str, Any]:
+    return {
+        "instrument": _instrument(position.instrument),
+        "quantity": _decimal(position.quantity),
+        "costBasis": _cash(position.costBasis),
+        "description": str(position),
+    }
+
+
+def _activity(activity: Activity) -> Dict[str, Any]:
+    result: Dict[str, Any] = {
+        "type": type(activity).__name__,
+        "date": _date(activity.date),
+        "description": str(activity),
+    }
+
+    if isinstance(activity, Trade):
+        result.update(
+            instrument=_instrument(activity.instrument),
+            action=activity.action,
+            quantity=_decimal(activity.quantity),
+            amount=_cash(activity.amount),
+            fees=_cash(activity.fees),
+        )
+    elif isinstance(activity, CashPayment):
+        result.update(
+            instrument=_instrument(activity.instrument)
+            if activity.instrument
+            else None,
+            proceeds=_cash(activity.proceeds),
+        )
+
+    return result
+
+
+def _timelineEntry(entry: analysis.TimelineEntry) -> Dict[str, Any]:
+    return {
+        "date": _date(entry.date),
+        "realizedProfit": _cash(entry.realizedProfit),
+        "positions": [
+            {"instrument": _instrument(i), "quantity": _decimal(entry.positions[i])}
+            for i in sorted(entry.positions.keys())
+        ],
+        "description": str(entry),
+    }
+
+
+def _flag(value: Any) -> bool:
+    # Query string arguments arrive as strings.
+    return value if isinstance(value, bool) else _parseBool(str(value))
+
+
+# Answers the same questions as the command line's account commands, but keeps
+# the accounts, their parsed activity, and the market data connection resident
+# between requests, and returns results as JSON-compatible dictionaries.
+#
+# Requests are expected to be handled one at a time, on the thread which
+# created the market data connection (as ib_insync requires).
+class BankrollService:
+    def __init__(
+        self,
+        accounts: AccountAggregator,
+        marketDataSettings: Optional[Mapping[MarketDataSettings, str]] = None,
+    ):
+        self._accounts = accounts
+        self._marketDataSettings = marketDataSettings
+        self._dataProvider: Optional[MarketDataProvider] = None
+        self._activity: Optional[List[Activity]] = None
+        self._activityIndex: Optional[analysis.ActivityIndex] = None
+        super().__init__()
+
+    @property
+    def accounts(self) -> AccountAggregator:
+        return self._accounts
+
+    # Every activity across all accounts, parsed once and then reused.
+    @property
+    def allActivity(self) -> List[Activity]:
+        if self._activity is None:
+            self._activity = list(self._accounts.activity())
+
+        return self._activity
+
+    @property
+    def activityIndex(self) -> analysis.ActivityIndex:
+        if self._activityIndex is None:
+            self._activityIndex = analysis.ActivityIndex(self.allActivity)
+
+        return self._activityIndex
+
+    @property
+    def dataProvider(self) -> MarketDataProvider:
+        if self._dataProvider is None:
+            try:
+                self._dataProvider = marketDataProvider(
+                    self._accounts, self._marketDataSettings
+                )
+            except StopIteration:
+                raise ServerError(
+                    503, "Live data connection required to fetch market values"
+                )
+
+        return self._dataProvider
+
+    def positions(
+        self, realizedBasis: Any = False, liveValue: Any = False
+    ) -> Dict[str, Any]:
+        positions = sorted(self._accounts.positions(), key=lambda p: p.instrument)
+        results = [_position(p) for p in positions]
+
+        if _flag(liveValue):
+            values = analysis.liveValuesForPositions(
+                positions, dataProvider=self.dataProvider
+            )
+            for p, result in zip(positions, results):
+                result["marketValue"] = _cash(values[p]) if p in values else None
+
+        if _flag(realizedBasis):
+            for p, result in zip(positions, results):
+                if not isinstance(p.instrument, Stock):
+                    continue
+
+                basis = analysis.realizedBasisForSymbol(
+                    p.instrument.symbol, activity=self.activityIndex
+                )
+                result["realizedBasis"] = _cash(basis) if basis else None
+
+        return {"positions": results}
+
+    def activity(self) -> Dict[str, Any]:
+        return {
+            "activity": [
+                _activity(a)
+                for a in sorted(self.allActivity, key=lambda a: a.date, reverse=True)
+            ]
+        }
+
+    def balances(self) -> Dict[str, Any]:
+        balance = self._accounts.balance()
+        return {"cash": [_cash(balance.cash[c]) for c in sorted(balance.cash.keys())]}
+
+    def timeline(
+        self, symbol: Optional[str] = None, all: Any = False
+    ) -> Dict[str, Any]:
+        all = _flag(all)
+        if all == bool(symbol):
+            raise ServerError(400, "Specify either a symbol or all")
+
+        index = self.activityIndex
+        if symbol:
+            symbols = [analysis.normalizeSymbol(symbol)]
+        else:
+            symbols = sorted(index.underlyingSymbols)
+
+        timelines: Dict[str, Any] = {}
+        for s in symbols:
+            try:
+                timeline = analysis.compactTimelineForSymbol(s, index)
+            except ValueError as err:
+                if not all:
+                    raise ServerError(400, str(err))
+
+                logging.warning(f"Could not trace timeline for {s}: {err}")
+                continue
+
+            timelines[s] = [_timelineEntry(entry) for entry in timeline]
+
+        return {"timelines": timelines}
+
+    @property
+    def commands(self) -> Dict[str, Callable[..., Dict[str, Any]]]:
+        return {
+            "positions": self.positions,
+            "activity": self.activity,
+            "balances": self.balances,
+            "timeline": self.timeline,
+        }
+
+    # Runs `command` with the given keyword arguments, raising ServerError if
+    # the command or its arguments are invalid.
+    def handle(self, command: str, arguments: Mapping[str, Any]) -> Dict[str, Any]:
+        method = self.commands.get(command)
+        if method is None:
+            raise ServerError(404, f"Unknown command: {command}")
+
+        try:
+            inspect.signature(method).bind(**arguments)
+        except TypeError as err:
+            raise ServerError(400, f"Invalid arguments to {command}: {err}")
+
+        return method(**arguments)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    server: "_Server"
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        self._respond(url.path, dict(parse_qsl(url.query)))
+
+    def do_POST(self) -> None:
+        url = urlsplit(self.path)
+        length = int(str(self.headers.get("Content-Length") or 0))
+        try:
+            arguments = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as err:
+            self._send(400, {"error": f"Invalid JSON: {err}"})
+            return
+
+        if not isinstance(arguments, dict):
+            self._send(400, {"error": "Arguments must be a JSON object"})
+            return
+
+        self._respond(url.path, arguments)
+
+    def _respond(self, path: str, arguments: Dict[str, Any]) -> None:
+        command = path.strip("/")
+        service = self.server.service
+        if not command:
+            self._send(200, {"commands": sorted(service.commands.keys())})
+            return
+
+        try:
+            self._send(200, service.handle(command, arguments))
+        except ServerError as err:
+            self._send(err.status, {"error": str(err)})
+        except ValueError as err:
+            self._send(400, {"error": str(err)})
+        except Exception as err:
+            logging.exception(f"Failed to answer {command}")
+            self._send(500, {"error": str(err)})
+
+    def _send(self, status: int, body: Dict[str, Any]) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # Clients of a Unix socket have no address to log.
+        logging.info(format % args)
+
+
+class _Server(socketserver.TCPServer):
+    service: BankrollService
+
+
+class _TCPServer(HTTPServer, _Server):
+    pass
+
+
+class _UnixServer(socketserver.UnixStreamServer, _Server):
+    def __init__(self, path: Path):
+        self._path = path
+
+        # Typeshed declares TCP addresses for every TCPServer, but Unix stream
+        # servers are bound to a path.
+        address: Any = str(path)
+        super().__init__(address, _RequestHandler)
+
+    def server_close(self) -> None:
+        super().server_close()
+        try:
+            self._path.unlink()
+        except OSError:
+            pass
+
+
+def _removeStaleSocket(path: Path) -> None:
+    if not path.exists():
+        return
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(str(path))
+    except OSError:
+        path.unlink()
+    else:
+        # Matches the error from binding a TCP port which is in use.
+        raise OSError(errno.EADDRINUSE, f"Another server is listening on {path}")
+    finally:
+        probe.close()
+
+
+# Creates a server which answers requests to `service` at `address`. Call
+# serve_forever() to start handling requests, and server_close() to stop.
+#
+# Each command is available at a path of the same name, taking arguments from
+# the query string (for GET) or a JSON object (for POST), e.g.:
+#
+#   GET /positions?realizedBasis=true
+#   POST /timeline {"symbol": "SPY"}
+def makeServer(service: BankrollService, address: ServerAddress) -> _Server:
+    server: _Server
+    if isinstance(address, Path):
+        address.parent.mkdir(parents=True, exist_ok=True)
+        _removeStaleSocket(address)
+        server = _UnixServer(address)
+    else:
+        server = _TCPServer(address, _RequestHandler)
+
+    server.service = service
+    return server
+
+
+# Answers requests to `service` at `address` until interrupted.
+def serve(service: BankrollService, address: ServerAddress) -> None:
+    server = makeServer(service, address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: Path, timeout: int):
+        self._path = path
+        self._timeout = timeout
+        super().__init__("localhost", timeout=timeout)
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self._timeout)
+        self.sock.connect(str(self._path))
+
+
+# Asks the server at `address` to run `command`, returning its JSON response.
+#
+# Raises ServerError if the server rejects the request, or OSError if it cannot
+# be reached.
+def requestCommand(
+    address: ServerAddress,
+    command: str,
+    arguments: Optional[Mapping[str, Any]] = None,
+    timeout: int = 300,
+) -> Dict[str, Any]:
+    connection: http.client.HTTPConnection
+    if isinstance(address, Path):
+        connection = _UnixHTTPConnection(address, timeout=timeout)
+    else:
+        host, port = address
+        connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    try:
+        connection.request(
+            "POST",
+            f"/{command}",
+            body=json.dumps(dict(arguments or {})),
+            headers={"Content-Type": "application/json"},
+        )
+        response = connection.getresponse()
+        body: Dict[str, Any] = json.loads(response.read() or b"{}")
+    finally:
+        connection.close()
+
+    if response.status != 200:
+        raise ServerError(response.status, body.get("error", response.reason))
+
+    return body
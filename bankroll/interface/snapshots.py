@@ -0,0 +1,588 @@
+import hashlib
+import inspect
+import json
+import logging
+import os
+import pickle
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from itertools import chain
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+)
+
+from bankroll.broker import AccountAggregator, AccountData
+from bankroll.broker.configuration import Settings
+from bankroll.model import AccountBalance, Activity, Position
+
+from .profiling import Profiler, disabledProfiler
+
+if sys.version_info >= (3, 8):
+    from importlib.metadata import PackageNotFoundError, version
+else:
+    from importlib_metadata import PackageNotFoundError, version  # type: ignore
+
+defaultSnapshotDirectory = "~/.cache/bankroll/snapshots"
+
+
+# Identifies the exact contents of one file that account data was loaded from.
+class FileFingerprint(NamedTuple):
+    path: str
+    size: int
+    mtime: int
+    sha256: str
+
+    @classmethod
+    def ofFile(cls, path: Path) -> "FileFingerprint":
+        stat = path.stat()
+        return cls(
+            path=str(path),
+            size=stat.st_size,
+            mtime=stat.st_mtime_ns,
+            sha256=_hashFile(path),
+        )
+
+    # Whether `path` still has the same contents. The file is only hashed again
+    # if its size matches but its modification time does not.
+    def matches(self, path: Path) -> bool:
+        try:
+            stat = path.stat()
+        except OSError:
+            return False
+
+        if stat.st_size != self.size:
+            return False
+        elif stat.st_mtime_ns == self.mtime:
+            return True
+        else:
+            return _hashFile(path) == self.sha256
+
+
+def _hashFile(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+# Positions, activity, and balances loaded from one source of account data,
+# along with fingerprints of the files they were loaded from.
+@dataclass(frozen=True)
+class AccountSnapshot:
+    source: str
+    files: Sequence[FileFingerprint]
+    positions: Sequence[Position]
+    activity: Sequence[Activity]
+    balance: AccountBalance
+
+
+# Serves account data from an AccountSnapshot instead of the original source.
+class SnapshotAccount(AccountData):
+    @classmethod
+    def fromSettings(
+        cls, settings: Mapping[Settings, str], lenient: bool
+    ) -> "SnapshotAccount":
+        # Only created from a SnapshotCache.
+        raise NotImplementedError
+
+    def __init__(self, snapshot: AccountSnapshot):
+        self._snapshot = snapshot
+        super().__init__()
+
+    @property
+    def snapshot(self) -> AccountSnapshot:
+        return self._snapshot
+
+    def positions(self) -> Iterable[Position]:
+        return self._snapshot.positions
+
+    def activity(self) -> Iterable[Activity]:
+        return self._snapshot.activity
+
+    def balance(self) -> AccountBalance:
+        return self._snapshot.balance
+
+    def __str__(self) -> str:
+        return f"Snapshot of {self._snapshot.source}"
+
+
+@dataclass(frozen=True)
+class SnapshotStats:
+    directory: Path
+    snapshots: int
+    totalBytes: int
+    hits: int
+    misses: int
+
+    def __str__(self) -> str:
+        lookups = self.hits + self.misses
+        hitRate = f"{self.hits / lookups:.0%}" if lookups else "n/a"
+        return "\n".join(
+            [
+                f"Snapshot cache: {self.directory}",
+                f"\tSnapshots: {self.snapshots} ({self.totalBytes:,} bytes)",
+                f"\tHits: {self.hits}",
+                f"\tMisses: {self.misses}",
+                f"\tHit rate: {hitRate}",
+            ]
+        )
+
+
+# Keeps parsed account data on disk, so that sources whose files have not
+# changed don't need to be parsed again.
+#
+# Each snapshot is keyed by the type of account and the files its settings
+# resolve to. It is only used if every file it was loaded from still has the
+# same size and contents.
+class SnapshotCache:
+    # Bump when the snapshot format changes, to ignore older snapshots.
+    version = 1
+
+    def __init__(self, directory: str = defaultSnapshotDirectory):
+        self._directory = Path(directory).expanduser()
+        self._hits = 0
+        self._misses = 0
+
+        # How many of the above have been added to the totals on disk.
+        self._recordedHits = 0
+        self._recordedMisses = 0
+
+    @property
+    def directory(self) -> Path:
+        return self._directory
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    def _path(self, key: str) -> Path:
+        digest = hashlib.sha256(f"{self.version}:{key}".encode()).hexdigest()
+        return self._directory / f"{digest[:32]}.snapshot"
+
+    # Returns the snapshot stored under `key`, if it was loaded from exactly
+    # `paths`, and none of those files have changed.
+    def load(self, key: str, paths: Sequence[Path]) -> Optional[AccountSnapshot]:
+        snapshot: Optional[AccountSnapshot] = None
+        try:
+            with open(self._path(key), "rb") as f:
+                storedKey, loaded = pickle.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as err:
+            logging.warning(f"Ignoring unreadable snapshot for {key}: {err}")
+        else:
+            if (
+                storedKey == key
+                and [f.path for f in loaded.files] == [str(p) for p in paths]
+                and all(f.matches(Path(f.path)) for f in loaded.files)
+            ):
+                snapshot = loaded
+
+        if snapshot is None:
+            self._misses += 1
+        else:
+            self._hits += 1
+
+        return snapshot
+
+    def store(self, key: str, snapshot: AccountSnapshot) -> None:
+        self._directory.mkdir(parents=True, exist_ok=True)
+
+        fd, tmp = tempfile.mkstemp(dir=str(self._directory), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump((key, snapshot), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(tmp, str(self._path(key)))
+
+    def clear(self) -> int:
+        count = 0
+        for path in self._directory.glob("*.snapshot"):
+            path.unlink()
+            count += 1
+
+        return count
+
+    # Adds this session's hits and misses to the totals kept on disk.
+    def recordStats(self) -> None:
+        hits = self._hits - self._recordedHits
+        misses = self._misses - self._recordedMisses
+        if not hits and not misses:
+            return
+
+        totals = self._readTotals()
+        totals["hits"] += hits
+        totals["misses"] += misses
+        self._recordedHits = self._hits
+        self._recordedMisses = self._misses
+
+        self._directory.mkdir(parents=True, exist_ok=True)
+        with open(self._directory / "stats.json", "w") as f:
+            json.dump(totals, f)
+
+    def _readTotals(self) -> Dict[str, int]:
+        try:
+            with open(self._directory / "stats.json") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            stored = {}
+
+        return {
+            "hits": int(stored.get("hits", 0)),
+            "misses": int(stored.get("misses", 0)),
+        }
+
+    def stats(self) -> SnapshotStats:
+        paths = list(self._directory.glob("*.snapshot"))
+        totals = self._readTotals()
+        return SnapshotStats(
+            directory=self._directory,
+            snapshots=len(paths),
+            totalBytes=sum(p.stat().st_size for p in paths),
+            hits=totals["hits"] + self._hits - self._recordedHits,
+            misses=totals["misses"] + self._misses - self._recordedMisses,
+        )
+
+    def __str__(self) -> str:
+        return f"Snapshot cache in {self._directory}"
+
+
+def _accountSubclasses(
+    start: Type[AccountData] = AccountData,
+) -> Iterable[Type[AccountData]]:
+    return chain.from_iterable(
+        chain([cls], _accountSubclasses(cls))
+        for cls in start.__subclasses__()
+        if not issubclass(cls, (AccountAggregator, SnapshotAccount))
+    )
+
+
+# Every concrete type of account which can be loaded from settings, in the
+# order AccountAggregator.fromSettings() would load them.
+def accountTypes() -> List[Type[AccountData]]:
+    return [
+        accountCls
+        for accountCls in _accountSubclasses()
+        if not inspect.isabstract(accountCls)
+    ]
+
+
+def _package(cls: Type[Any]) -> str:
+    return cls.__module__.rsplit(".", 1)[0]
+
+
+# Returns the configured values of those `settings` which apply to
+# `accountCls`. Settings are declared alongside the account type which uses
+# them.
+def accountSettings(
+    accountCls: Type[AccountData], settings: Mapping[Settings, str]
+) -> Dict[Settings, str]:
+    return {
+        key: value
+        for key, value in settings.items()
+        if value and _package(type(key)) == _package(accountCls)
+    }
+
+
+# The installed version of the distribution providing a broker package, or None
+# if it is not installed (e.g., when run from a source checkout).
+#
+# Brokers are distributed as `bankroll_broker_<name>` for the package
+# `bankroll.brokers.<name>`. Other packages are assumed to be distributed
+# under their own name.
+@lru_cache(maxsize=None)
+def _brokerVersion(package: str) -> Optional[str]:
+    prefix = "bankroll.brokers."
+    if package.startswith(prefix):
+        distribution = "bankroll_broker_" + package[len(prefix) :]
+    else:
+        distribution = package.replace(".", "_")
+
+    try:
+        return str(version(distribution))
+    except PackageNotFoundError:
+        return None
+
+
+# Returns a snapshot key for loading `accountCls` with `settings`, along with
+# the files it would load from, or None if the source cannot be snapshotted
+# (e.g., because it fetches data over the network).
+#
+# The key includes the version of the broker, so that upgrading it (which may
+# change how files are parsed) invalidates its snapshots.
+def snapshotSource(
+    accountCls: Type[AccountData], settings: Mapping[Settings, str], lenient: bool
+) -> Optional[Tuple[str, List[Path]]]:
+    values = sorted(
+        (f"{type(key).__name__}.{key.name}", value)
+        for key, value in accountSettings(accountCls, settings).items()
+    )
+
+    if not values:
+        return None
+
+    # Key by the files each setting resolves to, rather than the setting itself,
+    # so that relative paths used from another directory, or files added to a
+    # configured directory, don't match an older snapshot.
+    resolved: List[Tuple[str, List[str]]] = []
+    paths: List[Path] = []
+    for name, value in values:
+        path = Path(value).expanduser()
+        if path.is_file():
+            files = [path.resolve()]
+        elif path.is_dir():
+            files = sorted(p.resolve() for p in path.rglob("*") if p.is_file())
+        else:
+            return None
+
+        resolved.append((name, [str(p) for p in files]))
+        paths.extend(files)
+
+    key = json.dumps(
+        [
+            f"{accountCls.__module__}.{accountCls.__qualname__}",
+            _brokerVersion(_package(accountCls)),
+            resolved,
+            lenient,
+        ]
+    )
+    return (key, paths)
+
+
+def _snapshotOf(
+    accountCls: Type[AccountData],
+    account: AccountData,
+    fingerprints: Sequence[FileFingerprint],
+) -> AccountSnapshot:
+    return AccountSnapshot(
+        source=accountCls.__name__,
+        files=fingerprints,
+        positions=list(account.positions()),
+        activity=list(account.activity()),
+        balance=account.balance(),
+    )
+
+
+def _storeIfUnchanged(
+    cache: SnapshotCache, key: str, snapshot: AccountSnapshot
+) -> None:
+    if all(f.matches(Path(f.path)) for f in snapshot.files):
+        cache.store(key, snapshot)
+
+
+# Loads one type of account from `settings`, from a snapshot in `cache` if
+# possible (saving a new snapshot otherwise), or returns None if `accountCls`
+# cannot be loaded from settings.
+def loadAccount(
+    accountCls: Type[AccountData],
+    settings: Mapping[Settings, str],
+    lenient: bool,
+    cache: Optional[SnapshotCache],
+) -> Optional[AccountData]:
+    source = snapshotSource(accountCls, settings, lenient) if cache else None
+    fingerprints: List[FileFingerprint] = []
+    if cache and source:
+        key, paths = source
+        snapshot = cache.load(key, paths)
+        if snapshot:
+            logging.info(f"Loaded {snapshot.source} from snapshot")
+            return SnapshotAccount(snapshot)
+
+        # Fingerprint files before loading them, so that changes made while
+        # loading are detected below.
+        fingerprints = [FileFingerprint.ofFile(p) for p in paths]
+
+    try:
+        account = accountCls.fromSettings(settings, lenient=lenient)
+    except NotImplementedError:
+        return None
+
+    if not cache or not source:
+        return account
+
+    key, _ = source
+    _storeIfUnchanged(cache, key, _snapshotOf(accountCls, account, fingerprints))
+    return account
+
+
+# Parses account data from local files, in a worker process. Returns a
+# snapshot, rather than the AccountData itself (which may not be picklable),
+# along with how many seconds loading took.
+def _parseInProcess(
+    accountCls: Type[AccountData],
+    settings: Mapping[Settings, str],
+    lenient: bool,
+    paths: Sequence[Path],
+    fingerprint: bool,
+) -> Tuple[Optional[AccountSnapshot], float]:
+    started = time.perf_counter()
+    fingerprints = [FileFingerprint.ofFile(p) for p in paths] if fingerprint else []
+    try:
+        account = accountCls.fromSettings(settings, lenient=lenient)
+    except NotImplementedError:
+        return (None, time.perf_counter() - started)
+
+    snapshot = _snapshotOf(accountCls, account, fingerprints)
+    return (snapshot, time.perf_counter() - started)
+
+
+def _logLoadTime(accountCls: Type[AccountData], seconds: float) -> None:
+    logging.info(f"Loaded {accountCls.__name__} in {seconds:.3f}s")
+
+
+# Loads each type of account at the same time.
+#
+# Sources configured entirely by local paths are parsed in worker processes,
+# as parsing is CPU-bound. The others (which use live connections or download
+# data) are loaded on this thread meanwhile, because live connections like
+# ib_insync's are bound to the event loop of the thread which opened them.
+def _loadAccountsConcurrently(
+    accountClasses: Sequence[Type[AccountData]],
+    sources: Mapping[Type[AccountData], Optional[Tuple[str, List[Path]]]],
+    settings: Mapping[Settings, str],
+    lenient: bool,
+    cache: Optional[SnapshotCache],
+    profiler: Profiler,
+) -> List[AccountData]:
+    loaded: Dict[Type[AccountData], Optional[AccountData]] = {}
+    local: List[Tuple[Type[AccountData], str, List[Path]]] = []
+    remote: List[Type[AccountData]] = []
+
+    for accountCls in accountClasses:
+        source = sources[accountCls]
+        if not source:
+            remote.append(accountCls)
+            continue
+
+        key, paths = source
+        snapshot = cache.load(key, paths) if cache else None
+        if snapshot:
+            logging.info(f"Loaded {snapshot.source} from snapshot")
+            loaded[accountCls] = SnapshotAccount(snapshot)
+        else:
+            local.append((accountCls, key, paths))
+
+    # Only imported here, as multiprocessing is slow to import.
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = min(len(local), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = [
+            (
+                accountCls,
+                key,
+                executor.submit(
+                    _parseInProcess,
+                    accountCls,
+                    dict(settings),
+                    lenient,
+                    paths,
+                    cache is not None,
+                ),
+            )
+            for accountCls, key, paths in local
+        ]
+
+        for accountCls in remote:
+            started = time.perf_counter()
+            with profiler.stage(f"load {accountCls.__name__}"):
+                try:
+                    loaded[accountCls] = accountCls.fromSettings(
+                        settings, lenient=lenient
+                    )
+                except NotImplementedError:
+                    pass
+
+            _logLoadTime(accountCls, time.perf_counter() - started)
+
+        for accountCls, key, future in futures:
+            snapshot, seconds = future.result()
+            profiler.record(f"load {accountCls.__name__}", seconds)
+            _logLoadTime(accountCls, seconds)
+
+            if not snapshot:
+                continue
+
+            if cache:
+                _storeIfUnchanged(cache, key, snapshot)
+
+            loaded[accountCls] = SnapshotAccount(snapshot)
+
+    # Keep the same order as loading one after another would.
+    return [
+        account
+        for account in (loaded.get(accountCls) for accountCls in accountClasses)
+        if account
+    ]
+
+
+# Like AccountAggregator.fromSettings(), but loads each source of account data
+# from `cache` where possible, and saves newly loaded data to it.
+#
+# Only sources configured entirely by local paths are cached; those which use
+# live connections or download data are always loaded normally.
+#
+# If `parallel` is true and at least two sources are configured by local paths,
+# sources are loaded concurrently (see _loadAccountsConcurrently()). Accounts
+# parsed in worker processes are returned as SnapshotAccounts, but the
+# aggregated data is the same.
+#
+# If `profiler` is provided, loading each type of account is timed as a
+# separate stage.
+def loadAccounts(
+    settings: Mapping[Settings, str],
+    lenient: bool,
+    cache: Optional[SnapshotCache] = None,
+    profiler: Profiler = disabledProfiler,
+    parallel: bool = False,
+) -> AccountAggregator:
+    accountClasses = accountTypes()
+
+    def load(accountCls: Type[AccountData]) -> Optional[AccountData]:
+        with profiler.stage(f"load {accountCls.__name__}"):
+            return loadAccount(accountCls, settings, lenient=lenient, cache=cache)
+
+    sources = (
+        {c: snapshotSource(c, settings, lenient) for c in accountClasses}
+        if parallel
+        else {}
+    )
+
+    accounts: Iterable[AccountData]
+    # Worker processes only pay off with at least two sources to parse.
+    if sum(1 for source in sources.values() if source) >= 2:
+        accounts = _loadAccountsConcurrently(
+            accountClasses,
+            sources,
+            settings,
+            lenient=lenient,
+            cache=cache,
+            profiler=profiler,
+        )
+    else:
+        accounts = filter(None, (load(accountCls) for accountCls in accountClasses))
+
+    aggregator = AccountAggregator(accounts=accounts, lenient=lenient)
+
+    if cache:
+        cache.recordStats()
+
+    return aggregator
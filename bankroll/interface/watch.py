@@ -0,0 +1,290 @@
+import heapq
+import logging
+import time
+from collections import Counter
+from dataclasses import dataclass
+from importlib.util import find_spec
+from itertools import chain
+from pathlib import Path
+from typing import (
+    AbstractSet,
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+)
+
+import bankroll.analysis as analysis
+from bankroll.broker import AccountAggregator, AccountData
+from bankroll.broker.configuration import Settings
+from bankroll.model import Activity, Cash
+
+from .configuration import defaultPollInterval
+from .snapshots import (
+    SnapshotCache,
+    accountSettings,
+    accountTypes,
+    loadAccount,
+    snapshotSource,
+)
+
+# The path, size, and modification time of each file a source is loaded from.
+_FileState = Tuple[Tuple[str, int, int], ...]
+
+
+def _fileState(paths: Iterable[Path]) -> Optional[_FileState]:
+    try:
+        return tuple(
+            (str(p), stat.st_size, stat.st_mtime_ns)
+            for p, stat in ((p, p.stat()) for p in paths)
+        )
+    except OSError:
+        return None
+
+
+def _date(activity: Activity) -> Any:
+    return activity.date
+
+
+# What changed after some sources of account data were parsed again.
+@dataclass(frozen=True)
+class ActivityChange:
+    # The names of the account types which were parsed again.
+    sources: Sequence[str]
+
+    added: Sequence[Activity]
+    removed: Sequence[Activity]
+
+    # The normalized symbols whose activity changed.
+    @property
+    def symbols(self) -> AbstractSet[str]:
+        return frozenset(
+            chain.from_iterable(
+                analysis.symbolsAffectedByActivity(a)
+                for a in chain(self.added, self.removed)
+            )
+        )
+
+
+# The realized basis and timeline of a symbol, recomputed after its activity
+# changed. Both are None if no activity for the symbol remains.
+@dataclass(frozen=True)
+class SymbolUpdate:
+    symbol: str
+    realizedBasis: Optional[Cash]
+    timeline: Optional[analysis.CompactTimeline]
+
+    def __str__(self) -> str:
+        if self.realizedBasis is None and not self.timeline:
+            return f"{self.symbol}: no activity"
+
+        lines = [f"{self.symbol}: realized basis {self.realizedBasis}"]
+        if self.timeline:
+            lines.append(str(self.timeline[-1]))
+
+        return "\n".join(lines)
+
+
+# Keeps account data loaded, and parses a source again only when the files it
+# was loaded from change.
+#
+# Only sources configured entirely by local paths (the same ones which
+# SnapshotCache can store) are watched. Others, like those which use live
+# connections or download data, are loaded once.
+#
+# Activity is indexed by symbol per source, so that after a change, only the
+# symbols whose activity changed need to be analyzed again.
+class AccountWatcher:
+    def __init__(
+        self,
+        settings: Mapping[Settings, str],
+        lenient: bool,
+        cache: Optional[SnapshotCache] = None,
+    ):
+        self._settings = settings
+        self._lenient = lenient
+        self._cache = cache
+
+        self._accounts: Dict[Type[AccountData], AccountData] = {}
+        self._activity: Dict[Type[AccountData], List[Activity]] = {}
+        self._indexes: Dict[Type[AccountData], analysis.ActivityIndex] = {}
+        self._states: Dict[Type[AccountData], Optional[_FileState]] = {}
+
+        for accountCls in accountTypes():
+            source = snapshotSource(accountCls, settings, lenient)
+            if source:
+                self._states[accountCls] = _fileState(source[1])
+
+            account = loadAccount(accountCls, settings, lenient=lenient, cache=cache)
+            if account:
+                self._setAccount(accountCls, account)
+
+        if cache:
+            cache.recordStats()
+
+        super().__init__()
+
+    def _setAccount(self, accountCls: Type[AccountData], account: AccountData) -> None:
+        activity = list(account.activity())
+        self._accounts[accountCls] = account
+        self._activity[accountCls] = activity
+        self._indexes[accountCls] = analysis.ActivityIndex(activity)
+
+    @property
+    def accounts(self) -> AccountAggregator:
+        return AccountAggregator(
+            accounts=list(self._accounts.values()), lenient=self._lenient
+        )
+
+    # The configured paths (files or directories) of every watched source.
+    @property
+    def watchedPaths(self) -> Sequence[Path]:
+        return [
+            Path(value).expanduser()
+            for accountCls in self._states.keys()
+            for value in accountSettings(accountCls, self._settings).values()
+        ]
+
+    # Parses again every watched source whose files have changed since they
+    # were last loaded, and returns what changed, or None if nothing did.
+    #
+    # If a source fails to parse (e.g., because its file is still being
+    # written), its previous data is kept until its files change again.
+    def poll(self) -> Optional[ActivityChange]:
+        sources: List[str] = []
+        added: List[Activity] = []
+        removed: List[Activity] = []
+
+        for accountCls, previousState in self._states.items():
+            source = snapshotSource(accountCls, self._settings, self._lenient)
+            state = _fileState(source[1]) if source else None
+            if state == previousState:
+                continue
+
+            self._states[accountCls] = state
+            try:
+                account = loadAccount(
+                    accountCls, self._settings, lenient=self._lenient, cache=self._cache
+                )
+            except Exception as err:
+                logging.warning(
+                    f"Failed to load {accountCls.__name__}, keeping previous data: {err}"
+                )
+                continue
+
+            if account is None:
+                continue
+
+            previous = Counter(self._activity.get(accountCls, []))
+            self._setAccount(accountCls, account)
+            current = Counter(self._activity[accountCls])
+
+            sources.append(accountCls.__name__)
+            added.extend((current - previous).elements())
+            removed.extend((previous - current).elements())
+
+        if self._cache:
+            self._cache.recordStats()
+
+        if not sources:
+            return None
+
+        return ActivityChange(sources=sources, added=added, removed=removed)
+
+    # Returns the activity affecting `symbol` across all sources, sorted by
+    # date (as a single ActivityIndex over all activity would).
+    def activityForSymbol(self, symbol: str) -> List[Activity]:
+        return list(
+            heapq.merge(
+                *(index.activityForSymbol(symbol) for index in self._indexes.values()),
+                key=_date,
+            )
+        )
+
+    # Recomputes the realized basis and timeline of each of `symbols`, yielding
+    # each as soon as it is ready.
+    def updates(self, symbols: Iterable[str]) -> Iterator[SymbolUpdate]:
+        for symbol in sorted(symbols):
+            activity = self.activityForSymbol(symbol)
+            timeline: Optional[analysis.CompactTimeline] = None
+            try:
+                timeline = analysis.compactTimelineForSymbol(
+                    symbol, activity, presorted=True
+                )
+            except ValueError as err:
+                logging.warning(f"Could not trace timeline for {symbol}: {err}")
+
+            yield SymbolUpdate(
+                symbol=symbol,
+                realizedBasis=analysis.realizedBasisForSymbol(symbol, activity),
+                timeline=timeline,
+            )
+
+    # Waits for watched files to change, yielding each change after the
+    # affected sources have been parsed again. Runs until interrupted.
+    def watch(
+        self, pollInterval: float = defaultPollInterval
+    ) -> Iterator[ActivityChange]:
+        waiter = _waiter(self.watchedPaths, pollInterval)
+        while True:
+            waiter.wait()
+
+            change = self.poll()
+            if change:
+                yield change
+
+
+class _Waiter:
+    def __init__(self, pollInterval: float):
+        self._pollInterval = pollInterval
+        super().__init__()
+
+    def wait(self) -> None:
+        time.sleep(self._pollInterval)
+
+
+# Wakes up as soon as anything changes in the directories containing the
+# watched paths, or after the poll interval otherwise.
+class _InotifyWaiter(_Waiter):
+    def __init__(self, paths: Iterable[Path], pollInterval: float):
+        from inotify_simple import INotify, flags  # type: ignore
+
+        self._inotify = INotify()
+
+        # Watch directories, rather than files, so that files which are
+        # replaced (instead of written in place) are still noticed.
+        mask = (
+            flags.CLOSE_WRITE
+            | flags.MOVED_TO
+            | flags.CREATE
+            | flags.DELETE
+            | flags.MODIFY
+        )
+        for directory in {p if p.is_dir() else p.parent for p in paths}:
+            self._inotify.add_watch(str(directory), mask)
+
+        super().__init__(pollInterval)
+
+    def wait(self) -> None:
+        if not self._inotify.read(timeout=int(self._pollInterval * 1000)):
+            return
+
+        # Let writers finish, and coalesce bursts of events.
+        while self._inotify.read(timeout=100):
+            pass
+
+
+def _waiter(paths: Sequence[Path], pollInterval: float) -> _Waiter:
+    if find_spec("inotify_simple") is not None:
+        try:
+            return _InotifyWaiter(paths, pollInterval)
+        except OSError as err:
+            logging.warning(f"Falling back to polling, as inotify failed: {err}")
+
+    return _Waiter(pollInterval)
@@ -0,0 +1,182 @@
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import timeit
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .suite import benchmarks
+
+parser = ArgumentParser(
+    prog="python -m benchmarks",
+    description="Times bankroll's analysis functions over synthetic account data, and writes the results as JSON.",
+)
+parser.add_argument(
+    "-k",
+    "--filter",
+    help="Only run benchmarks whose names contain this string",
+    default="",
+)
+parser.add_argument(
+    "--sizes",
+    help="How many activities and positions to generate (default: 1000 10000)",
+    nargs="+",
+    type=int,
+    default=[1000, 10000],
+)
+parser.add_argument(
+    "--seed", help="Seed for generating data (default: 0)", type=int, default=0
+)
+parser.add_argument(
+    "--repeat",
+    help="How many times to time each benchmark (default: 5)",
+    type=int,
+    default=5,
+)
+parser.add_argument(
+    "-o",
+    "--output",
+    metavar="out-file",
+    help="Path to write results as JSON (default: standard output)",
+)
+parser.add_argument(
+    "--compare",
+    metavar="baseline-file",
+    help="Path to results from a previous run, to compare against",
+)
+parser.add_argument(
+    "--threshold",
+    help="With --compare, fail if any benchmark's median time grows by more than this factor (default: 1.25)",
+    type=float,
+    default=1.25,
+)
+
+
+def _commit() -> Optional[str]:
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=Path(__file__).parent,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return str(result.stdout).strip()
+
+
+# Times one benchmark, returning the seconds taken per call in each repetition.
+def timeBenchmark(name: str, size: int, seed: int, repeat: int) -> Dict[str, Any]:
+    timer = timeit.Timer(benchmarks[name](size, seed))
+
+    # Call quick functions enough times to be measured accurately.
+    number, _ = timer.autorange()
+    times = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+
+    return {
+        "name": name,
+        "size": size,
+        "number": number,
+        "min": min(times),
+        "median": statistics.median(times),
+        "times": times,
+    }
+
+
+def runBenchmarks(
+    names: List[str], sizes: List[int], seed: int, repeat: int
+) -> Dict[str, Any]:
+    results: List[Dict[str, Any]] = []
+    for size in sizes:
+        for name in names:
+            results.append(timeBenchmark(name, size, seed, repeat))
+
+    return {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "seed": seed,
+        "results": results,
+    }
+
+
+# Compares the median times in `results` against those in `baseline`, returning
+# the factor by which each benchmark's median changed. Benchmarks missing from
+# the baseline are skipped.
+def compareMedians(
+    results: Dict[str, Any], baseline: Dict[str, Any]
+) -> List[Tuple[str, int, float]]:
+    previous = {(r["name"], r["size"]): r["median"] for r in baseline["results"]}
+
+    ratios: List[Tuple[str, int, float]] = []
+    for r in results["results"]:
+        before = previous.get((r["name"], r["size"]))
+        if not before:
+            continue
+
+        ratios.append((r["name"], r["size"], r["median"] / before))
+
+    return ratios
+
+
+# Returns the benchmarks which slowed down by more than `threshold` relative to
+# `baseline`, along with the factor by which they did.
+def compareResults(
+    results: Dict[str, Any], baseline: Dict[str, Any], threshold: float
+) -> List[Tuple[str, int, float]]:
+    return [
+        (name, size, ratio)
+        for name, size, ratio in compareMedians(results, baseline)
+        if ratio > threshold
+    ]
+
+
+def main() -> None:
+    args = parser.parse_args()
+
+    names = [name for name in benchmarks.keys() if args.filter in name]
+    if not names:
+        parser.error(f"No benchmarks match {args.filter!r}")
+
+    results = runBenchmarks(names, args.sizes, seed=args.seed, repeat=args.repeat)
+    for r in results["results"]:
+        print(
+            f"{r['name']:30} {r['size']:>10,} {r['median'] * 1000:>12.3f} ms",
+            file=sys.stderr,
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+        for name, size, ratio in compareMedians(results, baseline):
+            print(f"{name:30} {size:>10,} {ratio:>11.2f}x", file=sys.stderr)
+
+        regressions = compareResults(results, baseline, args.threshold)
+        for name, size, ratio in regressions:
+            print(
+                f"Regression: {name} at size {size:,} is {ratio:.2f}x slower",
+                file=sys.stderr,
+            )
+
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
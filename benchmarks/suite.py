@@ -0,0 +1,135 @@
+import operator
+from collections import deque
+from functools import reduce
+from typing import Any, Callable, Dict
+
+import bankroll.analysis as analysis
+from bankroll.model import Currency
+
+from .synthetic import FakeDataProvider, generate, generateBars, generateCash
+
+# A benchmark is set up from a data size and random seed (which is not timed),
+# returning the function to time.
+Benchmark = Callable[[int, int], Callable[[], Any]]
+
+benchmarks: Dict[str, Benchmark] = {}
+
+
+def benchmark(name: str) -> Callable[[Benchmark], Benchmark]:
+    def register(setup: Benchmark) -> Benchmark:
+        benchmarks[name] = setup
+        return setup
+
+    return register
+
+
+# Consumes an iterable without keeping its items.
+def _exhaust(it: Any) -> None:
+    deque(it, maxlen=0)
+
+
+# Bars are generated for fewer instruments than activity, as real portfolios
+# hold far fewer instruments than they have trades.
+def _barsForSize(size: int, seed: int) -> Any:
+    return generateBars(
+        instruments=min(500, max(10, size // 100)), days=2520, seed=seed
+    )
+
+
+@benchmark("realizedBasisForSymbol")
+def realizedBasisForSymbol(size: int, seed: int) -> Callable[[], Any]:
+    data = generate(size, seed)
+    symbol = data.busiestSymbol
+    return lambda: analysis.realizedBasisForSymbol(symbol, data.activity)
+
+
+@benchmark("realizedBasisForAllSymbols")
+def realizedBasisForAllSymbols(size: int, seed: int) -> Callable[[], Any]:
+    data = generate(size, seed)
+    return lambda: analysis.ActivityIndex(data.activity).realizedBasisForAllSymbols()
+
+
+@benchmark("ActivityFrame")
+def activityFrame(size: int, seed: int) -> Callable[[], Any]:
+    data = generate(size, seed)
+    return lambda: analysis.ActivityFrame(data.activity)
+
+
+@benchmark("ActivityFrame.realizedBasisForAllSymbols")
+def frameRealizedBasisForAllSymbols(size: int, seed: int) -> Callable[[], Any]:
+    frame = analysis.ActivityFrame(generate(size, seed).activity)
+    return lambda: frame.realizedBasisForAllSymbols()
+
+
+@benchmark("timelineForSymbol")
+def timelineForSymbol(size: int, seed: int) -> Callable[[], Any]:
+    data = generate(size, seed)
+    symbol = data.busiestSymbol
+    return lambda: _exhaust(analysis.timelineForSymbol(symbol, data.activity))
+
+
+@benchmark("ActivityFrame.timelineForSymbol")
+def frameTimelineForSymbol(size: int, seed: int) -> Callable[[], Any]:
+    data = generate(size, seed)
+    frame = analysis.ActivityFrame(data.activity)
+    symbol = data.busiestSymbol
+    return lambda: frame.timelineForSymbol(symbol)
+
+
+@benchmark("analyzeSymbols")
+def analyzeSymbols(size: int, seed: int) -> Callable[[], Any]:
+    index = analysis.ActivityIndex(generate(size, seed).activity)
+    return lambda: _exhaust(analysis.analyzeSymbols(index, jobs=1))
+
+
+@benchmark("analyzeSymbols.parallel")
+def analyzeSymbolsParallel(size: int, seed: int) -> Callable[[], Any]:
+    index = analysis.ActivityIndex(generate(size, seed).activity)
+    return lambda: _exhaust(analysis.analyzeSymbols(index))
+
+
+@benchmark("deduplicatePositions")
+def deduplicatePositions(size: int, seed: int) -> Callable[[], Any]:
+    data = generate(size, seed)
+    return lambda: _exhaust(analysis.deduplicatePositions(data.positions))
+
+
+@benchmark("liveValuesForPositions")
+def liveValuesForPositions(size: int, seed: int) -> Callable[[], Any]:
+    data = generate(size, seed)
+    positions = list(analysis.deduplicatePositions(data.positions))
+    provider = FakeDataProvider(data.quotes)
+    return lambda: analysis.liveValuesForPositions(positions, provider)
+
+
+@benchmark("convertCashToCurrency")
+def convertCashToCurrency(size: int, seed: int) -> Callable[[], Any]:
+    data = generate(size, seed)
+    provider = FakeDataProvider(data.quotes)
+    return lambda: analysis.convertCashToCurrency(Currency.USD, data.cash, provider)
+
+
+@benchmark("sumCash")
+def sumCash(size: int, seed: int) -> Callable[[], Any]:
+    cash = generateCash(size, seed)
+    return lambda: analysis.sumCash(cash)
+
+
+# The reduce() which sumCash() replaces, for comparison.
+@benchmark("sumCash.reduce")
+def sumCashByReduce(size: int, seed: int) -> Callable[[], Any]:
+    cash = generateCash(size, seed)
+    return lambda: reduce(operator.add, cash)
+
+
+@benchmark("stocks_to_portfolio")
+def stocksToPortfolio(size: int, seed: int) -> Callable[[], Any]:
+    bars, weights = _barsForSize(size, seed)
+    return lambda: analysis.stocks_to_portfolio(bars, weights)
+
+
+@benchmark("etf")
+def etf(size: int, seed: int) -> Callable[[], Any]:
+    bars, weights = _barsForSize(size, seed)
+    panel = analysis.bars_to_panel(bars, weights)
+    return lambda: analysis.etf(panel, "America/New_York")
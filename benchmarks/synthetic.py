@@ -0,0 +1,313 @@
+import random
+import string
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from functools import lru_cache
+from typing import Dict, Iterable, List, Set, Tuple
+
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+
+from bankroll.marketdata import MarketDataProvider
+from bankroll.model import (
+    Activity,
+    Cash,
+    CashPayment,
+    Currency,
+    Forex,
+    Instrument,
+    Option,
+    OptionType,
+    Position,
+    Quote,
+    Stock,
+    Trade,
+    TradeFlags,
+)
+
+# The first day of synthetic activity.
+epoch = datetime(2000, 1, 3, 9, 30)
+
+
+# Randomly generated, but reproducible, account data for benchmarks.
+#
+# Every symbol trades in a single currency (so that its realized basis can be
+# summed), along with options upon it. Positions are drawn as if from several
+# accounts, so that most instruments appear more than once.
+@dataclass(frozen=True)
+class SyntheticData:
+    seed: int
+    symbols: List[str]
+    activity: List[Activity]
+    positions: List[Position]
+    quotes: Dict[Instrument, Quote]
+
+    # Cash in many currencies, as from the balances of many accounts.
+    cash: List[Cash]
+
+    # The symbol with the most activity.
+    @property
+    def busiestSymbol(self) -> str:
+        counts: Dict[str, int] = {}
+        for a in self.activity:
+            if isinstance(a, Trade) and isinstance(a.instrument, Option):
+                symbol = a.instrument.underlying
+            elif isinstance(a, (Trade, CashPayment)) and a.instrument:
+                symbol = a.instrument.symbol
+            else:
+                continue
+
+            counts[symbol] = counts.get(symbol, 0) + 1
+
+        return max(sorted(counts.keys()), key=lambda s: counts[s])
+
+
+def _symbols(rng: random.Random, count: int) -> List[str]:
+    symbols: Set[str] = set()
+    while len(symbols) < count:
+        symbol = "".join(rng.choices(string.ascii_uppercase, k=rng.randint(2, 5)))
+
+        # Some multi-class shares, which need to be normalized.
+        if rng.random() < 0.02:
+            symbol += "." + rng.choice("AB")
+
+        symbols.add(symbol)
+
+    return sorted(symbols)
+
+
+def _price(rng: random.Random, low: float, high: float) -> Decimal:
+    return Cash.quantize(Decimal(rng.uniform(low, high)))
+
+
+def _option(
+    rng: random.Random, underlying: str, currency: Currency, price: Decimal
+) -> Option:
+    return Option(
+        underlying=underlying,
+        currency=currency,
+        optionType=rng.choice([OptionType.CALL, OptionType.PUT]),
+        expiration=date(2000, 1, 21) + timedelta(weeks=rng.randrange(0, 52 * 20)),
+        strike=Decimal(max(1, int(price * Decimal(rng.uniform(0.5, 1.5))))),
+    )
+
+
+def _instruments(
+    rng: random.Random,
+    symbols: List[str],
+    currencies: Dict[str, Currency],
+    prices: Dict[str, Decimal],
+) -> Iterable[Instrument]:
+    while True:
+        symbol = rng.choice(symbols)
+        if rng.random() < 0.3:
+            yield _option(rng, symbol, currencies[symbol], prices[symbol])
+        else:
+            yield Stock(symbol=symbol, currency=currencies[symbol])
+
+
+def _activity(
+    rng: random.Random,
+    count: int,
+    symbols: List[str],
+    currencies: Dict[str, Currency],
+    prices: Dict[str, Decimal],
+) -> List[Activity]:
+    result: List[Activity] = []
+    when = epoch
+    instruments = iter(_instruments(rng, symbols, currencies, prices))
+
+    for _ in range(count):
+        when += timedelta(minutes=rng.randrange(1, 600))
+        instrument = next(instruments)
+        currency = instrument.currency
+
+        if isinstance(instrument, Stock) and rng.random() < 0.15:
+            result.append(
+                CashPayment(
+                    date=when,
+                    instrument=instrument,
+                    proceeds=Cash(currency=currency, quantity=_price(rng, 1, 500)),
+                )
+            )
+            continue
+
+        quantity = Decimal(rng.choice([-1, 1]) * rng.randint(1, 500))
+        price = _price(rng, 0.5, 20) if isinstance(instrument, Option) else None
+        unitPrice = price or prices[instrument.symbol]
+        result.append(
+            Trade(
+                date=when,
+                instrument=instrument,
+                quantity=quantity,
+                amount=Cash(
+                    currency=currency,
+                    quantity=-quantity * unitPrice * instrument.multiplier,
+                ),
+                fees=Cash(currency=currency, quantity=_price(rng, 0, 5)),
+                flags=TradeFlags.OPEN if quantity > 0 else TradeFlags.CLOSE,
+            )
+        )
+
+    return result
+
+
+def _positions(
+    rng: random.Random,
+    count: int,
+    symbols: List[str],
+    currencies: Dict[str, Currency],
+    prices: Dict[str, Decimal],
+) -> List[Position]:
+    # Draw distinct instruments first, then hold most of them in more than one
+    # account.
+    distinct: List[Instrument] = []
+    seen: Set[Instrument] = set()
+    instruments = iter(_instruments(rng, symbols, currencies, prices))
+    while len(distinct) < max(1, count // 2):
+        instrument = next(instruments)
+        if instrument not in seen:
+            seen.add(instrument)
+            distinct.append(instrument)
+
+    result: List[Position] = []
+    while len(result) < count:
+        instrument = rng.choice(distinct)
+        quantity = Decimal(rng.randint(1, 1000))
+        result.append(
+            Position(
+                instrument=instrument,
+                quantity=quantity,
+                costBasis=Cash(
+                    currency=instrument.currency,
+                    quantity=quantity * _price(rng, 0.5, 1000) * instrument.multiplier,
+                ),
+            )
+        )
+
+    # Accounts would not list positions in any particular order.
+    rng.shuffle(result)
+    return result
+
+
+def _quotes(
+    rng: random.Random, positions: Iterable[Position], prices: Dict[str, Decimal]
+) -> Dict[Instrument, Quote]:
+    quotes: Dict[Instrument, Quote] = {}
+    for p in positions:
+        instrument = p.instrument
+        if instrument in quotes:
+            continue
+
+        if isinstance(instrument, Option):
+            mid = _price(rng, 0.5, 20)
+        else:
+            mid = prices[instrument.symbol]
+
+        spread = Cash.quantize(mid * Decimal("0.001"))
+        quotes[instrument] = Quote(
+            bid=Cash(currency=instrument.currency, quantity=mid - spread),
+            ask=Cash(currency=instrument.currency, quantity=mid + spread),
+            last=Cash(currency=instrument.currency, quantity=mid),
+        )
+
+    # Every pair of currencies, in market convention.
+    for base in Currency:
+        for quote in Currency:
+            if base < quote:
+                rate = _price(rng, 0.5, 2)
+                quotes[Forex(baseCurrency=base, quoteCurrency=quote)] = Quote(
+                    last=Cash(currency=quote, quantity=rate)
+                )
+
+    return quotes
+
+
+# Generates `size` activities and positions (each), over roughly `size / 50`
+# symbols in every currency.
+#
+# The same `size` and `seed` always produce the same data. Results are cached,
+# so that several benchmarks can share them.
+@lru_cache(maxsize=4)
+def generate(size: int, seed: int = 0) -> SyntheticData:
+    rng = random.Random(seed)
+
+    symbols = _symbols(rng, max(10, size // 50))
+    currencies = {s: rng.choice(list(Currency)) for s in symbols}
+    prices = {s: _price(rng, 1, 1000) for s in symbols}
+
+    positions = _positions(rng, size, symbols, currencies, prices)
+    cash = [
+        Cash(currency=rng.choice(list(Currency)), quantity=_price(rng, -1e6, 1e6))
+        for _ in range(size)
+    ]
+
+    return SyntheticData(
+        seed=seed,
+        symbols=symbols,
+        activity=_activity(rng, size, symbols, currencies, prices),
+        positions=positions,
+        quotes=_quotes(rng, positions, prices),
+        cash=cash,
+    )
+
+
+# Generates `size` amounts of cash in a single currency, as from a long history
+# of trades in one account. The same `size` and `seed` always produce the same
+# amounts.
+@lru_cache(maxsize=4)
+def generateCash(size: int, seed: int = 0) -> List[Cash]:
+    rng = random.Random(seed)
+    return [
+        Cash(currency=Currency.USD, quantity=_price(rng, -1e6, 1e6))
+        for _ in range(size)
+    ]
+
+
+# Generates `days` of daily bars for each of `instruments` (as returned by
+# IBDataProvider.fetchHistoricalData()), along with random weights. Some
+# instruments are missing a few days, as with holidays on different exchanges.
+@lru_cache(maxsize=4)
+def generateBars(
+    instruments: int, days: int, seed: int = 0
+) -> Tuple[Dict[str, pd.DataFrame], Dict[str, float]]:
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range("2000-01-03", periods=days)
+
+    bars: Dict[str, pd.DataFrame] = {}
+    for i in range(instruments):
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, days)))
+        opens = close * np.exp(rng.normal(0, 0.005, days))
+        keep = rng.random(days) > 0.01
+        bars[f"S{i:05d}"] = pd.DataFrame(
+            {
+                "date": dates[keep],
+                "open": opens[keep],
+                "high": np.maximum(opens, close)[keep] * 1.01,
+                "low": np.minimum(opens, close)[keep] * 0.99,
+                "close": close[keep],
+                "volume": rng.integers(1000, 10 ** 6, days)[keep].astype(float),
+                "barCount": rng.integers(10, 1000, days)[keep].astype(float),
+                "average": ((opens + close) / 2)[keep],
+            }
+        )
+
+    weights = rng.random(instruments)
+    return (
+        bars,
+        {key: float(w) for key, w in zip(bars.keys(), weights / weights.sum())},
+    )
+
+
+# Returns quotes for any instrument in `quotes` immediately, as a stand-in for
+# a market data connection.
+class FakeDataProvider(MarketDataProvider):
+    def __init__(self, quotes: Dict[Instrument, Quote]):
+        self._quotes = quotes
+        super().__init__()
+
+    def fetchQuotes(
+        self, instruments: Iterable[Instrument]
+    ) -> Iterable[Tuple[Instrument, Quote]]:
+        return ((i, self._quotes[i]) for i in instruments if i in self._quotes)
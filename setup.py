@@ -35,15 +35,18 @@ setup(
         "bankroll_marketdata ~= 0.4.0",
         "bankroll_model ~= 0.4.1",
         "bankroll_broker ~= 0.4.2",
+        "importlib_metadata >= 0.12; python_version < '3.8'",
         "numpy ~= 1.17.0",
         "progress ~= 1.5",
         "pyfolio >= 0.9.2",
     ],
     extras_require={
+        "arrow": ["pyarrow >= 0.17.0"],
         "ibkr": ["bankroll_broker_ibkr ~= 0.4.0"],
         "schwab": ["bankroll_broker_schwab ~= 0.4.0"],
         "fidelity": ["bankroll_broker_fidelity ~= 0.4.0"],
         "vanguard": ["bankroll_broker_vanguard ~= 0.4.0"],
+        "watch": ["inotify_simple >= 1.2; sys_platform == 'linux'"],
     },
     keywords="trading investing finance portfolio",
     entry_points={"console_scripts": ["bankroll = bankroll.interface.__main__:main"]},
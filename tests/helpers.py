@@ -1,15 +1,16 @@
 import os
 from datetime import date, datetime, timedelta
 from decimal import Decimal
-from typing import List, Optional, TypeVar
+from typing import Any, Callable, List, Optional, TypeVar, cast
 
-from hypothesis import settings
+from hypothesis import HealthCheck, settings
 from hypothesis.strategies import (
     SearchStrategy,
     builds,
     dates,
     datetimes,
     decimals,
+    deferred,
     from_regex,
     from_type,
     integers,
@@ -53,6 +54,27 @@ settings.register_profile("dev", max_examples=10, deadline=100)
 settings.load_profile(os.getenv(u"HYPOTHESIS_PROFILE", default="dev"))
 
 T = TypeVar("T")
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+# Using settings() directly as a decorator would make the test untyped under
+# mypy --strict. Hypothesis only permits one settings() per test, so tests
+# needing several overrides should call this directly.
+def withSettings(test: F, **kwargs: Any) -> F:
+    decorator = cast(Callable[[F], F], settings(**kwargs))
+    return decorator(test)
+
+
+# Lifts the deadline for tests which are slow by nature (e.g., because each
+# example builds DataFrames).
+def withoutDeadline(test: F) -> F:
+    return withSettings(test, deadline=None)
+
+
+# Suppresses the too_slow health check for tests whose strategies (e.g., lists
+# of activity) are expectedly slow to generate.
+def allowSlowGeneration(test: F) -> F:
+    return withSettings(test, suppress_health_check=[HealthCheck.too_slow])
 
 
 def optionals(inner: SearchStrategy[T]) -> SearchStrategy[Optional[T]]:
@@ -239,7 +261,8 @@ def trades(
     quantity: SearchStrategy[Decimal] = positionQuantities(),
     amount: SearchStrategy[Cash] = cash(),
     fees: SearchStrategy[Cash] = cash(quantity=cashAmounts(min_value=Decimal("0"))),
-    flags: SearchStrategy[TradeFlags] = from_type(TradeFlags),
+    # Deferred so that the TradeFlags strategy registered below is picked up.
+    flags: SearchStrategy[TradeFlags] = deferred(lambda: from_type(TradeFlags)),
 ) -> SearchStrategy[Trade]:
     return builds(
         Trade,
@@ -0,0 +1,175 @@
+import operator
+import unittest
+from decimal import Decimal
+from functools import reduce
+from itertools import groupby
+from typing import List
+
+from hypothesis import given
+from hypothesis.strategies import from_type, just, lists, sampled_from
+
+from bankroll.analysis.aggregation import (
+    CashSum,
+    sumCash,
+    sumPositions,
+    sumPositionsByInstrument,
+)
+from bankroll.model import Cash, Currency, Position, Stock
+from tests import helpers
+
+
+class TestAggregation(unittest.TestCase):
+    @given(lists(helpers.cash(currency=just(Currency.USD)), min_size=1))
+    def test_sumCashMatchesReduce(self, cash: List[Cash]) -> None:
+        self.assertEqual(sumCash(cash), reduce(operator.add, cash))
+
+    def test_sumCashEmpty(self) -> None:
+        self.assertIsNone(sumCash([]))
+        self.assertIsNone(CashSum().total)
+        self.assertEqual(
+            CashSum(Currency.EUR).total,
+            Cash(currency=Currency.EUR, quantity=Decimal(0)),
+        )
+
+    @given(lists(helpers.cash(), min_size=2))
+    def test_sumCashMixedCurrencies(self, cash: List[Cash]) -> None:
+        try:
+            expected = reduce(operator.add, cash)
+        except ValueError:
+            with self.assertRaises(ValueError):
+                sumCash(cash)
+            return
+
+        self.assertEqual(sumCash(cash), expected)
+
+    @given(
+        lists(helpers.cashAmounts(), min_size=1),
+        lists(
+            helpers.cashAmounts(min_value=Decimal("0.0001"), max_value=Decimal("1000")),
+            min_size=1,
+        ),
+    )
+    def test_addQuantityQuantizesEachTerm(
+        self, amounts: List[Decimal], rates: List[Decimal]
+    ) -> None:
+        total = CashSum(Currency.USD)
+        expected = Cash(currency=Currency.USD, quantity=Decimal(0))
+        for amount, rate in zip(amounts, rates):
+            total.addQuantity(amount * rate)
+            expected += Cash(currency=Currency.USD, quantity=amount * rate)
+
+        self.assertEqual(total.total, expected)
+
+    def test_addQuantityRequiresCurrency(self) -> None:
+        with self.assertRaises(ValueError):
+            CashSum().addQuantity(Decimal(1))
+
+    @given(
+        from_type(Stock).flatmap(
+            lambda stock: lists(
+                helpers.positions(
+                    instrument=just(stock),
+                    costBasis=helpers.cash(currency=just(stock.currency)),
+                ),
+                min_size=1,
+                max_size=10,
+            )
+        )
+    )
+    def test_sumPositionsMatchesReduce(self, positions: List[Position]) -> None:
+        try:
+            expected = reduce(operator.add, positions)
+        except ValueError:
+            with self.assertRaises(ValueError):
+                sumPositions(positions)
+            return
+
+        self.assertEqual(sumPositions(positions), expected)
+
+    def test_sumPositionsRejectsDifferentInstruments(self) -> None:
+        positions = [
+            Position(
+                instrument=Stock(symbol=symbol, currency=Currency.USD),
+                quantity=Decimal(1),
+                costBasis=Cash(currency=Currency.USD, quantity=Decimal(1)),
+            )
+            for symbol in ["SPY", "QQQ"]
+        ]
+
+        with self.assertRaises(ValueError):
+            sumPositions(positions)
+        with self.assertRaises(ValueError):
+            sumPositions([])
+
+    def test_sumPositionsRejectsZeroQuantityWithBasis(self) -> None:
+        stock = Stock(symbol="SPY", currency=Currency.USD)
+        positions = [
+            Position(
+                instrument=stock,
+                quantity=Decimal(quantity),
+                costBasis=Cash(currency=Currency.USD, quantity=Decimal(basis)),
+            )
+            for quantity, basis in [(1, 10), (-1, -5), (1, 10)]
+        ]
+
+        with self.assertRaises(ValueError):
+            reduce(operator.add, positions)
+        with self.assertRaises(ValueError):
+            sumPositions(positions)
+
+    @given(
+        lists(from_type(Stock), min_size=1, max_size=3, unique=True).flatmap(
+            lambda stocks: lists(
+                sampled_from(stocks).flatmap(
+                    lambda stock: helpers.positions(
+                        instrument=just(stock),
+                        costBasis=helpers.cash(currency=just(stock.currency)),
+                    )
+                ),
+                max_size=20,
+            )
+        )
+    )
+    def test_sumPositionsByInstrumentMatchesGroupedSums(
+        self, positions: List[Position]
+    ) -> None:
+        key = operator.attrgetter("instrument")
+        try:
+            expected = {
+                i: sumPositions(ps)
+                for i, ps in groupby(sorted(positions, key=key), key=key)
+            }
+        except ValueError:
+            with self.assertRaises(ValueError):
+                sumPositionsByInstrument(iter(positions))
+            return
+
+        result = sumPositionsByInstrument(p for p in positions)
+        self.assertEqual({p.instrument: p for p in result}, expected)
+        self.assertEqual(
+            [p.instrument for p in result], list(dict.fromkeys(map(key, positions)))
+        )
+
+    def test_sumPositionsByInstrumentRejectsZeroQuantityWithBasis(self) -> None:
+        spy = Stock(symbol="SPY", currency=Currency.USD)
+        qqq = Stock(symbol="QQQ", currency=Currency.USD)
+        positions = [
+            Position(
+                instrument=stock,
+                quantity=Decimal(quantity),
+                costBasis=Cash(currency=Currency.USD, quantity=Decimal(basis)),
+            )
+            for stock, quantity, basis in [
+                (spy, 1, 10),
+                (qqq, 1, 10),
+                (spy, -1, -5),
+                (spy, 1, 10),
+            ]
+        ]
+
+        with self.assertRaises(ValueError):
+            sumPositionsByInstrument(positions)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,14 @@
+import asyncio
+import math
+import threading
+import time
 import unittest
+import warnings
 from datetime import date, datetime
 from decimal import Decimal
 from itertools import chain
-from typing import Any, Dict, Iterable, List, Tuple, no_type_check
+from types import SimpleNamespace
+from typing import Any, Dict, Iterable, List, Sequence, Set, Tuple, no_type_check
 
 from bankroll.model import (
     Activity,
@@ -21,15 +27,25 @@ from bankroll.model import (
     TradeFlags,
 )
 from bankroll.analysis import (
+    ActivityIndex,
+    AsyncMarketDataProvider,
+    IBMarketDataProvider,
     TimelineEntry,
+    activityAffectsSymbol,
+    compactTimelineForSymbol,
+    compactTimelinesForAllSymbols,
     convertCashToCurrency,
     currencyConversionRates,
+    currencyConversionRatesAsync,
     deduplicatePositions,
+    fetchQuotesAsync,
     liveValuesForPositions,
+    liveValuesForPositionsAsync,
     normalizeInstrument,
     normalizeSymbol,
     realizedBasisForSymbol,
     timelineForSymbol,
+    timelinesForAllSymbols,
 )
 from bankroll.marketdata import MarketDataProvider
 from hypothesis import HealthCheck, given, reproduce_failure, seed, settings
@@ -86,6 +102,12 @@ def tradesForAmounts(
     )
 
 
+def tradeListForSymbol(symbol: str) -> SearchStrategy[List[Trade]]:
+    return lists(helpers.cashAmounts(), max_size=5).flatmap(
+        lambda ds: tradesForAmounts(amounts=ds, symbol=symbol).map(list)
+    )
+
+
 @no_type_check
 def positionAndQuote(
     instrument: SearchStrategy[Instrument] = helpers.instruments()
@@ -111,6 +133,114 @@ class StubDataProvider(MarketDataProvider):
         return ((i, self._quotes[i]) for i in instruments)
 
 
+# Blocks when asked for quotes of any instrument in `blockedInstruments`, until
+# `released` is set.
+class BlockingDataProvider(StubDataProvider):
+    def __init__(
+        self, quotes: Dict[Instrument, Quote], blockedInstruments: Set[Instrument]
+    ):
+        self._blockedInstruments = blockedInstruments
+        self.released = threading.Event()
+        super().__init__(quotes)
+
+    def fetchQuotes(
+        self, instruments: Iterable[Instrument]
+    ) -> Iterable[Tuple[Instrument, Quote]]:
+        requested = list(instruments)
+        if self._blockedInstruments.intersection(requested):
+            self.released.wait()
+
+        return super().fetchQuotes(requested)
+
+
+# Takes `delay` seconds to return quotes for each request.
+class SlowDataProvider(StubDataProvider):
+    def __init__(self, quotes: Dict[Instrument, Quote], delay: float):
+        self._delay = delay
+        super().__init__(quotes)
+
+    def fetchQuotes(
+        self, instruments: Iterable[Instrument]
+    ) -> Iterable[Tuple[Instrument, Quote]]:
+        time.sleep(self._delay)
+        return super().fetchQuotes(instruments)
+
+
+# Implements just enough of ib_insync's asynchronous API for IBMarketDataProvider.
+# Its synchronous API is deliberately missing.
+class StubIBClient:
+    def __init__(self, bid: float):
+        self._bid = bid
+        self.requests = 0
+        super().__init__()
+
+    def reqMarketDataType(self, marketDataType: int) -> None:
+        pass
+
+    async def qualifyContractsAsync(self, *contracts: Any) -> List[Any]:
+        return list(contracts)
+
+    async def reqTickersAsync(self, *contracts: Any) -> List[Any]:
+        self.requests += 1
+        await asyncio.sleep(0)
+        return [
+            SimpleNamespace(
+                contract=c,
+                bid=self._bid,
+                bidSize=1,
+                ask=math.nan,
+                askSize=0,
+                last=math.nan,
+                lastSize=0,
+                close=math.nan,
+            )
+            for c in contracts
+        ]
+
+
+# Adds the synchronous API which the plugin's IBDataProvider uses.
+class StubSyncIBClient(StubIBClient):
+    def qualifyContracts(self, *contracts: Any) -> List[Any]:
+        return asyncio.run(self.qualifyContractsAsync(*contracts))
+
+    def reqTickers(self, *contracts: Any) -> List[Any]:
+        return asyncio.run(self.reqTickersAsync(*contracts))
+
+
+class StubAsyncDataProvider(AsyncMarketDataProvider):
+    def __init__(
+        self, quotes: Dict[Instrument, Quote], slowInstruments: Set[Instrument] = set()
+    ):
+        self._quotes = quotes
+        self._slowInstruments = slowInstruments
+        self.concurrentRequests = 0
+        self.maxConcurrentRequests = 0
+        super().__init__()
+
+    def fetchQuotes(
+        self, instruments: Iterable[Instrument]
+    ) -> Iterable[Tuple[Instrument, Quote]]:
+        return ((i, self._quotes[i]) for i in instruments)
+
+    async def fetchQuotesAsync(
+        self, instruments: Sequence[Instrument]
+    ) -> Iterable[Tuple[Instrument, Quote]]:
+        self.concurrentRequests += 1
+        self.maxConcurrentRequests = max(
+            self.maxConcurrentRequests, self.concurrentRequests
+        )
+
+        try:
+            if self._slowInstruments.intersection(instruments):
+                await asyncio.sleep(10)
+            else:
+                await asyncio.sleep(0)
+
+            return list(self.fetchQuotes(instruments))
+        finally:
+            self.concurrentRequests -= 1
+
+
 class TestAnalysis(unittest.TestCase):
     def test_realizedBasis(self) -> None:
         trades = [
@@ -303,6 +433,55 @@ class TestAnalysis(unittest.TestCase):
         if realizedBasis:
             self.assertEqual(realizedBasis.quantity, -summed)
 
+    @given(
+        lists(helpers.cashAmounts(), min_size=1, max_size=20).flatmap(
+            lambda ds: tradesForAmounts(amounts=ds, symbol="BRK.B")
+        ),
+        lists(
+            helpers.trades(
+                instrument=helpers.instruments(currency=just(Currency.USD)),
+                amount=helpers.cash(currency=just(Currency.USD)),
+                fees=helpers.cash(
+                    currency=just(Currency.USD),
+                    quantity=helpers.cashAmounts(min_value=Decimal("0")),
+                ),
+            ),
+            max_size=10,
+        ),
+    )
+    @helpers.allowSlowGeneration
+    def test_realizedBasisFromIndexMatchesIterable(
+        self, trades: Iterable[Trade], otherTrades: List[Trade]
+    ) -> None:
+        activity: List[Activity] = list(chain(trades, otherTrades))
+        index = ActivityIndex(activity)
+
+        self.assertEqual(
+            realizedBasisForSymbol("BRK B", index),
+            realizedBasisForSymbol("BRK B", activity),
+        )
+
+        allBases = index.realizedBasisForAllSymbols()
+        self.assertEqual(allBases["BRKB"], realizedBasisForSymbol("BRKB", activity))
+        for symbol in index.symbols:
+            self.assertEqual(
+                allBases.get(symbol), realizedBasisForSymbol(symbol, activity)
+            )
+
+    @given(lists(from_type(Activity), max_size=20))
+    def test_activityIndexSortsEachSymbolByDate(self, activity: List[Activity]) -> None:
+        index = ActivityIndex(activity)
+
+        for symbol in index.symbols:
+            bucket = index.activityForSymbol(symbol)
+            self.assertEqual(
+                list(bucket),
+                sorted(
+                    (t for t in activity if activityAffectsSymbol(t, symbol)),
+                    key=lambda t: t.date,
+                ),
+            )
+
     # Filter for positions and quotes where the instruments are all unique.
     @given(
         lists(positionAndQuote(), min_size=1, max_size=3).filter(
@@ -341,19 +520,242 @@ class TestAnalysis(unittest.TestCase):
             if highest is not None:
                 self.assertLessEqual(value, highest)
 
+    @given(
+        lists(positionAndQuote(), min_size=1, max_size=5).filter(
+            lambda l: len({p.instrument for p, q in l}) == len(l)
+        ),
+        sampled_from([1, 2, 50]),
+    )
+    # Each example spins up an event loop.
+    @helpers.withoutDeadline
+    def test_liveValuesForPositionsAsyncMatchesSync(
+        self, i: List[Tuple[Position, Quote]], batchSize: int
+    ) -> None:
+        quotesByInstrument = {p.instrument: q for (p, q) in i}
+        positions = [p for (p, _) in i]
+
+        expected = liveValuesForPositions(
+            positions, StubDataProvider(quotesByInstrument)
+        )
+
+        # Providers without async support are used on a background thread.
+        self.assertEqual(
+            asyncio.run(
+                liveValuesForPositionsAsync(
+                    positions, StubDataProvider(quotesByInstrument), batchSize=batchSize
+                )
+            ),
+            expected,
+        )
+
+        asyncProvider = StubAsyncDataProvider(quotesByInstrument)
+        self.assertEqual(
+            asyncio.run(
+                liveValuesForPositionsAsync(
+                    positions, asyncProvider, batchSize=batchSize
+                )
+            ),
+            expected,
+        )
+
+        batches = (len(positions) + batchSize - 1) // batchSize
+        self.assertEqual(asyncProvider.maxConcurrentRequests, batches)
+
+    def test_liveValuesForPositionsAsyncReturnsPartialResultsOnTimeout(self) -> None:
+        spy = Stock("SPY", Currency.USD)
+        vt = Stock("VT", Currency.USD)
+        quote = Quote(bid=helpers.cashUSD(Decimal("10")))
+        positions = [
+            Position(
+                instrument=spy,
+                quantity=Decimal(1),
+                costBasis=helpers.cashUSD(Decimal(1)),
+            ),
+            Position(
+                instrument=vt,
+                quantity=Decimal(2),
+                costBasis=helpers.cashUSD(Decimal(1)),
+            ),
+        ]
+
+        dataProvider = StubAsyncDataProvider(
+            {spy: quote, vt: quote}, slowInstruments={vt}
+        )
+
+        with self.assertWarns(RuntimeWarning):
+            values = asyncio.run(
+                liveValuesForPositionsAsync(
+                    positions, dataProvider, batchSize=1, timeout=0.1
+                )
+            )
+
+        self.assertEqual(values, {positions[0]: helpers.cashUSD(Decimal("10"))})
+
+    def test_liveValuesForPositionsAsyncTimesOutSyncProviders(self) -> None:
+        spy = Stock("SPY", Currency.USD)
+        vt = Stock("VT", Currency.USD)
+        quote = Quote(bid=helpers.cashUSD(Decimal("10")))
+        positions = [
+            Position(
+                instrument=i, quantity=Decimal(1), costBasis=helpers.cashUSD(Decimal(1))
+            )
+            for i in [spy, vt]
+        ]
+
+        dataProvider = BlockingDataProvider(
+            {spy: quote, vt: quote}, blockedInstruments={vt}
+        )
+
+        # The provider is called off the event loop, so the timeout can fire
+        # while it is blocked.
+        try:
+            with self.assertWarns(RuntimeWarning):
+                values = asyncio.run(
+                    liveValuesForPositionsAsync(
+                        positions, dataProvider, batchSize=1, timeout=0.1
+                    )
+                )
+        finally:
+            dataProvider.released.set()
+
+        self.assertEqual(values, {positions[0]: helpers.cashUSD(Decimal("10"))})
+
+    def test_liveValuesForPositionsAsyncTimesSyncBatchesFromWhenTheyStart(self) -> None:
+        quote = Quote(bid=helpers.cashUSD(Decimal("10")))
+        positions = [
+            Position(
+                instrument=Stock(f"S{i}", Currency.USD),
+                quantity=Decimal(1),
+                costBasis=helpers.cashUSD(Decimal(1)),
+            )
+            for i in range(8)
+        ]
+
+        # Each batch finishes well within the timeout, but all of them together
+        # would not.
+        dataProvider = SlowDataProvider(
+            {p.instrument: quote for p in positions}, delay=0.05
+        )
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", RuntimeWarning)
+            values = asyncio.run(
+                liveValuesForPositionsAsync(
+                    positions, dataProvider, batchSize=1, timeout=0.2
+                )
+            )
+
+        self.assertEqual(values, {p: helpers.cashUSD(Decimal("10")) for p in positions})
+
+    def test_liveValuesForPositionsAsyncTimesSyncBatchesAfterTimedOutOnes(self) -> None:
+        quote = Quote(bid=helpers.cashUSD(Decimal("10")))
+        positions = [
+            Position(
+                instrument=Stock(symbol, Currency.USD),
+                quantity=Decimal(1),
+                costBasis=helpers.cashUSD(Decimal(1)),
+            )
+            for symbol in ["SLOW", "FAST"]
+        ]
+
+        # The first batch times out, but keeps the provider busy for longer
+        # than the second batch's timeout.
+        dataProvider = BlockingDataProvider(
+            {p.instrument: quote for p in positions}, {positions[0].instrument}
+        )
+        release = threading.Timer(0.5, dataProvider.released.set)
+        release.start()
+
+        try:
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter("always")
+                values = asyncio.run(
+                    liveValuesForPositionsAsync(
+                        positions, dataProvider, batchSize=1, timeout=0.2
+                    )
+                )
+        finally:
+            release.cancel()
+            dataProvider.released.set()
+
+        self.assertEqual(values, {positions[1]: helpers.cashUSD(Decimal("10"))})
+        self.assertEqual(
+            [w.category for w in caught if issubclass(w.category, RuntimeWarning)],
+            [RuntimeWarning],
+        )
+
+    def test_liveValuesForPositionsAsyncUsesIBAsyncAPI(self) -> None:
+        spy = Stock("SPY", Currency.USD)
+        vod = Stock("VOD", Currency.GBP)
+        positions = [
+            Position(
+                instrument=i,
+                quantity=Decimal(1),
+                costBasis=Cash(currency=i.currency, quantity=Decimal(1)),
+            )
+            for i in [spy, vod]
+        ]
+
+        client = StubIBClient(bid=250.0)
+        dataProvider = IBMarketDataProvider(client)
+        values = asyncio.run(
+            liveValuesForPositionsAsync(positions, dataProvider, batchSize=1)
+        )
+
+        self.assertEqual(client.requests, 2)
+        self.assertEqual(
+            values,
+            {
+                positions[0]: helpers.cashUSD(Decimal("250")),
+                # Quoted in GBX.
+                positions[1]: Cash(currency=Currency.GBP, quantity=Decimal("2.5")),
+            },
+        )
+
+    def test_ibMarketDataProviderFetchesSyncQuotesFromPlugin(self) -> None:
+        instruments = [Stock("SPY", Currency.USD), Stock("VOD", Currency.GBP)]
+        client = StubSyncIBClient(bid=250.0)
+        dataProvider = IBMarketDataProvider(client)
+
+        quotes = dict(dataProvider.fetchQuotes(instruments))
+        self.assertEqual(
+            quotes, dict(asyncio.run(fetchQuotesAsync(dataProvider, instruments)))
+        )
+        self.assertEqual(quotes[instruments[0]].bid, helpers.cashUSD(Decimal("250")))
+
     @given(
         lists(from_type(Position), max_size=5), lists(from_type(Position), max_size=5)
     )
     def test_deduplicatePositions(self, a: List[Position], b: List[Position]) -> None:
-        c = chain(a, b)
+        c = list(chain(a, b))
         instruments = (p.instrument for p in c)
-        result = deduplicatePositions(c)
+        result = list(deduplicatePositions(c))
 
         for i in instruments:
-            posA = next((p.quantity for p in a if p.instrument == i), Decimal(0))
-            posB = next((p.quantity for p in b if p.instrument == i), Decimal(0))
+            # Either list may hold the same instrument more than once.
+            quantity = sum((p.quantity for p in c if p.instrument == i), Decimal(0))
             posC = next((p.quantity for p in result if p.instrument == i))
-            self.assertEqual(posC, Position.quantizeQuantity(posA + posB))
+            self.assertEqual(posC, Position.quantizeQuantity(quantity))
+
+    def test_deduplicatePositionsOrder(self) -> None:
+        spy = Stock(symbol="SPY", currency=Currency.USD)
+        aapl = Stock(symbol="AAPL", currency=Currency.USD)
+        positions = (
+            Position(
+                instrument=stock,
+                quantity=Decimal(1),
+                costBasis=helpers.cashUSD(Decimal(10)),
+            )
+            for stock in [spy, aapl, spy]
+        )
+
+        result = deduplicatePositions(positions, sortByInstrument=False)
+        self.assertEqual([p.instrument for p in result], [spy, aapl])
+        self.assertEqual(result[0].quantity, Decimal(2))
+        self.assertEqual(result[0].costBasis, helpers.cashUSD(Decimal(20)))
+
+        result = deduplicatePositions(reversed(result))
+        self.assertEqual([p.instrument for p in result], [aapl, spy])
 
     forexQuotes: Dict[Instrument, Quote] = {
         # EURGBP
@@ -410,6 +812,28 @@ class TestAnalysis(unittest.TestCase):
         )
         self.assertNotIn(Currency.USD, rates)
 
+    def test_currencyConversionRatesAsyncMatchesSync(self) -> None:
+        async def collect() -> Dict[Currency, Cash]:
+            return {
+                currency: rate
+                async for (currency, rate) in currencyConversionRatesAsync(
+                    quoteCurrency=Currency.USD,
+                    otherCurrencies=[Currency.GBP, Currency.JPY],
+                    dataProvider=StubAsyncDataProvider(self.forexQuotes),
+                    batchSize=1,
+                )
+            }
+
+        expected = dict(
+            currencyConversionRates(
+                quoteCurrency=Currency.USD,
+                otherCurrencies=[Currency.GBP, Currency.JPY],
+                dataProvider=StubDataProvider(self.forexQuotes),
+            )
+        )
+
+        self.assertEqual(asyncio.run(collect()), expected)
+
     def test_convertCash(self) -> None:
         dataProvider = StubDataProvider(self.forexQuotes)
         cash = convertCashToCurrency(
@@ -470,6 +894,10 @@ class TestAnalysis(unittest.TestCase):
         ]
 
         timeline = list(timelineForSymbol("BRKB", activity))
+        self.assertEqual(
+            list(timelineForSymbol("BRK.B", ActivityIndex(activity))), timeline
+        )
+
         stock = Stock(symbol="BRKB", currency=Currency.USD)
 
         self.assertEquals(
@@ -497,3 +925,60 @@ class TestAnalysis(unittest.TestCase):
                 ),
             ],
         )
+
+    @given(
+        lists(helpers.cashAmounts(), min_size=1, max_size=20).flatmap(
+            lambda ds: tradesForAmounts(amounts=ds, symbol="SPY")
+        ),
+        sampled_from([1, 3, 256]),
+    )
+    def test_compactTimelineMatchesTimeline(
+        self, trades: Iterable[Trade], checkpointInterval: int
+    ) -> None:
+        activity = sorted(trades, key=lambda t: t.date)
+        timeline = list(timelineForSymbol("SPY", activity))
+
+        self.assertEqual(
+            list(timelineForSymbol("SPY", activity, presorted=True)), timeline
+        )
+
+        compact = compactTimelineForSymbol(
+            "SPY", activity, presorted=True, checkpointInterval=checkpointInterval
+        )
+        self.assertEqual(len(compact), len(timeline))
+        self.assertEqual(list(compact), timeline)
+        self.assertEqual(compact[-1], timeline[-1])
+        self.assertEqual(compact[1:3], timeline[1:3])
+
+        for i, entry in enumerate(timeline):
+            self.assertEqual(compact[i], entry)
+            self.assertEqual(compact.positionsAt(i), entry.positions)
+
+    @given(
+        tuples(
+            tradeListForSymbol("SPY"),
+            tradeListForSymbol("BRK.B"),
+            tradeListForSymbol("VT"),
+        )
+    )
+    def test_timelinesForAllSymbols(self, tradeLists: Tuple[List[Trade], ...]) -> None:
+        activity = list(chain.from_iterable(tradeLists))
+        timelines = {
+            symbol: list(timeline)
+            for symbol, timeline in timelinesForAllSymbols(activity)
+        }
+
+        for t in activity:
+            if isinstance(t.instrument, Option):
+                self.assertIn(normalizeSymbol(t.instrument.underlying), timelines)
+                self.assertNotIn(normalizeSymbol(t.instrument.symbol), timelines)
+            else:
+                self.assertIn(normalizeSymbol(t.instrument.symbol), timelines)
+
+        for symbol, timeline in timelines.items():
+            self.assertEqual(timeline, list(timelineForSymbol(symbol, activity)))
+
+        compactTimelines = dict(compactTimelinesForAllSymbols(activity))
+        self.assertEqual(compactTimelines.keys(), timelines.keys())
+        for symbol, compact in compactTimelines.items():
+            self.assertEqual(list(compact), timelines[symbol])
@@ -0,0 +1,92 @@
+import unittest
+from typing import Any, Dict
+
+from benchmarks.__main__ import compareMedians, compareResults, runBenchmarks
+from benchmarks.suite import benchmarks
+from benchmarks.synthetic import SyntheticData, generate, generateBars
+
+import bankroll.analysis as analysis
+from bankroll.model import Option, Trade
+
+
+class TestSyntheticData(unittest.TestCase):
+    def testSameSeedSameData(self) -> None:
+        # Bypass the cache, to generate each anew.
+        a: SyntheticData = generate.__wrapped__(200, seed=1)
+        b: SyntheticData = generate.__wrapped__(200, seed=1)
+        self.assertEqual(a, b)
+
+        c: SyntheticData = generate.__wrapped__(200, seed=2)
+        self.assertNotEqual(a.activity, c.activity)
+
+    def testSizes(self) -> None:
+        data = generate(500)
+        self.assertEqual(len(data.activity), 500)
+        self.assertEqual(len(data.positions), 500)
+        self.assertEqual(len(data.cash), 500)
+
+        # Most instruments are held in more than one account.
+        deduplicated = list(analysis.deduplicatePositions(data.positions))
+        self.assertLess(len(deduplicated), len(data.positions))
+
+        self.assertTrue(
+            any(
+                isinstance(a, Trade) and isinstance(a.instrument, Option)
+                for a in data.activity
+            )
+        )
+        self.assertGreater(len({p.instrument.currency for p in data.positions}), 1)
+
+    def testEveryPositionQuoted(self) -> None:
+        data = generate(500)
+        for p in data.positions:
+            self.assertIn(p.instrument, data.quotes)
+
+    def testBars(self) -> None:
+        bars, weights = generateBars(instruments=3, days=20, seed=1)
+        self.assertEqual(list(bars.keys()), list(weights.keys()))
+        self.assertAlmostEqual(sum(weights.values()), 1.0)
+
+        panel = analysis.bars_to_panel(bars, weights)
+        self.assertGreater(len(panel), 0)
+
+
+class TestBenchmarks(unittest.TestCase):
+    def testEverySetupRuns(self) -> None:
+        for name, setup in benchmarks.items():
+            with self.subTest(name=name):
+                setup(100, 0)()
+
+    def testResults(self) -> None:
+        results = runBenchmarks(
+            ["realizedBasisForSymbol"], sizes=[100], seed=0, repeat=2
+        )
+        self.assertEqual(len(results["results"]), 1)
+
+        result = results["results"][0]
+        self.assertEqual(result["name"], "realizedBasisForSymbol")
+        self.assertEqual(result["size"], 100)
+        self.assertEqual(len(result["times"]), 2)
+        self.assertLessEqual(result["min"], result["median"])
+
+    def testCompareResults(self) -> None:
+        def results(median: float) -> Dict[str, Any]:
+            return {"results": [{"name": "etf", "size": 100, "median": median}]}
+
+        self.assertEqual(compareResults(results(1.2), results(1.0), 1.25), [])
+        self.assertEqual(
+            compareResults(results(1.5), results(1.0), 1.25), [("etf", 100, 1.5)]
+        )
+
+        # Benchmarks missing from the baseline are not compared.
+        self.assertEqual(
+            compareResults(results(1.5), {"results": []}, threshold=1.25), []
+        )
+
+        self.assertEqual(
+            compareMedians(results(1.5), results(1.0)), [("etf", 100, 1.5)]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+from hypothesis import given
+from hypothesis.strategies import sampled_from
+
+import bankroll.brokers.fidelity as fidelity
+from bankroll.broker.configuration import Configuration
+from bankroll.interface import (
+    BrokerPlugin,
+    builtinBrokers,
+    discoverBrokers,
+    loadBrokers,
+)
+from bankroll.interface.configuration import configuredSections
+
+
+class TestBrokers(unittest.TestCase):
+    def testBuiltinBrokersDiscovered(self) -> None:
+        names = [plugin.name for plugin in discoverBrokers()]
+        for name in builtinBrokers.keys():
+            self.assertIn(name, names)
+
+        self.assertEqual(len(names), len(set(names)))
+
+    @given(sampled_from(list(builtinBrokers.keys())))
+    def testConfiguredByFlag(self, name: str) -> None:
+        plugin = BrokerPlugin(name=name, module=builtinBrokers[name])
+        self.assertTrue(plugin.isConfigured(set(), [f"--{name}-foo", "bar"]))
+        self.assertTrue(plugin.isConfigured(set(), [f"--{name.upper()}-foo=bar"]))
+        self.assertFalse(plugin.isConfigured(set(), ["--lenient", name, "balances"]))
+
+    def testConfiguredBySection(self) -> None:
+        config = Configuration(
+            searchPaths=[],
+            defaultConfig="\n".join(
+                [
+                    "[Fidelity]",
+                    "Positions = positions.csv",
+                    "Transactions =",
+                    "[IBKR]",
+                    "Trades =",
+                    "#Activity = activity.xml",
+                    "[Schwab]",
+                ]
+            ),
+        )
+
+        sections = configuredSections(config)
+        self.assertEqual(sections, {"fidelity"})
+
+        configured = [p.name for p in discoverBrokers() if p.isConfigured(sections, [])]
+        self.assertEqual(configured, ["fidelity"])
+
+    def testLoadBrokers(self) -> None:
+        missing = BrokerPlugin(name="missing", module="bankroll.brokers.missing")
+        plugin = BrokerPlugin(name="fidelity", module=builtinBrokers["fidelity"])
+
+        loaded = loadBrokers([missing, plugin])
+        self.assertEqual(list(loaded.keys()), [plugin])
+        self.assertIs(loaded[plugin], fidelity)
+
+
+if __name__ == "__main__":
+    unittest.main()
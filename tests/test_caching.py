@@ -0,0 +1,205 @@
+import asyncio
+import threading
+import time
+import unittest
+from datetime import date
+from decimal import Decimal
+from typing import Any, Iterable, List, Optional, Sequence, Tuple
+
+import pandas as pd  # type: ignore
+
+from bankroll.analysis import (
+    AsyncMarketDataProvider,
+    CachingMarketDataProvider,
+    IBMarketDataProvider,
+    fetchQuotesAsync,
+    streamQuotes,
+)
+from bankroll.analysis.ibkr import ibClient
+from bankroll.marketdata import MarketDataProvider
+from bankroll.model import Currency, Forex, Instrument, Option, OptionType, Quote, Stock
+from tests import helpers
+
+
+class CountingDataProvider(MarketDataProvider):
+    def __init__(self) -> None:
+        self.requests: List[List[Instrument]] = []
+        super().__init__()
+
+    def fetchQuotes(
+        self, instruments: Iterable[Instrument]
+    ) -> Iterable[Tuple[Instrument, Quote]]:
+        requested = list(instruments)
+        self.requests.append(requested)
+        return (
+            (i, Quote(last=helpers.cashUSD(Decimal(len(self.requests)))))
+            for i in requested
+        )
+
+
+class HistoricalDataProvider(CountingDataProvider):
+    def __init__(self) -> None:
+        self.starts: List[Optional[date]] = []
+        super().__init__()
+
+    def fetchHistoricalData(
+        self, instrument: Instrument, start: Optional[date] = None
+    ) -> pd.DataFrame:
+        self.starts.append(start)
+        return pd.DataFrame({"date": [start]})
+
+
+class AsyncCountingDataProvider(CountingDataProvider, AsyncMarketDataProvider):
+    async def fetchQuotesAsync(
+        self, instruments: Sequence[Instrument]
+    ) -> Iterable[Tuple[Instrument, Quote]]:
+        return self.fetchQuotes(instruments)
+
+
+# Records how many threads call into it at once.
+class NonThreadSafeDataProvider(CountingDataProvider):
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.active = 0
+        self.mostActive = 0
+        super().__init__()
+
+    def fetchQuotes(
+        self, instruments: Iterable[Instrument]
+    ) -> Iterable[Tuple[Instrument, Quote]]:
+        with self.lock:
+            self.active += 1
+            self.mostActive = max(self.mostActive, self.active)
+
+        time.sleep(0.01)
+        quotes = list(super().fetchQuotes(instruments))
+
+        with self.lock:
+            self.active -= 1
+
+        return quotes
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestCachingMarketDataProvider(unittest.TestCase):
+    spy = Stock("SPY", Currency.USD)
+    vt = Stock("VT", Currency.USD)
+    option = Option(
+        underlying="SPY",
+        currency=Currency.USD,
+        optionType=OptionType.PUT,
+        expiration=date(2020, 1, 17),
+        strike=Decimal("300"),
+    )
+
+    def setUp(self) -> None:
+        self.provider = CountingDataProvider()
+        self.clock = FakeClock()
+
+    def test_reusesQuotesUntilExpiry(self) -> None:
+        cache = CachingMarketDataProvider(self.provider, ttl=10, clock=self.clock)
+
+        first = dict(cache.fetchQuotes([self.spy, self.vt]))
+        self.clock.now = 9
+        second = dict(cache.fetchQuotes([self.vt, self.spy]))
+
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.provider.requests), 1)
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+        self.clock.now = 10
+        third = dict(cache.fetchQuotes([self.spy]))
+        self.assertNotEqual(third[self.spy], first[self.spy])
+        self.assertEqual(self.provider.requests[-1], [self.spy])
+        self.assertEqual((cache.hits, cache.misses), (2, 3))
+
+    def test_onlyFetchesMissingInstruments(self) -> None:
+        cache = CachingMarketDataProvider(self.provider, clock=self.clock)
+
+        cache.fetchQuotes([self.spy])
+        quotes = dict(cache.fetchQuotes([self.spy, self.vt, self.vt]))
+
+        self.assertEqual(set(quotes.keys()), {self.spy, self.vt})
+        self.assertEqual(self.provider.requests, [[self.spy], [self.vt]])
+
+    def test_ttlByInstrumentType(self) -> None:
+        cache = CachingMarketDataProvider(
+            self.provider, ttl=60, ttlByType={Option: 0}, clock=self.clock
+        )
+
+        cache.fetchQuotes([self.spy, self.option])
+        cache.fetchQuotes([self.spy, self.option])
+
+        self.assertEqual(self.provider.requests[-1], [self.option])
+        self.assertEqual(cache.ttlForInstrument(self.spy), 60)
+        self.assertEqual(cache.ttlForInstrument(self.option), 0)
+
+    def test_evictsLeastRecentlyUsed(self) -> None:
+        cache = CachingMarketDataProvider(self.provider, maxSize=2, clock=self.clock)
+        gbpusd = Forex(baseCurrency=Currency.GBP, quoteCurrency=Currency.USD)
+
+        cache.fetchQuotes([self.spy, self.vt])
+        cache.fetchQuotes([self.spy])
+        cache.fetchQuotes([gbpusd])
+        self.assertEqual(cache.evictions, 1)
+
+        cache.fetchQuotes([self.spy, self.vt])
+        self.assertEqual(self.provider.requests[-1], [self.vt])
+
+    def test_cachedQuotesAreSharedAcrossSyncAndAsync(self) -> None:
+        cache = CachingMarketDataProvider(self.provider, clock=self.clock)
+
+        expected = dict(cache.fetchQuotes([self.spy]))
+        quotes = dict(asyncio.run(fetchQuotesAsync(cache, [self.spy, self.vt])))
+
+        self.assertEqual(quotes[self.spy], expected[self.spy])
+        self.assertEqual(self.provider.requests, [[self.spy], [self.vt]])
+
+    def test_onlyAsyncAroundAsyncProviders(self) -> None:
+        cache = CachingMarketDataProvider(self.provider, clock=self.clock)
+        self.assertNotIsInstance(cache, AsyncMarketDataProvider)
+
+        provider = AsyncCountingDataProvider()
+        cache = CachingMarketDataProvider(provider, clock=self.clock)
+        self.assertIsInstance(cache, AsyncMarketDataProvider)
+
+        quotes = dict(asyncio.run(fetchQuotesAsync(cache, [self.spy])))
+        self.assertEqual(dict(cache.fetchQuotes([self.spy])), quotes)
+        self.assertEqual(provider.requests, [[self.spy]])
+
+    def test_streamQuotesCallsSyncProviderOneBatchAtATime(self) -> None:
+        provider = NonThreadSafeDataProvider()
+        cache = CachingMarketDataProvider(provider, clock=self.clock)
+        instruments = [Stock(symbol, Currency.USD) for symbol in "ABCDEF"]
+
+        async def stream() -> List[Instrument]:
+            return [i async for i, _ in streamQuotes(instruments, cache, batchSize=1)]
+
+        self.assertCountEqual(asyncio.run(stream()), instruments)
+        self.assertEqual(provider.mostActive, 1)
+        self.assertEqual(len(provider.requests), len(instruments))
+
+    def test_forwardsHistoricalData(self) -> None:
+        provider = HistoricalDataProvider()
+        cache = CachingMarketDataProvider(provider, clock=self.clock)
+
+        bars = cache.fetchHistoricalData(self.spy, start=date(2019, 6, 3))
+        assert bars is not None
+        self.assertEqual(list(bars["date"]), [date(2019, 6, 3)])
+        self.assertEqual(provider.starts, [date(2019, 6, 3)])
+
+    def test_unwrapsIBClient(self) -> None:
+        client = object()
+        cache = CachingMarketDataProvider(IBMarketDataProvider(client))
+
+        self.assertIsInstance(cache.underlying, IBMarketDataProvider)
+        self.assertIsInstance(cache, AsyncMarketDataProvider)
+        self.assertIs(ibClient(cache), client)
+        self.assertIsNone(ibClient(self.provider))
@@ -0,0 +1,171 @@
+import tempfile
+import unittest
+from datetime import datetime
+from decimal import Decimal
+from typing import List
+
+from hypothesis import given
+from hypothesis.strategies import (
+    SearchStrategy,
+    integers,
+    just,
+    lists,
+    one_of,
+    sampled_from,
+)
+
+from bankroll.analysis import (
+    ActivityIndex,
+    BackdatedActivityError,
+    CheckpointStore,
+    SymbolCheckpoint,
+    realizedBasisForSymbol,
+    timelineForSymbol,
+    updateCheckpoint,
+)
+from bankroll.model import Activity, Currency, Stock, Trade, TradeFlags
+from tests import helpers
+
+
+# Activity on a few symbols, all in one currency, so that it can be summed.
+def uniformActivity(currency: Currency = Currency.USD) -> SearchStrategy[Activity]:
+    symbols = sampled_from(["SPY", "BRK.B", "BRK B"])
+    cash = helpers.cash(currency=just(currency))
+    return one_of(
+        helpers.trades(
+            instrument=one_of(
+                helpers.stocks(symbol=symbols, currency=just(currency)),
+                helpers.options(underlying=symbols, currency=just(currency)),
+            ),
+            amount=cash,
+            fees=helpers.cash(
+                currency=just(currency),
+                quantity=helpers.cashAmounts(min_value=Decimal("0")),
+            ),
+        ),
+        helpers.dividendPayments(
+            stock=helpers.stocks(symbol=symbols, currency=just(currency)), proceeds=cash
+        ),
+    )
+
+
+class TestSymbolCheckpoint(unittest.TestCase):
+    @given(lists(uniformActivity(), max_size=30))
+    def test_buildMatchesFullFold(self, activity: List[Activity]) -> None:
+        for symbol in ["SPY", "BRK.B"]:
+            checkpoint = SymbolCheckpoint.build(symbol, activity)
+            timeline = list(timelineForSymbol(symbol, activity))
+
+            self.assertEqual(
+                checkpoint.realizedBasis, realizedBasisForSymbol(symbol, activity)
+            )
+            self.assertEqual(checkpoint.count, len(timeline))
+            self.assertEqual(checkpoint.entry, timeline[-1] if timeline else None)
+
+    @given(lists(uniformActivity(), max_size=30), integers(min_value=0, max_value=30))
+    def test_advanceMatchesBuild(self, activity: List[Activity], split: int) -> None:
+        # Identical activity on either side of the split would be skipped as
+        # already applied.
+        activity = sorted(dict.fromkeys(activity), key=lambda a: a.date)
+        old, new = activity[:split], activity[split:]
+
+        checkpoint, deltas = SymbolCheckpoint.build("SPY", old).advance(new)
+        expected = SymbolCheckpoint.build("SPY", ActivityIndex(activity))
+        self.assertEqual(checkpoint, expected)
+
+        timeline = list(timelineForSymbol("SPY", activity))
+        self.assertEqual(
+            [d.realizedProfit for d in deltas],
+            [e.realizedProfit for e in timeline[len(timeline) - len(deltas) :]],
+        )
+
+    def test_backdatedActivity(self) -> None:
+        trades = [
+            Trade(
+                date=datetime(2019, 1, day),
+                instrument=Stock("SPY", Currency.USD),
+                quantity=Decimal("1"),
+                amount=helpers.cashUSD(Decimal("-100")),
+                fees=helpers.cashUSD(Decimal("0")),
+                flags=TradeFlags.OPEN,
+            )
+            for day in [1, 2]
+        ]
+
+        checkpoint = SymbolCheckpoint.build("SPY", trades[1:])
+        with self.assertRaises(BackdatedActivityError):
+            checkpoint.advance(trades[:1])
+
+    def test_reappliedActivityIsSkipped(self) -> None:
+        trades = [
+            Trade(
+                date=datetime(2019, 1, 1),
+                instrument=Stock("SPY", Currency.USD),
+                quantity=Decimal(quantity),
+                amount=helpers.cashUSD(Decimal("-100") * quantity),
+                fees=helpers.cashUSD(Decimal("0")),
+                flags=TradeFlags.OPEN,
+            )
+            for quantity in [1, 2, 2]
+        ]
+
+        checkpoint = SymbolCheckpoint.build("SPY", trades[:2])
+        self.assertEqual(checkpoint.advance(trades[:2]), (checkpoint, []))
+
+        # Activity on the same date as the checkpoint is not back-dated, and
+        # identical activity is applied as many times as it occurs.
+        advanced, deltas = checkpoint.advance(trades)
+        self.assertEqual(len(deltas), 1)
+        self.assertEqual(advanced.positions, {Stock("SPY", Currency.USD): 5})
+        self.assertEqual(advanced, SymbolCheckpoint.build("SPY", trades))
+        self.assertEqual(advanced.advance(trades), (advanced, []))
+
+
+class TestCheckpointStore(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = CheckpointStore(self.directory.name)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    @given(lists(uniformActivity(), max_size=10))
+    def test_roundTrip(self, activity: List[Activity]) -> None:
+        checkpoint = SymbolCheckpoint.build("BRK B", activity)
+        self.store.store(checkpoint)
+
+        self.assertEqual(self.store.load("BRK.B"), checkpoint)
+        self.assertIsNone(self.store.load("SPY"))
+
+        self.assertEqual(self.store.invalidate(["BRKB"]), 1)
+        self.assertIsNone(self.store.load("BRK.B"))
+
+    @given(lists(uniformActivity(), min_size=1, max_size=20))
+    def test_updateCheckpoint(self, activity: List[Activity]) -> None:
+        self.store.invalidate()
+        activity = sorted(dict.fromkeys(activity), key=lambda a: a.date)
+        old, new = activity[:-1], activity[-1:]
+        expected = SymbolCheckpoint.build("SPY", activity)
+
+        # Without a checkpoint, the full history is used.
+        self.assertEqual(
+            updateCheckpoint(self.store, "SPY", [], history=old),
+            SymbolCheckpoint.build("SPY", old),
+        )
+
+        # Otherwise, only new activity is applied.
+        self.assertEqual(
+            updateCheckpoint(self.store, "SPY", new, history=iter(())), expected
+        )
+        self.assertEqual(self.store.load("SPY"), expected)
+
+        # Back-dated activity causes a rebuild.
+        lastDate = expected.lastDate
+        if lastDate is not None and old and old[0].date < lastDate:
+            self.assertEqual(
+                updateCheckpoint(self.store, "SPY", old[:1], history=activity), expected
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 from argparse import ArgumentParser
 from enum import unique
+from typing import Iterable, Mapping
 
 from hypothesis import given
 from hypothesis.strategies import from_type, sampled_from, text
@@ -10,10 +11,40 @@ import bankroll.brokers.fidelity as fidelity
 import bankroll.brokers.ibkr as ibkr
 import bankroll.brokers.schwab as schwab
 import bankroll.brokers.vanguard as vanguard
-from bankroll.broker import configuration
-from bankroll.interface import loadConfig
+from bankroll.analysis import CachingMarketDataProvider
+from bankroll.broker import AccountAggregator, AccountData, configuration
+from bankroll.interface import MarketDataSettings, loadConfig, marketDataProvider
+from bankroll.marketdata import MarketConnectedAccountData, MarketDataProvider
+from bankroll.model import AccountBalance, Activity, Currency, Position, Stock
+from tests.test_caching import CountingDataProvider
 
-import pkg_resources
+import importlib.resources
+
+
+class MarketAccount(MarketConnectedAccountData):
+    def __init__(self) -> None:
+        self._provider = CountingDataProvider()
+        super().__init__()
+
+    # Never loaded from settings, so as not to affect other tests.
+    @classmethod
+    def fromSettings(
+        cls, settings: Mapping[configuration.Settings, str], lenient: bool
+    ) -> AccountData:
+        raise NotImplementedError()
+
+    @property
+    def marketDataProvider(self) -> MarketDataProvider:
+        return self._provider
+
+    def positions(self) -> Iterable[Position]:
+        return []
+
+    def activity(self) -> Iterable[Activity]:
+        return []
+
+    def balance(self) -> AccountBalance:
+        return AccountBalance(cash={})
 
 
 class TestConfiguration(unittest.TestCase):
@@ -46,10 +77,52 @@ class TestConfiguration(unittest.TestCase):
     # Verifies that settings keys are present in bankroll.default.ini, even if commented out.
     @given(from_type(configuration.Settings))
     def testSettingsListedInDefaultINI(self, key: configuration.Settings) -> None:
-        contents = (
-            pkg_resources.resource_string("bankroll.interface", "bankroll.default.ini")
-            .decode()
-            .lower()
-        )
+        contents = importlib.resources.read_text(
+            "bankroll.interface", "bankroll.default.ini"
+        ).lower()
 
         self.assertIn(key.value.lower(), contents)
+
+
+class TestMarketDataProvider(unittest.TestCase):
+    def setUp(self) -> None:
+        self.accounts = AccountAggregator(accounts=[MarketAccount()], lenient=False)
+
+    def testCachingProviderIsShared(self) -> None:
+        settings = {MarketDataSettings.CACHE_QUOTES: "true"}
+        provider = marketDataProvider(self.accounts, settings)
+
+        self.assertIsInstance(provider, CachingMarketDataProvider)
+        self.assertIs(marketDataProvider(self.accounts, dict(settings)), provider)
+
+    def testDifferentSettingsAreNotIgnored(self) -> None:
+        provider = marketDataProvider(
+            self.accounts, {MarketDataSettings.CACHE_QUOTES: "true"}
+        )
+        other = marketDataProvider(
+            self.accounts,
+            {
+                MarketDataSettings.CACHE_QUOTES: "true",
+                MarketDataSettings.QUOTE_TTL: "5",
+            },
+        )
+        assert isinstance(other, CachingMarketDataProvider)
+
+        self.assertIsNot(other, provider)
+        self.assertEqual(other.ttlForInstrument(Stock("SPY", Currency.USD)), 5)
+        self.assertNotIsInstance(
+            marketDataProvider(self.accounts, {}), CachingMarketDataProvider
+        )
+
+    def testEmptyTTLsUseDefault(self) -> None:
+        provider = marketDataProvider(
+            self.accounts,
+            {
+                MarketDataSettings.CACHE_QUOTES: "true",
+                MarketDataSettings.QUOTE_TTL: "5",
+                MarketDataSettings.STOCK_QUOTE_TTL: "",
+            },
+        )
+        assert isinstance(provider, CachingMarketDataProvider)
+
+        self.assertEqual(provider.ttlForInstrument(Stock("SPY", Currency.USD)), 5)
@@ -0,0 +1,159 @@
+import csv
+import gzip
+import io
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from decimal import Decimal
+from importlib.util import find_spec
+from typing import List, TextIO, cast
+
+from hypothesis import given
+from hypothesis.strategies import integers, lists
+
+from bankroll.broker import AccountAggregator
+from bankroll.interface.export import ExportFormat, exportActivity, mergeActivity
+from bankroll.model import Activity, CashPayment, Currency, Stock, Trade, converter
+from tests import helpers
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "activity.csv")
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    @given(lists(lists(helpers.activity(), max_size=10), max_size=5))
+    def test_mergeActivityInDateOrder(self, accounts: List[List[Activity]]) -> None:
+        merged = list(mergeActivity(accounts))
+
+        self.assertCountEqual(merged, [a for acts in accounts for a in acts])
+
+        dates = [a.date for a in merged]
+        self.assertEqual(dates, sorted(dates))
+
+    @given(lists(helpers.activity(), max_size=20), integers(min_value=1, max_value=8))
+    def test_csvMatchesConverter(
+        self, activity: List[Activity], chunkSize: int
+    ) -> None:
+        activity.sort(key=lambda a: a.date)
+        trades = [a for a in activity if isinstance(a, Trade)]
+
+        count = exportActivity(trades, self.path, chunkSize=chunkSize)
+        self.assertEqual(count, len(trades))
+
+        with open(self.path, newline="") as f:
+            exported = f.read()
+
+        expected = io.StringIO()
+        df = converter.dataframeForModelObjects(trades)
+        if trades:
+            df["Kind"] = "trade"
+            df.to_csv(expected, index=False, line_terminator="\n")
+        else:
+            expected.write("Date,Action,Quantity,Instrument,Amount,Fees,Kind\n")
+
+        self.assertEqual(exported, expected.getvalue())
+
+    def test_paymentsExported(self) -> None:
+        payments = [
+            CashPayment(
+                date=datetime(2019, 1, 2),
+                instrument=Stock("SPY", Currency.USD),
+                proceeds=helpers.cashUSD(Decimal("1.23")),
+            ),
+            CashPayment(
+                date=datetime(2019, 1, 3),
+                instrument=None,
+                proceeds=helpers.cashUSD(Decimal("-4.56")),
+            ),
+        ]
+
+        self.assertEqual(exportActivity(payments, self.path), 2)
+        with open(self.path, newline="") as f:
+            rows = list(csv.DictReader(f))
+
+        self.assertEqual([r["Kind"] for r in rows], ["payment", "payment"])
+        self.assertEqual([r["Instrument"] for r in rows], ["SPY", ""])
+        self.assertEqual(
+            [r["Amount"] for r in rows], [str(p.proceeds) for p in payments]
+        )
+        self.assertEqual([r["Action"] for r in rows], ["", ""])
+        self.assertEqual([r["Fees"] for r in rows], ["", ""])
+
+    def test_gzipFixtures(self) -> None:
+        accounts = AccountAggregator.fromSettings(
+            helpers.fixtureSettings, lenient=False
+        )
+        activity = list(mergeActivity(a.activity() for a in accounts.accounts))
+
+        plainPath = self.path
+        gzipPath = self.path + ".gz"
+        exportActivity(activity, plainPath, chunkSize=7)
+        count = exportActivity(activity, gzipPath, compress=True, chunkSize=7)
+
+        with open(plainPath, newline="") as f:
+            plain = f.read()
+        with cast(TextIO, gzip.open(gzipPath, "rt", newline="")) as f:
+            self.assertEqual(f.read(), plain)
+
+        rows = list(csv.DictReader(io.StringIO(plain)))
+        self.assertEqual(len(rows), count)
+        self.assertGreater(count, 0)
+        self.assertEqual([r["Date"] for r in rows], sorted(r["Date"] for r in rows))
+
+    def test_invalidArguments(self) -> None:
+        with self.assertRaises(ValueError):
+            exportActivity([], self.path, chunkSize=0)
+        with self.assertRaises(ValueError):
+            exportActivity([], self.path, format=ExportFormat.FEATHER, compress=True)
+
+    def test_formatForPath(self) -> None:
+        self.assertEqual(ExportFormat.forPath("a.csv"), ExportFormat.CSV)
+        self.assertEqual(ExportFormat.forPath("a.csv.gz"), ExportFormat.CSV)
+        self.assertEqual(ExportFormat.forPath("a"), ExportFormat.CSV)
+        self.assertEqual(ExportFormat.forPath("a.PARQUET"), ExportFormat.PARQUET)
+        self.assertEqual(ExportFormat.forPath("a.parquet.gz"), ExportFormat.PARQUET)
+        self.assertEqual(ExportFormat.forPath("a.feather"), ExportFormat.FEATHER)
+
+    @unittest.skipUnless(find_spec("pyarrow"), "pyarrow is not installed")
+    def test_arrowFormatsRoundTrip(self) -> None:
+        import pyarrow.feather  # type: ignore
+        import pyarrow.parquet  # type: ignore
+
+        accounts = AccountAggregator.fromSettings(
+            helpers.fixtureSettings, lenient=False
+        )
+        activity = list(mergeActivity(a.activity() for a in accounts.accounts))
+        amounts = [
+            a.amount if isinstance(a, Trade) else cast(CashPayment, a).proceeds
+            for a in activity
+        ]
+
+        parquetPath = os.path.join(self.directory.name, "activity.parquet")
+        exportActivity(activity, parquetPath, format=ExportFormat.PARQUET, chunkSize=7)
+        featherPath = os.path.join(self.directory.name, "activity.feather")
+        exportActivity(activity, featherPath, format=ExportFormat.FEATHER, chunkSize=7)
+
+        for table in [
+            pyarrow.parquet.read_table(parquetPath),
+            pyarrow.feather.read_table(featherPath),
+        ]:
+            self.assertEqual(table.num_rows, len(activity))
+            self.assertEqual(
+                table.column("Amount").to_pylist(), [a.quantity for a in amounts]
+            )
+            self.assertEqual(
+                table.column("Currency").to_pylist(), [a.currency.name for a in amounts]
+            )
+            self.assertEqual(
+                table.column("Kind").to_pylist(),
+                ["trade" if isinstance(a, Trade) else "payment" for a in activity],
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
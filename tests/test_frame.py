@@ -0,0 +1,189 @@
+import unittest
+from datetime import datetime
+from decimal import Decimal
+from typing import List
+
+from hypothesis import given
+from hypothesis.strategies import (
+    SearchStrategy,
+    datetimes,
+    just,
+    lists,
+    one_of,
+    sampled_from,
+)
+
+from bankroll.analysis import (
+    ActivityIndex,
+    compactTimelineForSymbol,
+    realizedBasisForSymbol,
+)
+from bankroll.analysis.frame import ActivityFrame
+from bankroll.broker import AccountAggregator
+from bankroll.model import Activity, Cash, CashPayment, Currency, Stock, Trade
+from tests import helpers
+
+# Dates which pandas can represent.
+frameDates = datetimes(min_value=datetime(1900, 1, 1), max_value=datetime(2200, 1, 1))
+
+
+# Activity on a few symbols, all in one currency, so that it can be summed.
+def uniformActivity(currency: Currency = Currency.USD) -> SearchStrategy[Activity]:
+    symbols = sampled_from(["AAPL", "BRK.B", "BRK B", "SPY"])
+    cash = helpers.cash(currency=just(currency))
+    return one_of(
+        helpers.trades(
+            date=frameDates,
+            instrument=one_of(
+                helpers.stocks(symbol=symbols, currency=just(currency)),
+                helpers.options(underlying=symbols, currency=just(currency)),
+            ),
+            amount=cash,
+            fees=helpers.cash(
+                currency=just(currency),
+                quantity=helpers.cashAmounts(min_value=Decimal("0")),
+            ),
+        ),
+        helpers.dividendPayments(
+            date=frameDates,
+            stock=helpers.stocks(symbol=symbols, currency=just(currency)),
+            proceeds=cash,
+        ),
+    )
+
+
+class TestActivityFrame(unittest.TestCase):
+    @given(lists(helpers.activity(date=frameDates), max_size=20))
+    def test_roundTrip(self, activity: List[Activity]) -> None:
+        frame = ActivityFrame(activity)
+        self.assertEqual(len(frame), len(activity))
+        self.assertEqual(list(frame), activity)
+
+    @given(lists(helpers.activity(date=frameDates), max_size=20))
+    def test_activityForSymbolMatchesIndex(self, activity: List[Activity]) -> None:
+        frame = ActivityFrame(activity)
+        index = ActivityIndex(activity)
+
+        self.assertEqual(set(frame.symbols), set(index.symbols))
+        for symbol in index.symbols:
+            self.assertEqual(
+                list(frame.activityForSymbol(symbol)),
+                list(index.activityForSymbol(symbol)),
+            )
+
+    @given(lists(uniformActivity(), max_size=30))
+    def test_realizedBasisMatches(self, activity: List[Activity]) -> None:
+        frame = ActivityFrame(activity)
+        index = ActivityIndex(activity)
+
+        self.assertEqual(
+            frame.realizedBasisForAllSymbols(), index.realizedBasisForAllSymbols()
+        )
+        for symbol in ["AAPL", "BRK.B", "BRKB", "SPY", "MSFT"]:
+            self.assertEqual(
+                frame.realizedBasisForSymbol(symbol),
+                realizedBasisForSymbol(symbol, activity),
+            )
+
+    @given(lists(uniformActivity(), max_size=30))
+    def test_timelineMatches(self, activity: List[Activity]) -> None:
+        frame = ActivityFrame(activity)
+        index = ActivityIndex(activity)
+
+        for symbol in ["AAPL", "BRK.B", "SPY", "MSFT"]:
+            expected = compactTimelineForSymbol(symbol, index)
+            timeline = frame.timelineForSymbol(symbol, checkpointInterval=4)
+            self.assertEqual(list(timeline.deltas), list(expected.deltas))
+            self.assertEqual(list(timeline), list(expected))
+
+    def test_mixedCurrenciesFail(self) -> None:
+        date = datetime(2019, 1, 1)
+        stock = Stock(symbol="SPY", currency=Currency.USD)
+        activity: List[Activity] = [
+            CashPayment(
+                date=date,
+                instrument=stock,
+                proceeds=Cash(currency=Currency.USD, quantity=Decimal("1")),
+            ),
+            CashPayment(
+                date=date,
+                instrument=stock,
+                proceeds=Cash(currency=Currency.GBP, quantity=Decimal("1")),
+            ),
+        ]
+
+        frame = ActivityFrame(activity)
+        with self.assertRaises(ValueError):
+            frame.realizedBasisForSymbol("SPY")
+        with self.assertRaises(ValueError):
+            frame.realizedBasisForAllSymbols()
+        with self.assertRaises(ValueError):
+            frame.timelineForSymbol("SPY")
+
+    def test_incomeBySymbol(self) -> None:
+        stock = Stock(symbol="SPY", currency=Currency.USD)
+        activity: List[Activity] = [
+            CashPayment(
+                date=datetime(2018, 3, 1),
+                instrument=stock,
+                proceeds=Cash(currency=Currency.USD, quantity=Decimal("1.25")),
+            ),
+            CashPayment(
+                date=datetime(2018, 6, 1),
+                instrument=stock,
+                proceeds=Cash(currency=Currency.USD, quantity=Decimal("1.5")),
+            ),
+            CashPayment(
+                date=datetime(2019, 3, 1),
+                instrument=stock,
+                proceeds=Cash(currency=Currency.USD, quantity=Decimal("2")),
+            ),
+            CashPayment(
+                date=datetime(2019, 3, 1),
+                instrument=None,
+                proceeds=Cash(currency=Currency.GBP, quantity=Decimal("0.1")),
+            ),
+        ]
+
+        income = ActivityFrame(activity).incomeBySymbol()
+        self.assertEqual(income.loc[("SPY", "USD"), "income"], Decimal("4.75"))
+        self.assertEqual(income.loc[("", "GBP"), "income"], Decimal("0.1"))
+
+        yearly = ActivityFrame(activity).incomeBySymbol(period="A")
+        self.assertEqual(
+            [i for i in yearly.xs("SPY", level="symbol")["income"]],
+            [Decimal("2.75"), Decimal("2")],
+        )
+
+    def test_fixtures(self) -> None:
+        activity = list(
+            AccountAggregator.fromSettings(
+                helpers.fixtureSettings, lenient=False
+            ).activity()
+        )
+        frame = ActivityFrame(activity)
+        index = ActivityIndex(activity)
+
+        self.assertEqual(list(frame), activity)
+        for symbol in index.symbols:
+            try:
+                expected = realizedBasisForSymbol(symbol, index)
+            except ValueError:
+                with self.assertRaises(ValueError):
+                    frame.realizedBasisForSymbol(symbol)
+                continue
+
+            self.assertEqual(frame.realizedBasisForSymbol(symbol), expected)
+
+    def test_empty(self) -> None:
+        frame = ActivityFrame([])
+        self.assertEqual(len(frame), 0)
+        self.assertEqual(list(frame), [])
+        self.assertEqual(frame.realizedBasisForAllSymbols(), {})
+        self.assertIsNone(frame.realizedBasisForSymbol("SPY"))
+        self.assertEqual(list(frame.timelineForSymbol("SPY")), [])
+        self.assertEqual(len(frame.incomeBySymbol()), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,320 @@
+import unittest
+from decimal import Decimal
+from typing import Dict, Iterable, List, Tuple, cast
+
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+
+from bankroll.analysis import (
+    CurrencyGraph,
+    FxRateTable,
+    FxRefreshPolicy,
+    convertCashToCurrency,
+)
+from bankroll.marketdata import MarketDataProvider
+from bankroll.model import Cash, Currency, Forex, Instrument, Quote
+from tests import helpers
+
+
+class RecordingDataProvider(MarketDataProvider):
+    def __init__(self, quotes: Dict[Instrument, Quote]):
+        self.quotes = quotes
+        self.requests: List[List[Instrument]] = []
+        super().__init__()
+
+    def fetchQuotes(
+        self, instruments: Iterable[Instrument]
+    ) -> Iterable[Tuple[Instrument, Quote]]:
+        requested = list(instruments)
+        self.requests.append(requested)
+        return ((i, self.quotes[i]) for i in requested if i in self.quotes)
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestFxRateTable(unittest.TestCase):
+    gbpusd = Forex(baseCurrency=Currency.GBP, quoteCurrency=Currency.USD)
+    usdjpy = Forex(baseCurrency=Currency.USD, quoteCurrency=Currency.JPY)
+    eurusd = Forex(baseCurrency=Currency.EUR, quoteCurrency=Currency.USD)
+
+    def setUp(self) -> None:
+        self.provider = RecordingDataProvider(
+            {
+                self.gbpusd: Quote(
+                    bid=helpers.cashUSD(Decimal("1.25")),
+                    ask=helpers.cashUSD(Decimal("1.29")),
+                ),
+                self.usdjpy: Quote(
+                    bid=Cash(currency=Currency.JPY, quantity=Decimal("109")),
+                    ask=Cash(currency=Currency.JPY, quantity=Decimal("110")),
+                ),
+                self.eurusd: Quote(
+                    bid=helpers.cashUSD(Decimal("1.10")),
+                    ask=helpers.cashUSD(Decimal("1.12")),
+                ),
+            }
+        )
+        self.clock = FakeClock()
+
+    def test_convertManyMatchesConvertCashToCurrency(self) -> None:
+        cash = [
+            helpers.cashUSD(Decimal(1000)),
+            Cash(currency=Currency.GBP, quantity=Decimal(100)),
+            Cash(currency=Currency.JPY, quantity=Decimal(30000)),
+        ]
+
+        table = FxRateTable(Currency.USD, self.provider)
+        converted = table.convertMany(cash)
+
+        self.assertEqual(
+            converted[0] + converted[1] + converted[2],
+            convertCashToCurrency(Currency.USD, cash, self.provider),
+        )
+        self.assertEqual(converted[0], helpers.cashUSD(Decimal(1000)))
+        self.assertEqual(converted[1], helpers.cashUSD(Decimal(127)))
+
+    def test_fetchesEachCurrencyOnce(self) -> None:
+        table = FxRateTable(Currency.USD, self.provider, currencies=[Currency.GBP])
+        self.assertEqual(len(self.provider.requests), 1)
+
+        for _ in range(3):
+            table.convertMany(
+                [
+                    Cash(currency=Currency.GBP, quantity=Decimal(5)),
+                    Cash(currency=Currency.EUR, quantity=Decimal(5)),
+                    Cash(currency=Currency.EUR, quantity=Decimal(7)),
+                ]
+            )
+
+        self.assertEqual(self.provider.requests[1:], [[self.eurusd]])
+        self.assertEqual(
+            table.convert(Cash(currency=Currency.EUR, quantity=Decimal(10))),
+            helpers.cashUSD(Decimal("11.1")),
+        )
+
+    def test_manualPolicyNeverFetches(self) -> None:
+        table = FxRateTable(
+            Currency.USD,
+            self.provider,
+            currencies=[Currency.GBP],
+            policy=FxRefreshPolicy.MANUAL,
+        )
+
+        with self.assertRaises(RuntimeError):
+            table.convert(Cash(currency=Currency.EUR, quantity=Decimal(1)))
+
+        self.assertEqual(len(self.provider.requests), 1)
+
+        table.refresh([Currency.EUR])
+        self.assertEqual(
+            table.convert(Cash(currency=Currency.EUR, quantity=Decimal(10))),
+            helpers.cashUSD(Decimal("11.1")),
+        )
+
+    def test_expiredPolicyRefreshesAfterMaxAge(self) -> None:
+        table = FxRateTable(
+            Currency.USD,
+            self.provider,
+            currencies=[Currency.GBP],
+            policy=FxRefreshPolicy.EXPIRED,
+            maxAge=30,
+            clock=self.clock,
+        )
+
+        gbp = Cash(currency=Currency.GBP, quantity=Decimal(100))
+        self.assertEqual(table.convert(gbp), helpers.cashUSD(Decimal(127)))
+
+        self.provider.quotes[self.gbpusd] = Quote(
+            bid=helpers.cashUSD(Decimal("1.30")), ask=helpers.cashUSD(Decimal("1.32"))
+        )
+        self.clock.now = 29
+        self.assertFalse(table.isStale)
+        self.assertEqual(table.convert(gbp), helpers.cashUSD(Decimal(127)))
+
+        self.clock.now = 30
+        self.assertTrue(table.isStale)
+        self.assertEqual(table.convert(gbp), helpers.cashUSD(Decimal(131)))
+        self.assertEqual(table.age, 0)
+
+    def test_expiredPolicyRefreshesOldRatesAfterFetchingNewCurrency(self) -> None:
+        table = FxRateTable(
+            Currency.USD,
+            self.provider,
+            currencies=[Currency.GBP],
+            policy=FxRefreshPolicy.EXPIRED,
+            maxAge=30,
+            clock=self.clock,
+        )
+
+        self.clock.now = 20
+        eur = Cash(currency=Currency.EUR, quantity=Decimal(10))
+        self.assertEqual(table.convert(eur), helpers.cashUSD(Decimal("11.1")))
+        self.assertEqual(table.age, 20)
+
+        self.provider.quotes[self.gbpusd] = Quote(
+            bid=helpers.cashUSD(Decimal("1.30")), ask=helpers.cashUSD(Decimal("1.32"))
+        )
+        self.clock.now = 30
+        self.assertTrue(table.isStale)
+        table.convert(eur)
+
+        self.assertIn(self.gbpusd, self.provider.requests[-1])
+        self.assertEqual(
+            table.convert(Cash(currency=Currency.GBP, quantity=Decimal(100))),
+            helpers.cashUSD(Decimal(131)),
+        )
+        self.assertEqual(table.age, 0)
+
+    def test_expiredPolicyRequiresMaxAge(self) -> None:
+        with self.assertRaises(ValueError):
+            FxRateTable(Currency.USD, self.provider, policy=FxRefreshPolicy.EXPIRED)
+
+    def test_convertManyColumn(self) -> None:
+        table = FxRateTable(Currency.USD, self.provider)
+        df = pd.DataFrame(
+            {
+                "value": [10.0, 100.0, 5.0],
+                "currency": [Currency.USD, Currency.GBP, Currency.EUR],
+            }
+        )
+
+        converted = table.convertMany(df["value"], df["currency"])
+        np.testing.assert_allclose(converted.values, [10.0, 127.0, 5.55])
+        self.assertEqual(len(self.provider.requests), 1)
+
+        decimals = table.convertMany(
+            df["value"].map(lambda v: Decimal(str(v))), df["currency"]
+        )
+        self.assertEqual(
+            list(decimals), [Decimal("10.0"), Decimal("127.00"), Decimal("5.550")]
+        )
+
+
+class TestCurrencyGraph(unittest.TestCase):
+    def setUp(self) -> None:
+        self.provider = RecordingDataProvider(
+            {
+                Forex(baseCurrency=Currency.EUR, quoteCurrency=Currency.USD): Quote(
+                    bid=helpers.cashUSD(Decimal("1.10")),
+                    ask=helpers.cashUSD(Decimal("1.12")),
+                ),
+                Forex(baseCurrency=Currency.GBP, quoteCurrency=Currency.USD): Quote(
+                    bid=helpers.cashUSD(Decimal("1.25")),
+                    ask=helpers.cashUSD(Decimal("1.29")),
+                ),
+                Forex(baseCurrency=Currency.USD, quoteCurrency=Currency.JPY): Quote(
+                    bid=Cash(currency=Currency.JPY, quantity=Decimal("109")),
+                    ask=Cash(currency=Currency.JPY, quantity=Decimal("110")),
+                ),
+                Forex(baseCurrency=Currency.USD, quoteCurrency=Currency.CHF): Quote(
+                    bid=Cash(currency=Currency.CHF, quantity=Decimal("0.99")),
+                    ask=Cash(currency=Currency.CHF, quantity=Decimal("1.01")),
+                ),
+            }
+        )
+
+    def test_crossRatesAreTriangulatedThroughHub(self) -> None:
+        graph = CurrencyGraph(self.provider)
+
+        self.assertEqual(graph.rate(Currency.EUR, Currency.USD), Decimal("1.11"))
+        self.assertEqual(
+            graph.rate(Currency.EUR, Currency.GBP), Decimal("1.11") / Decimal("1.27")
+        )
+        self.assertEqual(
+            graph.rate(Currency.JPY, Currency.CHF), Decimal(1) / Decimal("109.5")
+        )
+        self.assertEqual(graph.rate(Currency.USD, Currency.USD), Decimal(1))
+
+    def test_defaultPairsFollowMarketConvention(self) -> None:
+        graph = CurrencyGraph(self.provider)
+        list(graph.conversionRates(Currency.USD, list(Currency)))
+
+        self.assertEqual(
+            {
+                f"{p.baseCurrency.name}{p.quoteCurrency.name}"
+                for r in self.provider.requests
+                for p in cast(List[Forex], r)
+            },
+            {"EURUSD", "GBPUSD", "AUDUSD", "NZDUSD", "USDCAD", "USDCHF", "USDJPY"},
+        )
+
+    def test_inverseRatesKeepPrecision(self) -> None:
+        graph = CurrencyGraph(self.provider)
+        rates = dict(graph.conversionRates(Currency.USD, [Currency.JPY]))
+
+        self.assertEqual(
+            Decimal(30000) * rates[Currency.JPY], Decimal(30000) / Decimal("109.5")
+        )
+
+    def test_eachPairIsFetchedOnceAcrossReportCurrencies(self) -> None:
+        graph = CurrencyGraph(self.provider)
+        currencies = [Currency.EUR, Currency.GBP, Currency.JPY, Currency.CHF]
+
+        tables = [
+            FxRateTable(report, graph, currencies=currencies)
+            for report in (Currency.USD, Currency.EUR, Currency.GBP, Currency.JPY)
+        ]
+
+        self.assertEqual(graph.requestedPairs, len(currencies))
+        self.assertEqual(len(self.provider.requests), 1)
+        self.assertEqual(
+            tables[1].convert(Cash(currency=Currency.GBP, quantity=Decimal(111))),
+            Cash(currency=Currency.EUR, quantity=Decimal(127)),
+        )
+
+    def test_onlyPathsToRequestedCurrenciesAreFetched(self) -> None:
+        eurgbp = Forex(baseCurrency=Currency.EUR, quoteCurrency=Currency.GBP)
+        self.provider.quotes[eurgbp] = Quote(
+            bid=Cash(currency=Currency.GBP, quantity=Decimal("0.86")),
+            ask=Cash(currency=Currency.GBP, quantity=Decimal("0.90")),
+        )
+        gbpusd = Forex(baseCurrency=Currency.GBP, quoteCurrency=Currency.USD)
+        usdjpy = Forex(baseCurrency=Currency.USD, quoteCurrency=Currency.JPY)
+
+        graph = CurrencyGraph(
+            self.provider, pairs=[eurgbp, gbpusd, usdjpy], hub=Currency.GBP
+        )
+        self.assertEqual(
+            graph.currencies, {Currency.EUR, Currency.GBP, Currency.USD, Currency.JPY}
+        )
+
+        self.assertEqual(graph.rate(Currency.EUR, Currency.GBP), Decimal("0.88"))
+        self.assertEqual(self.provider.requests, [[eurgbp]])
+
+        self.assertEqual(
+            graph.rate(Currency.JPY, Currency.EUR),
+            Decimal(1) / Decimal("1.27") / Decimal("109.5") / Decimal("0.88"),
+        )
+        self.assertEqual(self.provider.requests[1], [gbpusd, usdjpy])
+
+        with self.assertRaises(ValueError):
+            graph.rate(Currency.CHF, Currency.GBP)
+
+    def test_unavailablePairsAreRequestedOncePerConversion(self) -> None:
+        eurgbp = Forex(baseCurrency=Currency.EUR, quoteCurrency=Currency.GBP)
+        self.provider.quotes[eurgbp] = Quote(
+            bid=Cash(currency=Currency.GBP, quantity=Decimal("0.86")),
+            ask=Cash(currency=Currency.GBP, quantity=Decimal("0.90")),
+        )
+        gbpusd = Forex(baseCurrency=Currency.GBP, quoteCurrency=Currency.USD)
+        usdjpy = Forex(baseCurrency=Currency.USD, quoteCurrency=Currency.JPY)
+        del self.provider.quotes[gbpusd]
+
+        # USD and JPY are both reached through GBPUSD.
+        graph = CurrencyGraph(
+            self.provider, pairs=[eurgbp, gbpusd, usdjpy], hub=Currency.GBP
+        )
+        rates = dict(
+            graph.conversionRates(
+                Currency.GBP, [Currency.EUR, Currency.USD, Currency.JPY]
+            )
+        )
+
+        self.assertEqual(rates, {Currency.EUR: Decimal("0.88")})
+        self.assertEqual(self.provider.requests, [[eurgbp, gbpusd, usdjpy]])
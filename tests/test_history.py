@@ -0,0 +1,352 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+from typing import Any, Awaitable, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+
+from bankroll.analysis import (
+    HistoricalBarCache,
+    HistoryReport,
+    IBMarketDataProvider,
+    fetchHistory,
+    fetchHistoryAsync,
+)
+from bankroll.analysis.history import barColumns
+from bankroll.analysis.ibkr import _durationSince
+from bankroll.marketdata import MarketDataProvider
+from bankroll.model import Currency, Instrument, Quote, Stock
+
+
+def barsForDays(days: Iterable[date]) -> pd.DataFrame:
+    days = list(days)
+    prices = [float(d.toordinal() % 100) for d in days]
+    return pd.DataFrame(
+        {
+            "date": days,
+            "open": prices,
+            "high": prices,
+            "low": prices,
+            "close": prices,
+            "volume": 1.0,
+            "barCount": 1.0,
+            "average": prices,
+        }
+    )
+
+
+class HistoricalDataProvider(MarketDataProvider):
+    def __init__(self, days: List[date]):
+        self.days = days
+        self.requests: List[Instrument] = []
+        super().__init__()
+
+    def fetchQuotes(
+        self, instruments: Iterable[Instrument]
+    ) -> Iterable[Tuple[Instrument, Quote]]:
+        return []
+
+    def fetchHistoricalData(self, instrument: Instrument) -> pd.DataFrame:
+        self.requests.append(instrument)
+        return barsForDays(self.days)
+
+
+class RangedHistoricalDataProvider(HistoricalDataProvider):
+    def __init__(self, days: List[date]):
+        self.starts: List[Optional[date]] = []
+        super().__init__(days)
+
+    def fetchHistoricalData(
+        self, instrument: Instrument, start: Optional[date] = None
+    ) -> pd.DataFrame:
+        self.starts.append(start)
+        self.requests.append(instrument)
+        return barsForDays(d for d in self.days if start is None or d >= start)
+
+
+class SlowHistoricalDataProvider(HistoricalDataProvider):
+    def __init__(
+        self,
+        days: List[date],
+        delay: float = 0.05,
+        failures: Dict[str, int] = {},
+        hangs: Set[str] = set(),
+    ):
+        self.delay = delay
+        self.failures = dict(failures)
+        self.hangs = hangs
+        self.lock = threading.Lock()
+        self.concurrentRequests = 0
+        self.maxConcurrentRequests = 0
+        super().__init__(days)
+
+    def fetchHistoricalData(self, instrument: Instrument) -> pd.DataFrame:
+        with self.lock:
+            self.requests.append(instrument)
+            self.concurrentRequests += 1
+            self.maxConcurrentRequests = max(
+                self.maxConcurrentRequests, self.concurrentRequests
+            )
+
+        try:
+            time.sleep(1 if instrument.symbol in self.hangs else self.delay)
+
+            with self.lock:
+                remaining = self.failures.get(instrument.symbol, 0)
+                if remaining:
+                    self.failures[instrument.symbol] = remaining - 1
+                    raise ValueError(f"No data for {instrument.symbol}")
+
+            return barsForDays(self.days)
+        finally:
+            with self.lock:
+                self.concurrentRequests -= 1
+
+
+# Implements just enough of ib_insync's asynchronous API for IBMarketDataProvider.
+# Its synchronous API is deliberately missing.
+class StubIBClient:
+    def __init__(self, days: List[date]):
+        self.days = days
+        self.requests: List[Any] = []
+        self.durations: List[str] = []
+        super().__init__()
+
+    # Like ib_insync, runs the loop the connection was made on.
+    def run(self, awaitable: Awaitable[Any]) -> Any:
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(awaitable)
+        finally:
+            loop.close()
+
+    async def qualifyContractsAsync(self, *contracts: Any) -> List[Any]:
+        return list(contracts)
+
+    async def reqHistoricalDataAsync(self, contract: Any, **kwargs: Any) -> List[Any]:
+        self.requests.append(contract)
+        self.durations.append(kwargs["durationStr"])
+        await asyncio.sleep(0)
+        return [
+            SimpleNamespace(
+                date=d,
+                open=1.0,
+                high=1.0,
+                low=1.0,
+                close=1.0,
+                volume=1.0,
+                barCount=1.0,
+                average=1.0,
+            )
+            for d in self.days
+        ]
+
+
+class TestHistoricalBarCache(unittest.TestCase):
+    spy = Stock("SPY", Currency.USD)
+    brk = Stock("BRK B", Currency.USD)
+
+    # Monday, 2019-06-03 through Friday, 2019-06-14.
+    weekdays = [date(2019, 6, 3) + timedelta(days=i) for i in range(12) if (i % 7) < 5]
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = HistoricalBarCache(self.directory.name)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_fetchesOnceAndReadsFromDisk(self) -> None:
+        provider = HistoricalDataProvider(self.weekdays)
+        today = date(2019, 6, 15)
+
+        first = self.cache.bars(self.spy, provider, today=today)
+        second = self.cache.bars(self.spy, provider, today=today)
+        assert first is not None
+
+        self.assertEqual(provider.requests, [self.spy])
+        pd.testing.assert_frame_equal(first, second)
+        self.assertEqual(len(first), len(self.weekdays))
+        self.assertEqual(list(first["date"]), [pd.Timestamp(d) for d in self.weekdays])
+        np.testing.assert_array_equal(
+            first["close"].values, barsForDays(self.weekdays)["close"].values
+        )
+
+    def test_appendsOnlyMissingDays(self) -> None:
+        provider = RangedHistoricalDataProvider(self.weekdays[:5])
+        self.cache.bars(self.spy, provider, today=date(2019, 6, 8))
+
+        # Pretend the cache was last checked back then.
+        checked = datetime(2019, 6, 8).timestamp()
+        os.utime(self.cache.pathForInstrument(self.spy), (checked, checked))
+
+        provider.days = self.weekdays
+        bars = self.cache.bars(self.spy, provider, today=date(2019, 6, 15))
+        assert bars is not None
+
+        self.assertEqual(provider.starts, [None, date(2019, 6, 8)])
+        self.assertEqual(len(bars), len(self.weekdays))
+        cached = self.cache.cachedBars(self.spy)
+        assert cached is not None
+        self.assertEqual(len(cached), len(self.weekdays))
+
+    def test_neverCachesToday(self) -> None:
+        provider = HistoricalDataProvider(self.weekdays)
+        bars = self.cache.bars(self.spy, provider, today=date(2019, 6, 14))
+        assert bars is not None
+
+        self.assertEqual(bars["date"].iloc[-1], pd.Timestamp(2019, 6, 13))
+
+    def test_lookbackLimitsReturnedBars(self) -> None:
+        cache = HistoricalBarCache(self.directory.name, lookback=timedelta(days=3))
+        provider = HistoricalDataProvider(self.weekdays)
+
+        bars = cache.bars(self.spy, provider, today=date(2019, 6, 15))
+        assert bars is not None
+        self.assertEqual(
+            list(bars["date"]),
+            [
+                pd.Timestamp(2019, 6, 12),
+                pd.Timestamp(2019, 6, 13),
+                pd.Timestamp(2019, 6, 14),
+            ],
+        )
+        cached = cache.cachedBars(self.spy)
+        assert cached is not None
+        self.assertEqual(len(cached), len(self.weekdays))
+
+    def test_invalidate(self) -> None:
+        provider = HistoricalDataProvider(self.weekdays)
+        today = date(2019, 6, 15)
+        self.cache.bars(self.spy, provider, today=today)
+        self.cache.bars(self.brk, provider, today=today)
+
+        self.assertEqual(self.cache.invalidateSymbols(["BRK B"]), 1)
+        self.assertIsNone(self.cache.cachedBars(self.brk))
+        self.assertIsNotNone(self.cache.cachedBars(self.spy))
+
+        self.assertEqual(self.cache.invalidate(), 1)
+        self.assertIsNone(self.cache.cachedBars(self.spy))
+
+        self.cache.bars(self.spy, provider, today=today)
+        self.assertEqual(len(provider.requests), 3)
+
+
+class TestFetchHistory(unittest.TestCase):
+    days = [date(2019, 6, 3), date(2019, 6, 4)]
+    stocks = [Stock(symbol, Currency.USD) for symbol in ["A", "B", "C", "D", "E", "F"]]
+
+    def test_fetchesConcurrentlyWithinLimit(self) -> None:
+        provider = SlowHistoricalDataProvider(self.days)
+        report = fetchHistory(provider, self.stocks, maxConcurrency=3)
+
+        self.assertEqual(provider.maxConcurrentRequests, 3)
+        self.assertEqual([r.instrument for r in report.results], self.stocks)
+        self.assertEqual(len(report.succeeded), len(self.stocks))
+        self.assertEqual(report.failed, [])
+
+    def test_retriesFailures(self) -> None:
+        provider = SlowHistoricalDataProvider(
+            self.days, delay=0, failures={"B": 1, "C": 5}
+        )
+        report = fetchHistory(provider, self.stocks[:3], retries=2, retryDelay=0)
+
+        a, b, c = report.results
+        self.assertEqual((a.succeeded, a.attempts), (True, 1))
+        self.assertEqual((b.succeeded, b.attempts), (True, 2))
+        self.assertEqual((c.succeeded, c.attempts), (False, 3))
+        self.assertIsInstance(c.error, ValueError)
+        self.assertEqual(report.failed, [c])
+
+    def test_timesOutSlowInstruments(self) -> None:
+        provider = SlowHistoricalDataProvider(self.days, delay=0, hangs={"B"})
+
+        started = time.monotonic()
+        report = fetchHistory(provider, self.stocks[:3], timeout=0.2)
+        self.assertLess(time.monotonic() - started, 0.9)
+
+        self.assertEqual([r.instrument.symbol for r in report.succeeded], ["A", "C"])
+        self.assertIsInstance(report.failed[0].error, asyncio.TimeoutError)
+        self.assertIn("B: failed (TimeoutError", str(report))
+
+    def test_cancellationIsNotRetried(self) -> None:
+        provider = SlowHistoricalDataProvider(self.days, delay=0, hangs={"A"})
+
+        async def fetchThenCancel() -> None:
+            task = asyncio.ensure_future(
+                fetchHistoryAsync(provider, self.stocks[:1], retries=2, retryDelay=0)
+            )
+            await asyncio.sleep(0.1)
+            task.cancel()
+
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(fetchThenCancel())
+        self.assertEqual(provider.requests, self.stocks[:1])
+
+    def test_fetchesFromIBWithAsyncAPI(self) -> None:
+        client = StubIBClient(self.days)
+        provider = IBMarketDataProvider(client)
+
+        report = fetchHistory(provider, self.stocks[:3], maxConcurrency=2)
+        self.assertEqual(len(report.succeeded), 3)
+        self.assertEqual(len(client.requests), 3)
+
+        bars = report.results[0].bars
+        assert bars is not None
+        self.assertEqual(list(bars.columns), barColumns)
+        self.assertEqual(list(bars["date"]), self.days)
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = HistoricalBarCache(directory, lookback=timedelta(days=10000))
+            report = fetchHistory(provider, self.stocks[:1], cache=cache)
+            self.assertEqual(len(report.succeeded), 1)
+            self.assertEqual(len(client.requests), 4)
+
+            cached = cache.cachedBars(self.stocks[0])
+            assert cached is not None
+            self.assertEqual(len(cached), len(self.days))
+
+    def test_fetchesOnlyMissingDaysFromIB(self) -> None:
+        today = date.today()
+        days = [today - timedelta(days=i) for i in range(30, 20, -1)]
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = HistoricalBarCache(directory)
+            cache.bars(self.stocks[0], HistoricalDataProvider(days[:5]), today=today)
+
+            # Pretend the cache was last checked back then.
+            checked = datetime.combine(days[4], datetime.min.time()).timestamp()
+            os.utime(cache.pathForInstrument(self.stocks[0]), (checked, checked))
+
+            client = StubIBClient(days)
+            provider = IBMarketDataProvider(client)
+            report = fetchHistory(provider, self.stocks[:2], cache=cache)
+            self.assertEqual(len(report.succeeded), 2)
+
+            # Only the uncached instrument needs the full history.
+            self.assertCountEqual(client.durations, ["26 D", "10 Y"])
+
+            cached = cache.cachedBars(self.stocks[0])
+            assert cached is not None
+            self.assertEqual(len(cached), len(days))
+
+        self.assertEqual(
+            _durationSince(date(2018, 6, 3), today=date(2019, 6, 3)), "2 Y"
+        )
+
+    def test_fetchesFromRunningLoop(self) -> None:
+        provider = SlowHistoricalDataProvider(self.days, delay=0)
+
+        async def fetch() -> HistoryReport:
+            return fetchHistory(provider, self.stocks[:2])
+
+        report = asyncio.run(fetch())
+        self.assertEqual(len(report.succeeded), 2)
@@ -0,0 +1,100 @@
+import unittest
+from datetime import datetime
+from decimal import Decimal
+from typing import List
+
+from hypothesis import given
+from hypothesis.strategies import lists
+
+from bankroll.analysis import (
+    ActivityIndex,
+    analyzeSymbols,
+    realizedBasisForSymbol,
+    timelineForSymbol,
+)
+from bankroll.analysis.parallel import _analyzePartition, _encodePartition
+from bankroll.model import Activity, Cash, Currency, Stock, Trade, TradeFlags
+from tests import helpers
+from tests.test_checkpoint import uniformActivity
+
+
+class TestAnalyzeSymbols(unittest.TestCase):
+    @given(lists(uniformActivity(), max_size=30))
+    # Each example starts worker processes.
+    @helpers.withoutDeadline
+    def test_matchesSerialAnalysis(self, activity: List[Activity]) -> None:
+        index = ActivityIndex(activity)
+        for jobs in [1, 2]:
+            results = list(analyzeSymbols(index, jobs=jobs, checkpointInterval=4))
+            self.assertEqual(
+                [r.symbol for r in results], sorted(index.underlyingSymbols)
+            )
+
+            for result in results:
+                self.assertIsNone(result.error)
+                self.assertEqual(
+                    result.realizedBasis, realizedBasisForSymbol(result.symbol, index)
+                )
+                assert result.timeline is not None
+                self.assertEqual(
+                    list(result.timeline), list(timelineForSymbol(result.symbol, index))
+                )
+
+    # Partitions are only sent to workers which are not forked (e.g., on macOS
+    # and Windows), so check them here.
+    @given(lists(uniformActivity(), max_size=30))
+    def test_encodedPartitionsMatchSerialAnalysis(
+        self, activity: List[Activity]
+    ) -> None:
+        index = ActivityIndex(activity)
+        for symbol in index.symbols:
+            partition = _encodePartition(
+                symbol, index.activityForSymbol(symbol), True, checkpointInterval=4
+            )
+            result = _analyzePartition(partition)
+
+            self.assertEqual(result.symbol, symbol)
+            self.assertIsNone(result.error)
+            self.assertEqual(
+                result.realizedBasis, realizedBasisForSymbol(symbol, index)
+            )
+            assert result.timeline is not None
+            self.assertEqual(
+                list(result.timeline), list(timelineForSymbol(symbol, index))
+            )
+
+    def test_failuresAreReported(self) -> None:
+        trades = [
+            Trade(
+                date=datetime(2019, 1, 1),
+                instrument=Stock(symbol, Currency.USD),
+                quantity=Decimal("1"),
+                amount=Cash(currency=currency, quantity=Decimal("-100")),
+                fees=helpers.cashUSD(Decimal("0")),
+                flags=TradeFlags.OPEN,
+            )
+            for symbol, currency in [
+                ("SPY", Currency.USD),
+                ("SPY", Currency.GBP),
+                ("QQQ", Currency.USD),
+            ]
+        ]
+
+        qqq, spy = analyzeSymbols(trades, symbols=["SPY", "QQQ"], jobs=2)
+        self.assertEqual(spy.symbol, "SPY")
+        self.assertIsNotNone(spy.error)
+        self.assertIsNone(spy.timeline)
+
+        self.assertEqual(qqq.symbol, "QQQ")
+        self.assertIsNone(qqq.error)
+        self.assertEqual(qqq.realizedBasis, helpers.cashUSD(Decimal("100")))
+
+    def test_timelinesCanBeSkipped(self) -> None:
+        (result,) = analyzeSymbols([], symbols=["SPY"], jobs=2, timelines=False)
+        self.assertEqual(result.symbol, "SPY")
+        self.assertIsNone(result.realizedBasis)
+        self.assertIsNone(result.timeline)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,328 @@
+import unittest
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np  # type: ignore
+import pandas as pd  # type: ignore
+
+from bankroll.analysis import (
+    compactTimelinesForAllSymbols,
+    PanelAlignment,
+    PricePanel,
+    bars_to_panel,
+    etf,
+    positions_to_dataframe,
+    positions_to_history,
+    positions_to_panel,
+    positions_to_portfolio,
+    stocks_to_portfolio,
+    timelines_to_dataframe,
+)
+from bankroll.marketdata import MarketDataProvider
+from bankroll.model import (
+    Cash,
+    CashPayment,
+    Currency,
+    Instrument,
+    Position,
+    Quote,
+    Stock,
+    Trade,
+    TradeFlags,
+)
+from hypothesis import given
+from hypothesis.strategies import composite, floats, integers, lists, sampled_from
+from tests import helpers
+
+
+def barsForPrices(
+    opens: Sequence[Optional[float]], closes: Sequence[Optional[float]]
+) -> pd.DataFrame:
+    # Mimics the shape of the bar DataFrames returned by IBDataProvider.
+    closeArray = np.array([np.nan if c is None else c for c in closes])
+    return pd.DataFrame(
+        {
+            "date": pd.date_range("2019-01-01", periods=len(closes)),
+            "open": [np.nan if o is None else o for o in opens],
+            "high": closeArray,
+            "low": closeArray,
+            "close": closeArray,
+            "volume": 1.0,
+            "barCount": 1.0,
+            "average": closeArray,
+        }
+    )
+
+
+@composite
+def portfolios(draw: Any) -> pd.DataFrame:
+    days = draw(integers(min_value=1, max_value=12))
+    instruments = draw(integers(min_value=1, max_value=3))
+    prices = lists(
+        helpers.optionals(floats(min_value=1, max_value=1000)),
+        min_size=days,
+        max_size=days,
+    )
+
+    components: Dict[str, pd.DataFrame] = {}
+    weights: Dict[str, float] = {}
+    for i in range(instruments):
+        key = f"S{i}"
+        components[key] = barsForPrices(draw(prices), draw(prices))
+        weights[key] = draw(floats(min_value=-1, max_value=1))
+
+    return stocks_to_portfolio(components, weights)
+
+
+class BarsDataProvider(MarketDataProvider):
+    def __init__(self, bars: Dict[str, pd.DataFrame]):
+        self.bars = bars
+        super().__init__()
+
+    def fetchQuotes(
+        self, instruments: Iterable[Instrument]
+    ) -> Iterable[Tuple[Instrument, Quote]]:
+        return []
+
+    def fetchHistoricalData(self, instrument: Instrument) -> pd.DataFrame:
+        if instrument.symbol not in self.bars:
+            raise ValueError(f"No historical data for {instrument}")
+
+        return self.bars[instrument.symbol]
+
+
+class TestPortfolio(unittest.TestCase):
+    def test_etfTracksSingleInstrument(self) -> None:
+        closes = [100.0, 110.0, 99.0, 120.0]
+        portfolio = stocks_to_portfolio(
+            {"SPY": barsForPrices(closes, closes)}, {"SPY": 1.0}
+        )
+
+        result = etf(portfolio, "America/New_York")
+        np.testing.assert_allclose(result.values, np.array(closes) / closes[0])
+
+    def test_etfCarriesHoldingsForwardOverMissingOpens(self) -> None:
+        opens: List[Optional[float]] = [100.0, None, 105.0, None, 90.0]
+        closes: List[Optional[float]] = [101.0, 102.0, None, 95.0, 91.0]
+        portfolio = stocks_to_portfolio(
+            {
+                "A": barsForPrices(opens, closes),
+                "B": barsForPrices(list(reversed(opens)), list(reversed(closes))),
+            },
+            {"A": 0.75, "B": 0.25},
+        )
+
+        expected = etf(portfolio, "America/New_York", reference=True)
+        result = etf(portfolio, "America/New_York")
+        np.testing.assert_allclose(result.values, expected.values, rtol=1e-9)
+        self.assertTrue(result.index.equals(expected.index))
+
+    def test_innerAlignmentKeepsSharedDates(self) -> None:
+        a = barsForPrices([1.0, 2.0, 3.0, 4.0], [1.5, 2.5, 3.5, 4.5])
+        b = barsForPrices([10.0, 20.0, 30.0, 40.0], [15.0, 25.0, 35.0, 45.0])
+        panel = bars_to_panel(
+            {"A": a.drop(index=[1]), "B": b.drop(index=[3])}, {"A": 0.5, "B": 0.5}
+        )
+
+        self.assertEqual(panel.values.shape, (len(PricePanel.fields), 2, 2))
+        self.assertTrue(panel.values.flags["C_CONTIGUOUS"])
+        self.assertEqual(list(panel.dates), list(a["date"][[0, 2]]))
+        np.testing.assert_array_equal(
+            panel.field("close"), np.array([[1.5, 15.0], [3.5, 35.0]])
+        )
+        np.testing.assert_array_equal(panel.field("weight"), np.full((2, 2), 0.5))
+
+    def test_forwardFillAlignmentCarriesLastClose(self) -> None:
+        a = barsForPrices([1.0, 2.0, 3.0, 4.0], [1.5, 2.5, 3.5, 4.5])
+        b = barsForPrices([10.0, 20.0, 30.0, 40.0], [15.0, 25.0, 35.0, 45.0])
+        panel = bars_to_panel(
+            {"A": a.drop(index=[2]), "B": b.drop(index=[0])},
+            {"A": 0.25, "B": 0.75},
+            alignment=PanelAlignment.FORWARD_FILL,
+        )
+
+        self.assertEqual(list(panel.dates), list(a["date"]))
+        np.testing.assert_array_equal(
+            panel.field("open"),
+            np.array([[1.0, np.nan], [2.0, 20.0], [2.5, 30.0], [4.0, 40.0]]),
+        )
+        np.testing.assert_array_equal(
+            panel.field("close"),
+            np.array([[1.5, np.nan], [2.5, 25.0], [2.5, 35.0], [4.5, 45.0]]),
+        )
+        np.testing.assert_array_equal(
+            panel.field("volume"),
+            np.array([[1.0, np.nan], [1.0, 1.0], [0.0, 1.0], [1.0, 1.0]]),
+        )
+        np.testing.assert_array_equal(
+            panel.field("weight"),
+            np.array([[0.25, np.nan], [0.25, 0.75], [0.25, 0.75], [0.25, 0.75]]),
+        )
+
+    def test_instrumentsWithoutBars(self) -> None:
+        a = barsForPrices([1.0, 2.0], [1.5, 2.5])
+        components = {"A": a, "B": a.iloc[:0], "C": pd.DataFrame()}
+        weights = {"A": 0.5, "B": 0.25, "C": 0.25}
+
+        panel = bars_to_panel(components, weights)
+        self.assertEqual(len(panel), 0)
+        self.assertEqual(panel.instruments, ["A", "B", "C"])
+        self.assertEqual(panel.values.shape, (len(PricePanel.fields), 0, 3))
+
+        panel = bars_to_panel(
+            components, weights, alignment=PanelAlignment.FORWARD_FILL
+        )
+        self.assertEqual(list(panel.dates), list(a["date"]))
+        np.testing.assert_array_equal(
+            panel.field("close"),
+            np.array([[1.5, np.nan, np.nan], [2.5, np.nan, np.nan]]),
+        )
+
+    def test_stocksToPortfolioLayout(self) -> None:
+        closes = [100.0, 110.0, 99.0]
+        portfolio = stocks_to_portfolio(
+            {"SPY": barsForPrices(closes, closes)}, {"SPY": 1.0}
+        )
+
+        self.assertEqual(
+            list(portfolio.index.levels[0]), sorted(["date"] + list(PricePanel.fields))
+        )
+        self.assertEqual(
+            list(portfolio.loc["date"]["SPY"]),
+            list(pd.date_range("2019-01-01", periods=len(closes))),
+        )
+        self.assertEqual(list(portfolio.loc["close"]["SPY"]), closes)
+        self.assertEqual(list(portfolio.loc["weight"]["SPY"]), [1.0, 1.0, 1.0])
+
+    def test_positionsToPortfolioAndPanel(self) -> None:
+        positions = [
+            Position(
+                instrument=Stock(symbol, Currency.USD),
+                quantity=Decimal(quantity),
+                costBasis=helpers.cashUSD(Decimal(100)),
+            )
+            for symbol, quantity in [("SPY", 3), ("VT", 1)]
+        ]
+        history = [
+            barsForPrices([1.0, 2.0, 3.0], [1.5, 2.5, 3.5]),
+            barsForPrices([4.0, 5.0, 6.0], [4.5, 5.5, 6.5]),
+        ]
+        frame = positions_to_dataframe(positions)
+
+        portfolio = positions_to_portfolio(frame, history, "UTC")
+        self.assertIsInstance(portfolio, pd.DataFrame)
+        self.assertEqual(list(portfolio.columns), ["SPY", "VT"])
+        self.assertEqual(
+            list(portfolio.loc["weight"]["SPY"]), [float(frame["allocation"][0])] * 3
+        )
+
+        panel = positions_to_panel(frame, history)
+        self.assertIsInstance(panel, PricePanel)
+        pd.testing.assert_series_equal(
+            etf(panel, "UTC"), etf(portfolio, "UTC"), check_exact=False
+        )
+
+    @given(portfolios(), sampled_from(PanelAlignment))
+    @helpers.withoutDeadline
+    def test_etfOfPanelMatchesReference(
+        self, portfolio: pd.DataFrame, alignment: PanelAlignment
+    ) -> None:
+        components = {
+            key: pd.DataFrame(
+                {
+                    "date": portfolio.index.levels[1],
+                    **{
+                        field: portfolio.loc[field][key].values
+                        for field in PricePanel.fields
+                        if field != "weight"
+                    },
+                }
+            ).dropna(subset=["close"])
+            for key in portfolio.columns
+        }
+        weights = {key: portfolio.loc["weight"][key].iloc[0] for key in components}
+        if any(len(c) == 0 for c in components.values()):
+            return
+
+        panel = bars_to_panel(components, weights, alignment=alignment)
+        if len(panel) == 0:
+            return
+
+        expected = etf(panel, "UTC", reference=True)
+        result = etf(panel, "UTC")
+        np.testing.assert_allclose(
+            result.values, expected.values, rtol=1e-9, atol=1e-12
+        )
+        self.assertTrue(result.index.equals(expected.index))
+
+    @given(portfolios())
+    @helpers.withoutDeadline
+    def test_etfMatchesReference(self, portfolio: pd.DataFrame) -> None:
+        expected = etf(portfolio, "UTC", reference=True)
+        result = etf(portfolio, "UTC")
+        np.testing.assert_allclose(
+            result.values, expected.values, rtol=1e-9, atol=1e-12
+        )
+
+    def test_timelinesToDataFrame(self) -> None:
+        spy = Stock("SPY", Currency.USD)
+        activity = [
+            Trade(
+                date=datetime(2019, 1, 1),
+                instrument=spy,
+                quantity=Decimal(10),
+                amount=Cash(currency=Currency.USD, quantity=Decimal("-2500")),
+                fees=Cash(currency=Currency.USD, quantity=Decimal("1")),
+                flags=TradeFlags.OPEN,
+            ),
+            CashPayment(
+                date=datetime(2019, 3, 1),
+                instrument=spy,
+                proceeds=Cash(currency=Currency.USD, quantity=Decimal("12")),
+            ),
+            Trade(
+                date=datetime(2019, 6, 1),
+                instrument=spy,
+                quantity=Decimal(-4),
+                amount=Cash(currency=Currency.USD, quantity=Decimal("1100")),
+                fees=Cash(currency=Currency.USD, quantity=Decimal("1")),
+                flags=TradeFlags.CLOSE,
+            ),
+        ]
+
+        df = timelines_to_dataframe(compactTimelinesForAllSymbols(activity))
+        self.assertEqual(list(df["symbol"]), ["SPY", "SPY", "SPY"])
+        self.assertEqual(list(df["instrument"]), ["SPY", None, "SPY"])
+        self.assertEqual(list(df["position"]), [Decimal(10), None, Decimal(6)])
+        self.assertEqual(
+            list(df["realizedProfit"]),
+            [Decimal("-2501"), Decimal("-2489"), Decimal("-1390")],
+        )
+        self.assertEqual(list(df["currency"]), ["USD", "USD", "USD"])
+
+    def test_positionsToHistoryOmitsFailedInstruments(self) -> None:
+        positions = [
+            Position(
+                instrument=Stock(symbol, Currency.USD),
+                quantity=Decimal(10),
+                costBasis=helpers.cashUSD(Decimal(100)),
+            )
+            for symbol in ["SPY", "MISSING", "VT"]
+        ]
+        spyBars = barsForPrices([1.0, 2.0], [1.0, 2.0])
+        vtBars = barsForPrices([3.0, 4.0], [3.0, 4.0])
+        provider = BarsDataProvider({"SPY": spyBars, "VT": vtBars})
+
+        frame = positions_to_dataframe(positions)
+        with self.assertLogs(level="WARNING") as logs:
+            found, foundFrame, history = positions_to_history(
+                provider, positions, frame
+            )
+
+        self.assertEqual(found, [positions[0], positions[2]])
+        self.assertEqual(list(foundFrame.index), [0, 2])
+        self.assertEqual(len(history), 2)
+        self.assertIs(history[0], spyBars)
+        self.assertIs(history[1], vtBars)
+        self.assertIn("MISSING", logs.output[0])
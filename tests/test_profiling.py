@@ -0,0 +1,126 @@
+import io
+import json
+import os
+import pstats
+import tempfile
+import tracemalloc
+import unittest
+from typing import Iterator, List
+
+from bankroll.interface.profiling import Profiler, StageTiming
+
+
+# Returns a clock which advances by one second on each reading.
+def fakeClock() -> Iterator[float]:
+    now = 0.0
+    while True:
+        yield now
+        now += 1.0
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self) -> None:
+        clock = fakeClock()
+        self.profiler = Profiler(clock=lambda: next(clock))
+
+    def testDisabledRecordsNothing(self) -> None:
+        profiler = Profiler(enabled=False)
+        profiler.start()
+        with profiler.stage("nothing"):
+            pass
+        profiler.stop()
+
+        self.assertFalse(profiler.enabled)
+        self.assertEqual(profiler.stages, [])
+        self.assertIsNone(profiler.summary()["totalSeconds"])
+
+    def testStagesRecordedInOrder(self) -> None:
+        self.profiler.start()
+        with self.profiler.stage("first"):
+            pass
+        with self.profiler.stage("second"):
+            pass
+        self.profiler.stop()
+
+        self.assertEqual([s.name for s in self.profiler.stages], ["first", "second"])
+        self.assertEqual([s.seconds for s in self.profiler.stages], [1.0, 1.0])
+        self.assertEqual(self.profiler.summary()["totalSeconds"], 5.0)
+
+    def testStageRecordedOnException(self) -> None:
+        self.profiler.start()
+        with self.assertRaises(ValueError):
+            with self.profiler.stage("failing"):
+                raise ValueError()
+        self.profiler.stop()
+
+        self.assertEqual([s.name for s in self.profiler.stages], ["failing"])
+
+    def testRecordedStages(self) -> None:
+        self.profiler.start()
+        self.profiler.record("elsewhere", 2.5)
+        self.profiler.stop()
+
+        self.assertEqual(
+            self.profiler.stages,
+            [StageTiming(name="elsewhere", seconds=2.5, peakMemoryBytes=None)],
+        )
+
+        profiler = Profiler(enabled=False)
+        profiler.record("ignored", 1.0)
+        self.assertEqual(profiler.stages, [])
+
+    def testSummaryIsJSON(self) -> None:
+        self.profiler.start()
+        with self.profiler.stage("only"):
+            pass
+        self.profiler.stop()
+
+        output = io.StringIO()
+        self.profiler.writeSummary(output)
+        summary = json.loads(output.getvalue())
+
+        self.assertEqual(summary["totalSeconds"], 3.0)
+        self.assertIsNone(summary["peakMemoryBytes"])
+        self.assertIsNone(summary["profileDump"])
+        self.assertEqual(
+            summary["stages"],
+            [{"name": "only", "seconds": 1.0, "peakMemoryBytes": None}],
+        )
+
+    def testMemoryNotTrackedByDefault(self) -> None:
+        self.profiler.start()
+        self.assertFalse(tracemalloc.is_tracing())
+        with self.profiler.stage("allocate"):
+            data: List[bytes] = [bytes(10 ** 6)]
+            del data
+        self.profiler.stop()
+
+        self.assertIsNone(self.profiler.summary()["peakMemoryBytes"])
+
+    def testPeakMemoryTracked(self) -> None:
+        profiler = Profiler(traceMemory=True)
+        profiler.start()
+        with profiler.stage("allocate"):
+            data: List[bytes] = [bytes(10 ** 6)]
+            del data
+        profiler.stop()
+
+        peak = profiler.summary()["peakMemoryBytes"]
+        self.assertIsNotNone(peak)
+        self.assertGreaterEqual(peak, 10 ** 6)
+
+    def testProfileDumped(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bankroll.prof")
+            profiler = Profiler(dumpPath=path)
+            profiler.start()
+            with profiler.stage("sort"):
+                sorted(range(1000), reverse=True)
+            profiler.stop()
+
+            self.assertEqual(profiler.summary()["profileDump"], path)
+            self.assertGreater(pstats.Stats(path).total_calls, 0)  # type: ignore
+
+
+if __name__ == "__main__":
+    unittest.main()
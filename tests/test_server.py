@@ -0,0 +1,184 @@
+import io
+import sys
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stdout
+from pathlib import Path
+from unittest import mock
+
+from bankroll.broker import AccountAggregator
+from bankroll.interface.__main__ import main
+from bankroll.interface.server import (
+    BankrollService,
+    ServerError,
+    decodeBalance,
+    makeServer,
+    parseAddress,
+    requestCommand,
+)
+from tests import helpers
+
+
+class TestParseAddress(unittest.TestCase):
+    def test_hostAndPort(self) -> None:
+        self.assertEqual(parseAddress("localhost:8080"), ("localhost", 8080))
+        self.assertEqual(parseAddress("http://127.0.0.1:80/"), ("127.0.0.1", 80))
+        self.assertEqual(parseAddress(":8080"), ("localhost", 8080))
+
+    def test_socketPath(self) -> None:
+        self.assertEqual(parseAddress("/tmp/bankroll.sock"), Path("/tmp/bankroll.sock"))
+        self.assertEqual(parseAddress("bankroll.sock"), Path("bankroll.sock"))
+
+
+class TestBankrollService(unittest.TestCase):
+    def setUp(self) -> None:
+        self.accounts = AccountAggregator.fromSettings(
+            helpers.fixtureSettings, lenient=False
+        )
+        self.service = BankrollService(self.accounts)
+
+    def test_positions(self) -> None:
+        result = self.service.positions(realizedBasis="true")
+        positions = result["positions"]
+
+        self.assertEqual(len(positions), len(list(self.accounts.positions())))
+        stocks = [p for p in positions if p["instrument"]["type"] == "Stock"]
+        self.assertTrue(all("realizedBasis" in p for p in stocks))
+        self.assertNotIn("marketValue", positions[0])
+
+    def test_activityIsParsedOnce(self) -> None:
+        first = self.service.activity()
+        activity = self.service.allActivity
+        second = self.service.activity()
+
+        self.assertEqual(first, second)
+        self.assertIs(self.service.allActivity, activity)
+        self.assertEqual(len(first["activity"]), len(list(self.accounts.activity())))
+
+    def test_balances(self) -> None:
+        cash = self.service.balances()["cash"]
+        self.assertEqual(
+            {c["currency"] for c in cash},
+            {c.name for c in self.accounts.balance().cash.keys()},
+        )
+        self.assertEqual(
+            decodeBalance(self.service.balances()), self.accounts.balance()
+        )
+
+    def test_timeline(self) -> None:
+        timelines = self.service.timeline(all=True)["timelines"]
+        self.assertTrue(timelines)
+
+        symbol = next(iter(timelines))
+        self.assertEqual(
+            self.service.timeline(symbol=symbol)["timelines"],
+            {symbol: timelines[symbol]},
+        )
+
+        with self.assertRaises(ServerError):
+            self.service.timeline()
+
+    def test_invalidRequests(self) -> None:
+        with self.assertRaises(ServerError) as context:
+            self.service.handle("trade", {})
+        self.assertEqual(context.exception.status, 404)
+
+        with self.assertRaises(ServerError) as context:
+            self.service.handle("balances", {"symbol": "SPY"})
+        self.assertEqual(context.exception.status, 400)
+
+
+class TestServer(unittest.TestCase):
+    def setUp(self) -> None:
+        accounts = AccountAggregator.fromSettings(
+            helpers.fixtureSettings, lenient=False
+        )
+        self.service = BankrollService(accounts)
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_unixSocket(self) -> None:
+        address = Path(self.directory.name) / "bankroll.sock"
+        server = makeServer(self.service, address)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            self.assertEqual(
+                requestCommand(address, "balances"), self.service.balances()
+            )
+            self.assertEqual(
+                requestCommand(address, "positions", {"realizedBasis": True}),
+                self.service.positions(realizedBasis=True),
+            )
+
+            with self.assertRaises(ServerError) as context:
+                requestCommand(address, "timeline")
+            self.assertEqual(context.exception.status, 400)
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        self.assertFalse(address.exists())
+
+    def test_staleSocketIsReplaced(self) -> None:
+        address = Path(self.directory.name) / "bankroll.sock"
+        makeServer(self.service, address).socket.close()
+        self.assertTrue(address.exists())
+
+        server = makeServer(self.service, address)
+        with self.assertRaises(OSError):
+            makeServer(self.service, address)
+
+        server.server_close()
+
+    def test_tcp(self) -> None:
+        server = makeServer(self.service, ("127.0.0.1", 0))
+        address = ("127.0.0.1", server.server_address[1])
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            self.assertEqual(
+                requestCommand(address, "activity"), self.service.activity()
+            )
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    def test_commandLineForwardsToServer(self) -> None:
+        address = Path(self.directory.name) / "bankroll.sock"
+        server = makeServer(self.service, address)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            argv = [
+                "bankroll",
+                "--server",
+                "--server-address",
+                str(address),
+                "positions",
+                "--realized-basis",
+            ]
+            output = io.StringIO()
+            with mock.patch.object(sys, "argv", argv), redirect_stdout(output):
+                main()
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        positions = self.service.positions(realizedBasis=True)["positions"]
+        lines = output.getvalue().splitlines()
+        self.assertEqual(
+            [l for l in lines if not l.startswith("\t")],
+            [p["description"] for p in positions],
+        )
+        self.assertIn("\tRealized basis:", output.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
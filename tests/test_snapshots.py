@@ -0,0 +1,209 @@
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from typing import Dict
+from unittest.mock import patch
+
+from bankroll.broker import AccountAggregator
+from bankroll.broker.configuration import Settings
+from bankroll.model import AccountBalance
+from bankroll.interface.profiling import Profiler
+from bankroll.interface.snapshots import (
+    AccountSnapshot,
+    FileFingerprint,
+    SnapshotAccount,
+    SnapshotCache,
+    _brokerVersion,
+    loadAccounts,
+    snapshotSource,
+)
+from tests import helpers
+
+import bankroll.brokers.fidelity as fidelity
+
+
+class TestSnapshotCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = SnapshotCache(os.path.join(self.directory.name, "snapshots"))
+
+        # Copy fixtures, so they can be modified.
+        self.settings: Dict[Settings, str] = {}
+        for key, value in helpers.fixtureSettings.items():
+            path = os.path.join(self.directory.name, os.path.basename(value))
+            shutil.copyfile(value, path)
+            self.settings[key] = path
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def assertSameData(
+        self, accounts: AccountAggregator, expected: AccountAggregator
+    ) -> None:
+        self.assertEqual(list(accounts.positions()), list(expected.positions()))
+        self.assertEqual(list(accounts.activity()), list(expected.activity()))
+        self.assertEqual(accounts.balance(), expected.balance())
+
+    def test_unchangedSourcesLoadFromSnapshots(self) -> None:
+        expected = AccountAggregator.fromSettings(self.settings, lenient=False)
+
+        first = loadAccounts(self.settings, lenient=False, cache=self.cache)
+        self.assertFalse(any(isinstance(a, SnapshotAccount) for a in first.accounts))
+        self.assertSameData(first, expected)
+
+        second = loadAccounts(self.settings, lenient=False, cache=self.cache)
+        self.assertTrue(all(isinstance(a, SnapshotAccount) for a in second.accounts))
+        self.assertEqual(len(second.accounts), len(first.accounts))
+        self.assertSameData(second, expected)
+
+        stats = self.cache.stats()
+        self.assertEqual(stats.snapshots, len(first.accounts))
+        self.assertEqual(stats.hits, len(first.accounts))
+        self.assertEqual(stats.misses, len(first.accounts))
+
+    def test_changedFilesAreParsedAgain(self) -> None:
+        loadAccounts(self.settings, lenient=False, cache=self.cache)
+
+        path = Path(self.settings[fidelity.Settings.POSITIONS])
+        lines = path.read_text().splitlines(keepends=True)
+        path.write_text("".join(line for line in lines if "ROBO" not in line))
+
+        accounts = loadAccounts(self.settings, lenient=False, cache=self.cache)
+        reloaded = [a for a in accounts.accounts if not isinstance(a, SnapshotAccount)]
+        self.assertEqual([type(a) for a in reloaded], [fidelity.FidelityAccount])
+        self.assertNotIn("ROBO", [p.instrument.symbol for p in accounts.positions()])
+
+    def test_touchedFilesAreStillReused(self) -> None:
+        loadAccounts(self.settings, lenient=False, cache=self.cache)
+        os.utime(self.settings[fidelity.Settings.POSITIONS], (0, 0))
+
+        accounts = loadAccounts(self.settings, lenient=False, cache=self.cache)
+        self.assertTrue(all(isinstance(a, SnapshotAccount) for a in accounts.accounts))
+
+    def test_snapshotsAreKeyedBySettings(self) -> None:
+        loadAccounts(self.settings, lenient=False, cache=self.cache)
+        accounts = loadAccounts(self.settings, lenient=True, cache=self.cache)
+
+        self.assertFalse(any(isinstance(a, SnapshotAccount) for a in accounts.accounts))
+
+    def test_relativePathsFromAnotherDirectoryAreParsedAgain(self) -> None:
+        relativeSettings = {
+            key: os.path.basename(value) for key, value in self.settings.items()
+        }
+
+        other = os.path.join(self.directory.name, "other")
+        os.mkdir(other)
+        for value in self.settings.values():
+            shutil.copy(value, other)
+
+        path = Path(other, os.path.basename(self.settings[fidelity.Settings.POSITIONS]))
+        lines = path.read_text().splitlines(keepends=True)
+        path.write_text("".join(line for line in lines if "ROBO" not in line))
+
+        cwd = os.getcwd()
+        try:
+            os.chdir(self.directory.name)
+            loadAccounts(relativeSettings, lenient=False, cache=self.cache)
+
+            os.chdir(other)
+            accounts = loadAccounts(relativeSettings, lenient=False, cache=self.cache)
+        finally:
+            os.chdir(cwd)
+
+        self.assertFalse(any(isinstance(a, SnapshotAccount) for a in accounts.accounts))
+        self.assertNotIn("ROBO", [p.instrument.symbol for p in accounts.positions()])
+
+    def test_newFileInDirectoryInvalidatesSnapshot(self) -> None:
+        statements = Path(self.directory.name, "statements")
+        statements.mkdir()
+        Path(statements, "2019.csv").write_text("2019")
+        settings: Dict[Settings, str] = {fidelity.Settings.POSITIONS: str(statements)}
+
+        source = snapshotSource(fidelity.FidelityAccount, settings, lenient=False)
+        assert source is not None
+        key, paths = source
+        self.cache.store(
+            key,
+            AccountSnapshot(
+                source="FidelityAccount",
+                files=[FileFingerprint.ofFile(p) for p in paths],
+                positions=[],
+                activity=[],
+                balance=AccountBalance(cash={}),
+            ),
+        )
+        self.assertIsNotNone(self.cache.load(key, paths))
+
+        Path(statements, "2020.csv").write_text("2020")
+        source = snapshotSource(fidelity.FidelityAccount, settings, lenient=False)
+        assert source is not None
+        newKey, newPaths = source
+        self.assertEqual(len(newPaths), 2)
+        self.assertIsNone(self.cache.load(newKey, newPaths))
+
+        # Even under the old key, a snapshot of different files is not used.
+        self.assertIsNone(self.cache.load(key, newPaths))
+
+    def test_snapshotsAreKeyedByBrokerVersion(self) -> None:
+        brokerVersion = _brokerVersion("bankroll.brokers.fidelity")
+        self.assertIsNotNone(brokerVersion)
+
+        source = snapshotSource(fidelity.FidelityAccount, self.settings, lenient=False)
+        assert source is not None
+        key, _ = source
+        self.assertIn(f'"{brokerVersion}"', key)
+
+    def test_parallelLoadMatchesSequential(self) -> None:
+        expected = AccountAggregator.fromSettings(self.settings, lenient=False)
+        profiler = Profiler()
+
+        accounts = loadAccounts(
+            self.settings,
+            lenient=False,
+            cache=self.cache,
+            profiler=profiler,
+            parallel=True,
+        )
+        self.assertSameData(accounts, expected)
+        self.assertTrue(all(isinstance(a, SnapshotAccount) for a in accounts.accounts))
+        self.assertEqual(
+            [a.snapshot.source for a in accounts.accounts],  # type: ignore
+            [type(a).__name__ for a in expected.accounts],
+        )
+        self.assertLessEqual(
+            {f"load {type(a).__name__}" for a in expected.accounts},
+            {s.name for s in profiler.stages},
+        )
+        self.assertEqual(self.cache.stats().snapshots, len(expected.accounts))
+
+        # Snapshots stored by worker processes are reused.
+        accounts = loadAccounts(
+            self.settings, lenient=False, cache=self.cache, parallel=True
+        )
+        self.assertSameData(accounts, expected)
+        self.assertEqual(self.cache.stats().hits, len(expected.accounts))
+
+    def test_accountsNotLoadableFromSettingsAreSkipped(self) -> None:
+        with patch.object(
+            fidelity.FidelityAccount, "fromSettings", side_effect=NotImplementedError
+        ):
+            expected = AccountAggregator.fromSettings(self.settings, lenient=False)
+            accounts = loadAccounts(self.settings, lenient=False, cache=self.cache)
+
+        self.assertNotIn(fidelity.FidelityAccount, [type(a) for a in expected.accounts])
+        self.assertEqual(len(accounts.accounts), len(expected.accounts))
+        self.assertSameData(accounts, expected)
+
+    def test_withoutCache(self) -> None:
+        accounts = loadAccounts(self.settings, lenient=False)
+        self.assertFalse(any(isinstance(a, SnapshotAccount) for a in accounts.accounts))
+        self.assertEqual(self.cache.stats().snapshots, 0)
+
+    def test_clear(self) -> None:
+        loadAccounts(self.settings, lenient=False, cache=self.cache)
+        self.assertEqual(self.cache.clear(), 4)
+
+        accounts = loadAccounts(self.settings, lenient=False, cache=self.cache)
+        self.assertFalse(any(isinstance(a, SnapshotAccount) for a in accounts.accounts))
@@ -0,0 +1,226 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from typing import List
+
+fixtures = Path(__file__).resolve().parent
+
+# Modules of bankroll.analysis which import pandas, pyfolio, and friends, and
+# so should only be loaded on first use.
+lazyModules = [
+    "bankroll.analysis.caching",
+    "bankroll.analysis.frame",
+    "bankroll.analysis.history",
+    "bankroll.analysis.panel",
+    "bankroll.analysis.portfolio",
+]
+
+# Modules which only some commands (like serve, watch, and --profile) need.
+commandModules = [
+    "bankroll.interface.server",
+    "bankroll.interface.watch",
+    "http.server",
+    "cProfile",
+    "tracemalloc",
+]
+
+# Records every module of bankroll.analysis and bankroll.interface which
+# imports pandas or pyfolio. Whether pandas is in sys.modules can't be checked
+# directly, as bankroll.model and some broker plugins import it whenever it is
+# installed.
+recordPandasImporters = """
+import builtins
+pandasImporters = set()
+_import = builtins.__import__
+def _recordingImport(name, globals=None, *args, **kwargs):
+    importer = (globals or {}).get("__name__", "")
+    if name.partition(".")[0] in ("pandas", "pyfolio") and importer.startswith(
+        ("bankroll.analysis", "bankroll.interface")
+    ):
+        pandasImporters.add(importer)
+    return _import(name, globals, *args, **kwargs)
+builtins.__import__ = _recordingImport
+"""
+
+# Loads every fixture, without reusing snapshots, as the slowest common case.
+fixtureArguments = [
+    "--no-cache",
+    "--fidelity-positions",
+    str(fixtures / "fidelity_positions.csv"),
+    "--fidelity-transactions",
+    str(fixtures / "fidelity_transactions.csv"),
+    "--schwab-positions",
+    str(fixtures / "schwab_positions.CSV"),
+    "--schwab-transactions",
+    str(fixtures / "schwab_transactions.CSV"),
+    "--vanguard-statement",
+    str(fixtures / "vanguard_positions_and_transactions.csv"),
+    "--ibkr-trades",
+    str(fixtures / "ibkr_trades.xml"),
+    "--ibkr-activity",
+    str(fixtures / "ibkr_activity.xml"),
+]
+
+# Wall-clock budgets in seconds, which can be overridden through the
+# environment. Timing depends on the machine, so these are only checked when
+# BANKROLL_STARTUP_BUDGETS is set; the import checks below catch most
+# regressions (like eagerly importing pyfolio) deterministically.
+checkBudgets = bool(os.getenv("BANKROLL_STARTUP_BUDGETS"))
+helpBudget = float(os.getenv("BANKROLL_HELP_BUDGET", default="3.0"))
+balancesBudget = float(os.getenv("BANKROLL_BALANCES_BUDGET", default="6.0"))
+
+# Each command is timed this many times, and the fastest run is compared
+# against the budget, to reduce noise from other processes.
+runs = 3
+
+
+class TestStartup(unittest.TestCase):
+    def setUp(self) -> None:
+        # Keep any user configuration and caches out of the tests.
+        self.home = tempfile.TemporaryDirectory()
+        self.env = dict(
+            os.environ,
+            HOME=self.home.name,
+            # Import this checkout of bankroll, even from another directory.
+            PYTHONPATH=os.pathsep.join(
+                [str(fixtures.parent), os.getenv("PYTHONPATH", "")]
+            ),
+            PYTHONWARNINGS="ignore",
+        )
+
+    def tearDown(self) -> None:
+        self.home.cleanup()
+
+    def runPython(self, arguments: List[str]) -> str:
+        result = subprocess.run(
+            [sys.executable] + arguments,
+            cwd=self.home.name,
+            env=self.env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        self.assertEqual(result.returncode, 0, msg=result.stderr)
+        return str(result.stdout)
+
+    def fastestRun(self, arguments: List[str]) -> float:
+        times: List[float] = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            self.runPython(["-m", "bankroll.interface"] + arguments)
+            times.append(time.perf_counter() - started)
+
+        return min(times)
+
+    @unittest.skipUnless(checkBudgets, "BANKROLL_STARTUP_BUDGETS is not set")
+    def testHelpWithinBudget(self) -> None:
+        seconds = self.fastestRun(["--help"])
+        self.assertLess(
+            seconds,
+            helpBudget,
+            msg=f"`bankroll --help` took {seconds:.2f}s (budget: {helpBudget}s)",
+        )
+
+    @unittest.skipUnless(checkBudgets, "BANKROLL_STARTUP_BUDGETS is not set")
+    def testBalancesWithinBudget(self) -> None:
+        seconds = self.fastestRun(fixtureArguments + ["balances"])
+        self.assertLess(
+            seconds,
+            balancesBudget,
+            msg=f"`bankroll balances` took {seconds:.2f}s (budget: {balancesBudget}s)",
+        )
+
+    def testCommandModulesOnlyImportedWhenUsed(self) -> None:
+        arguments = fixtureArguments + ["balances"]
+        loaded = self.runPython(
+            [
+                "-c",
+                "import sys; from bankroll.interface.__main__ import main; "
+                + f"sys.argv = ['bankroll'] + {arguments!r}; main(); "
+                + f"print(' '.join(m for m in {commandModules!r} if m in sys.modules))",
+            ]
+        )
+
+        self.assertEqual(loaded.splitlines()[-1].split(), [])
+
+    def testPlainCommandsDoNotImportPandas(self) -> None:
+        for arguments in [["--help"], fixtureArguments + ["balances"]]:
+            with self.subTest(arguments=arguments):
+                output = self.runPython(
+                    [
+                        "-c",
+                        recordPandasImporters
+                        + "import sys; from bankroll.interface.__main__ import main\n"
+                        + f"sys.argv = ['bankroll'] + {arguments!r}\n"
+                        + "try:\n    main()\nexcept SystemExit:\n    pass\n"
+                        + "print(' '.join(sorted(pandasImporters)))",
+                    ]
+                )
+
+                self.assertEqual(output.splitlines()[-1].split(), [])
+
+    def testInterfaceDoesNotImportAnalysisDependencies(self) -> None:
+        loaded = self.runPython(
+            [
+                "-c",
+                "import sys, bankroll.interface; "
+                + f"print(' '.join(m for m in {lazyModules!r} if m in sys.modules))",
+            ]
+        ).split()
+
+        self.assertEqual(loaded, [])
+
+    def testUnconfiguredBrokersNotImported(self) -> None:
+        arguments = [
+            "bankroll",
+            "--no-cache",
+            "--fidelity-positions",
+            str(fixtures / "fidelity_positions.csv"),
+            "balances",
+        ]
+
+        output = self.runPython(
+            [
+                "-c",
+                "import sys; from bankroll.interface.__main__ import main; "
+                + f"sys.argv = {arguments!r}; main(); "
+                + "print(' '.join(sorted(m for m in sys.modules if m.startswith(('bankroll.brokers.', 'ib_insync')))))",
+            ]
+        )
+
+        loaded = output.splitlines()[-1].split()
+        self.assertIn("bankroll.brokers.fidelity", loaded)
+        self.assertNotIn("bankroll.brokers.ibkr", loaded)
+        self.assertNotIn("ib_insync", loaded)
+
+    def testBrokersLoadedForAccountAggregator(self) -> None:
+        loaded = self.runPython(
+            [
+                "-c",
+                "import sys, bankroll.interface as i; "
+                + "print('bankroll.brokers.fidelity' in sys.modules); "
+                + "i.AccountAggregator.allSettings(i.loadConfig([])); "
+                + "print('bankroll.brokers.fidelity' in sys.modules)",
+            ]
+        )
+
+        self.assertEqual(loaded.split(), ["False", "True"])
+
+    def testAnalysisLoadedOnFirstUse(self) -> None:
+        loaded = self.runPython(
+            [
+                "-c",
+                "import sys, bankroll.interface as i; i.positions_to_returns; "
+                + "print('bankroll.analysis.portfolio' in sys.modules)",
+            ]
+        )
+
+        self.assertEqual(loaded.strip(), "True")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from typing import Dict
+
+import bankroll.analysis as analysis
+from bankroll.broker import AccountAggregator
+from bankroll.broker.configuration import Settings
+from bankroll.interface.watch import AccountWatcher
+from tests import helpers
+
+import bankroll.brokers.fidelity as fidelity
+
+
+class TestAccountWatcher(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+
+        # Copy fixtures, so they can be modified.
+        self.settings: Dict[Settings, str] = {}
+        for key, value in helpers.fixtureSettings.items():
+            path = os.path.join(self.directory.name, os.path.basename(value))
+            shutil.copyfile(value, path)
+            self.settings[key] = path
+
+        self.watcher = AccountWatcher(self.settings, lenient=False)
+        self.transactions = Path(self.settings[fidelity.Settings.TRANSACTIONS])
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def removeLines(self, path: Path, text: str) -> None:
+        lines = path.read_text().splitlines(keepends=True)
+        path.write_text("".join(line for line in lines if text not in line))
+
+    def test_loadsSameDataAsAggregator(self) -> None:
+        expected = AccountAggregator.fromSettings(self.settings, lenient=False)
+        accounts = self.watcher.accounts
+
+        self.assertEqual(list(accounts.positions()), list(expected.positions()))
+        self.assertEqual(list(accounts.activity()), list(expected.activity()))
+        self.assertEqual(
+            sorted(self.watcher.watchedPaths), sorted(map(Path, self.settings.values()))
+        )
+
+    def test_unchangedFilesAreNotReloaded(self) -> None:
+        self.assertIsNone(self.watcher.poll())
+
+    def test_changedSourceIsReloaded(self) -> None:
+        self.removeLines(self.transactions, "NVDA")
+
+        change = self.watcher.poll()
+        assert change is not None
+        self.assertEqual(change.sources, ["FidelityAccount"])
+        self.assertEqual(change.added, [])
+        self.assertEqual(len(change.removed), 1)
+        self.assertEqual(change.symbols, {"NVDA"})
+
+        self.assertIsNone(self.watcher.poll())
+
+    def test_touchedSourceHasNoChangedSymbols(self) -> None:
+        os.utime(self.transactions, (0, 0))
+
+        change = self.watcher.poll()
+        assert change is not None
+        self.assertEqual(change.sources, ["FidelityAccount"])
+        self.assertEqual(change.symbols, frozenset())
+
+    def test_updatesMatchFullAnalysis(self) -> None:
+        self.removeLines(self.transactions, "SPY")
+
+        change = self.watcher.poll()
+        assert change is not None
+        self.assertIn("SPY", change.symbols)
+
+        activity = list(self.watcher.accounts.activity())
+        for update in self.watcher.updates(change.symbols):
+            self.assertEqual(
+                update.realizedBasis,
+                analysis.realizedBasisForSymbol(update.symbol, activity),
+            )
+            assert update.timeline is not None
+            self.assertEqual(
+                list(update.timeline),
+                list(analysis.timelineForSymbol(update.symbol, activity)),
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()